@@ -0,0 +1,117 @@
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from ibm2_aligner import FastAlignModel, ParallelCorpus
+
+
+# ====== CORPUS ====== #
+def make_corpus(n_sentences, vocab_size, seed):
+    """
+    Synthetic parallel corpus with known word alignments: every source word has one
+    translation (zipfian vocabulary), neighbouring words are sometimes swapped and
+    untranslated function words are inserted on both sides.
+    """
+    rng = random.Random(seed)
+    vocab = [f"s{k}" for k in range(vocab_size)]
+    weights = [1 / (k + 1) for k in range(vocab_size)]
+    lexicon = {word: f"t{k}" for k, word in enumerate(rng.sample(vocab, vocab_size))}
+
+    pairs, gold = [], []
+    for _ in range(n_sentences):
+        src = rng.choices(vocab, weights, k = rng.randint(5, 40))
+        order = list(range(len(src)))
+        for k in range(len(order) - 1):
+            if rng.random() < .15:
+                order[k], order[k + 1] = order[k + 1], order[k]
+
+        trg, links = [], set()
+        for i in order:
+            if rng.random() < .1:
+                trg.append("de")
+            links.add((i, len(trg)))
+            trg.append(lexicon[src[i]])
+        # source-only words, unaligned
+        for _ in range(rng.randint(0, 2)):
+            k = rng.randint(0, len(src))
+            src.insert(k, "the")
+            links = {(i + (i >= k), j) for i, j in links}
+
+        pairs.append((src, trg))
+        gold.append(links)
+    return pairs, gold
+
+
+# ====== SCORING ====== #
+def score(predicted, gold):
+    # precision, recall and AER with every gold link taken as sure
+    correct = sum(len(set(p) & g) for p, g in zip(predicted, gold))
+    n_predicted = sum(len(set(p)) for p in predicted)
+    n_gold = sum(len(g) for g in gold)
+    precision = correct / max(n_predicted, 1)
+    recall = correct / max(n_gold, 1)
+    aer = 1 - 2 * correct / max(n_predicted + n_gold, 1)
+    return precision, recall, aer
+
+def report(name, seconds, n_sentences, forward, reverse, gold):
+    union = [set(f) | set(r) for f, r in zip(forward, reverse)]
+    intersect = [set(f) & set(r) for f, r in zip(forward, reverse)]
+    print(f"{name:>12}: {seconds:.2f}s ({n_sentences / seconds:,.0f} pairs/sec, both directions)")
+    for label, links in (("forward", forward), ("reverse", reverse), ("union", union), ("intersect", intersect)):
+        precision, recall, aer = score(links, gold)
+        print(f"{'':>14}{label:<10} P={precision:.3f} R={recall:.3f} AER={aer:.3f}")
+
+
+# ====== ALIGNERS ====== #
+def run_numpy(pairs, iterations):
+    model = FastAlignModel(iterations = iterations)
+    corpus = ParallelCorpus(pairs)
+    return model.align(corpus), model.align(corpus, reverse = True)
+
+def run_fast_align(pairs, iterations, binary):
+    def parse(output):
+        return [[tuple(int(k) for k in link.split("-")) for link in line.split()] for line in output.splitlines()]
+
+    with tempfile.NamedTemporaryFile("w", suffix = ".merged", delete = False) as f:
+        for src, trg in pairs:
+            f.write(" ".join(src) + " ||| " + " ".join(trg) + "\n")
+    try:
+        command = [binary, "-i", f.name, "-d", "-o", "-v", "-I", str(iterations)]
+        forward = subprocess.run(command, capture_output = True, text = True, check = True).stdout
+        reverse = subprocess.run(command + ["-r"], capture_output = True, text = True, check = True).stdout
+    finally:
+        os.remove(f.name)
+    return parse(forward), parse(reverse)
+
+
+def main(n_sentences, vocab_size, iterations, fast_align, seed):
+
+    pairs, gold = make_corpus(n_sentences, vocab_size, seed)
+    print(f"{n_sentences:,} pairs, {sum(len(s) + len(t) for s, t in pairs):,} tokens\n")
+
+    start_time = time.perf_counter()
+    forward, reverse = run_numpy(pairs, iterations)
+    report("numpy", time.perf_counter() - start_time, n_sentences, forward, reverse, gold)
+
+    if fast_align:
+        start_time = time.perf_counter()
+        forward, reverse = run_fast_align(pairs, iterations, fast_align)
+        report("fast_align", time.perf_counter() - start_time, n_sentences, forward, reverse, gold)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Accuracy and throughput of the NumPy aligner on a synthetic parallel corpus")
+    parser.add_argument("-n", "--sentences", help = "Sentence pairs", default = 20_000)
+    parser.add_argument("--vocab", help = "Source vocabulary size", default = 2_000)
+    parser.add_argument("-I", "--iterations", help = "EM iterations", default = 5)
+    parser.add_argument("--fast-align", help = "Path to a fast_align binary to compare with")
+    parser.add_argument("--seed", help = "Random seed", default = 0)
+
+    args = parser.parse_args()
+
+    main(int(args.sentences), int(args.vocab), int(args.iterations), args.fast_align, int(args.seed))
@@ -0,0 +1,65 @@
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from make_dnts_algorithm3 import make_tuple
+from alignment_cache import build_cache, is_fresh, open_alignment_cache
+from synthetic_corpus import make_corpus, format_alignments, timeit
+
+
+def main(n_sentences, length, repeat, seed):
+
+    with tempfile.TemporaryDirectory() as tmp:
+        alignments = os.path.join(tmp, "sym.align")
+        with open(alignments, "w") as f:
+            for _, _, links in make_corpus(n_sentences, length, seed = seed):
+                f.write(format_alignments(links) + "\n")
+
+        def parse_text():
+            with open(alignments, "r") as f:
+                return [make_tuple(line.strip().split()) for line in f]
+
+        build = timeit(lambda: build_cache(alignments), 1)
+        cache = open_alignment_cache(alignments)
+
+        # parity: same links as make_tuple, line by line and by random access
+        expected = parse_text()
+        assert list(cache) == expected, "cached links differ from the text file"
+        lines = random.Random(seed).sample(range(len(cache)), min(len(cache), 10_000))
+        assert [cache[n] for n in lines] == [expected[n] for n in lines], "random access differs"
+
+        text = timeit(parse_text, repeat)
+        cached = timeit(lambda: list(cache), repeat)
+        random_access = timeit(lambda: [cache[n] for n in lines], repeat)
+        n_links = sum(map(len, expected))
+        print(f"{n_sentences:,} lines, {n_links:,} links: text {os.path.getsize(alignments):,} bytes, cache {os.path.getsize(alignments + '.cache'):,} bytes "
+              f"({'int16' if cache.links.format == 'h' else 'int32'} links), built in {build:.2f} s\n")
+        print(f"{'':>22} {'seconds':>9} {'lines/s':>12}")
+        print(f"{'text + make_tuple':>22} {text:>9.3f} {n_sentences / text:>12,.0f}")
+        print(f"{'cache, in order':>22} {cached:>9.3f} {n_sentences / cached:>12,.0f}")
+        print(f"{'cache, random lines':>22} {random_access:>9.3f} {len(lines) / random_access:>12,.0f}")
+
+        # any change to the alignment file invalidates the cache
+        os.utime(alignments, ns = (time.time_ns(), time.time_ns() + 10**9))
+        assert not is_fresh(alignments), "cache not invalidated by a new mtime"
+        cache.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Check the binary alignment cache against the text alignments and compare their parsing speed")
+    parser.add_argument("-n", "--sentences", help = "Alignment lines", default = 100_000)
+    parser.add_argument("-l", "--length", help = "Average sentence length (tokens)", default = 25)
+    parser.add_argument("-r", "--repeat", help = "Repetitions, best time is reported", default = 3)
+    parser.add_argument("--seed", help = "Random seed", default = 0)
+
+    args = parser.parse_args()
+
+    main(int(args.sentences),
+         int(args.length),
+         int(args.repeat),
+         int(args.seed))
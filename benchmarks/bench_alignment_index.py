@@ -0,0 +1,65 @@
+import os
+import sys
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from make_dnts_algorithm3 import AlignmentIndex
+from synthetic_corpus import make_corpus, timeit
+
+
+# ====== CORPUS ====== #
+def make_sentences(n_sentences, length, seed):
+    # (source length, target length, links) of synthetic pairs, near diagonal links with aligner noise
+    return [(len(src), len(trg), links) for src, trg, links in make_corpus(n_sentences, length, seed = seed)]
+
+
+# ====== LOOKUPS ====== #
+def legacy_lookup(src_len, trg_len, alignments):
+    # behaviour before the index: one scan of the links per token
+    src = [[tup[1] for tup in alignments if tup[0] == index] for index in range(src_len)]
+    trg = [[tup[1] for tup in alignments if tup[0] == index] for index in range(trg_len)]
+    return src, trg
+
+def index_lookup(src_len, trg_len, alignments):
+    links = AlignmentIndex(alignments, src_len, trg_len)
+    src = [links.forward(index) for index in range(src_len)]
+    trg = [links.reverse(index) for index in range(trg_len)]
+    return src, trg
+
+def run(func, corpus):
+    for src_len, trg_len, alignments in corpus:
+        func(src_len, trg_len, alignments)
+
+
+def main(lengths, n_sentences, repeat, seed):
+
+    print(f"{'length':>8} {'links':>8} {'legacy (s)':>12} {'index (s)':>12} {'speedup':>9}")
+    for length in lengths:
+        corpus = make_sentences(n_sentences, length, seed)
+
+        # sanity check: forward lookups must be identical to the old scan
+        for src_len, trg_len, alignments in corpus:
+            old, _ = legacy_lookup(src_len, trg_len, alignments)
+            new, _ = index_lookup(src_len, trg_len, alignments)
+            assert old == [list(el) for el in new], "forward links differ"
+
+        avg_links = sum(len(al) for _, _, al in corpus) / len(corpus)
+        legacy = timeit(lambda: run(legacy_lookup, corpus), repeat)
+        indexed = timeit(lambda: run(index_lookup, corpus), repeat)
+        print(f"{length:>8} {avg_links:>8.0f} {legacy:>12.4f} {indexed:>12.4f} {legacy / indexed:>8.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Compare per-token alignment scans with the precomputed alignment index")
+    parser.add_argument("-l", "--lengths", help = "Comma separated average sentence lengths", default = "25,50,100,200")
+    parser.add_argument("-n", "--sentences", help = "Sentences per length", default = 500)
+    parser.add_argument("-r", "--repeat", help = "Repetitions, best time is reported", default = 3)
+    parser.add_argument("--seed", help = "Random seed", default = 0)
+
+    args = parser.parse_args()
+
+    main([int(el) for el in args.lengths.split(",")],
+         int(args.sentences),
+         int(args.repeat),
+         int(args.seed))
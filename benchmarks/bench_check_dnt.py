@@ -0,0 +1,136 @@
+import os
+import re
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import subprocess
+from collections import Counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from synthetic_corpus import make_corpus
+
+CHECK_DNT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "utils", "check_dnt.py")
+
+
+# ====== PREVIOUS SCRIPT ====== #
+def reference_summary(ref_file, hyp_file):
+    # the counting loop of the single process check_dnt.py, whole files in memory
+    with open(ref_file, encoding = "utf-8") as r:
+        rlines = [line.strip() for line in r]
+    with open(hyp_file, encoding = "utf-8") as h:
+        hlines = [line.strip() for line in h]
+
+    rcount = hcount = mcount = mismatched = 0
+    for rl, hl in zip(rlines, hlines):
+        rdnt = sorted("".join(elem.upper().split()) for elem in re.findall(r"\${DNT0}\s*\d+", rl, flags = re.I))
+        hdnt = sorted("".join(elem.upper().split()) for elem in re.findall(r"\${DNT0}\s*\d+", hl, flags = re.I))
+        rcount += len(rdnt)
+        hcount += len(hdnt)
+        mcount += len(list((Counter(rdnt) & Counter(hdnt)).elements()))
+        mismatched += rdnt != hdnt
+    return {"lines": min(len(rlines), len(hlines)),
+            "dnt_in_ref": rcount,
+            "dnt_in_hyp": hcount,
+            "matching_dnts": mcount,
+            "precision": round(mcount / hcount, 3),
+            "recall": round(mcount / rcount, 3),
+            "mismatched_lines": mismatched}
+
+
+# ====== INPUTS ====== #
+def dnt(index, rng):
+    # the spellings a translation model produces: case, spaces before the index
+    return rng.choice(["${DNT0}", "${dnt0}", "${Dnt0}"]) + rng.choice(["", " ", "  ", "\t"]) + str(index)
+
+def write_files(directory, n_sentences, seed):
+    rng = random.Random(seed)
+    paths = {name: os.path.join(directory, name) for name in ("src", "ref", "hyp")}
+    with open(paths["src"], "w", encoding = "utf-8") as src, \
+         open(paths["ref"], "w", encoding = "utf-8", newline = "") as ref, \
+         open(paths["hyp"], "w", encoding = "utf-8", newline = "") as hyp:
+        for src_words, _, _ in make_corpus(n_sentences, seed = seed):
+            words = [word for word, _ in src_words]
+            if rng.random() < .1:
+                words.append(rng.choice(["città", "Größe", "東京"]))
+            indexes = [rng.randint(0, 12) for _ in range(rng.randint(0, 4))]
+            ref_words = words + [dnt(index, rng) for index in indexes]
+            # the hypothesis loses, adds or changes some DNTs
+            hyp_indexes = [index if rng.random() > .1 else rng.randint(0, 12) for index in indexes if rng.random() > .1]
+            hyp_indexes += [rng.randint(0, 12) for _ in range(rng.random() < .05)]
+            hyp_words = words + [dnt(index, rng) for index in hyp_indexes]
+            rng.shuffle(ref_words)
+            rng.shuffle(hyp_words)
+            src.write(" ".join(words) + "\n")
+            ref.write(" ".join(ref_words) + rng.choice(["\n", "\r\n"]))
+            hyp.write(" ".join(hyp_words) + rng.choice(["\n", "\r\n"]))
+    return paths
+
+def truncate(filename, lines, output):
+    with open(filename, encoding = "utf-8") as f, open(output, "w", encoding = "utf-8") as out:
+        for _, line in zip(range(lines), f):
+            out.write(line)
+    return output
+
+
+def run_reference(paths):
+    # the previous script in its own interpreter too, the times compare like for like
+    command = [sys.executable, "-c", f"import sys, json; sys.path.insert(0, {os.path.dirname(os.path.abspath(__file__))!r}); "
+               f"import bench_check_dnt; print(json.dumps(bench_check_dnt.reference_summary({paths['ref']!r}, {paths['hyp']!r})))"]
+    start = time.perf_counter()
+    stdout = subprocess.run(command, check = True, capture_output = True, text = True).stdout
+    return json.loads(stdout), time.perf_counter() - start
+
+def run(paths, directory, workers, chunk_size, src = None):
+    report = os.path.join(directory, "report.json")
+    command = [sys.executable, CHECK_DNT, "--ref", paths["ref"], "--hyp", paths["hyp"], "--report", report,
+               "-w", str(workers), "--chunk-size", str(chunk_size)]
+    if src:
+        command += ["--src", src]
+    start = time.perf_counter()
+    stdout = subprocess.run(command, check = True, capture_output = True, text = True).stdout
+    seconds = time.perf_counter() - start
+    with open(report, encoding = "utf-8") as f:
+        return json.load(f), stdout, seconds
+
+
+def main(n_sentences, workers, chunk_size, seed):
+
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = write_files(tmp, n_sentences, seed)
+
+        expected, reference = run_reference(paths)
+
+        print(f"{n_sentences:,} lines, {expected['dnt_in_ref']:,} DNTs in ref, {expected['mismatched_lines']:,} mismatching lines\n")
+        print(f"{'':>22} {'seconds':>9}")
+        print(f"{'previous (in memory)':>22} {reference:>9.2f}")
+        for n in workers:
+            report, stdout, seconds = run(paths, tmp, n, chunk_size, paths["src"])
+            assert {key: report[key] for key in expected} == expected, f"metrics with {n} workers differ: {report} != {expected}"
+            assert f"Precision: {expected['precision']}\nRecall: {expected['recall']}\n" in stdout, f"printed summary with {n} workers differs"
+            print(f"{f'check_dnt.py -w {n}':>22} {seconds:>9.2f}")
+
+        # a shorter --src does not cut the evaluation short
+        short_src = truncate(paths["src"], n_sentences // 2, os.path.join(tmp, "short.src"))
+        for n in workers:
+            report, stdout, _ = run(paths, tmp, n, chunk_size, short_src)
+            assert {key: report[key] for key in expected} == expected, f"metrics with a short --src and {n} workers differ"
+            assert "[Warning] --src is" in stdout, "no warning for a short --src"
+        print(f"\nmetrics identical to the previous script with {', '.join(map(str, workers))} workers, also with a shorter --src")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Check utils/check_dnt.py against the previous single process script with 1 and N workers and time them")
+    parser.add_argument("-n", "--sentences", help = "Lines of the synthetic ref/hyp files", default = 50_000)
+    parser.add_argument("-w", "--workers", help = "Comma separated worker counts", default = "1,4")
+    parser.add_argument("--chunk-size", help = "Lines sent to a worker at once", default = 5_000)
+    parser.add_argument("--seed", help = "Random seed", default = 0)
+
+    args = parser.parse_args()
+
+    main(int(args.sentences),
+         [int(el) for el in args.workers.split(",")],
+         int(args.chunk_size),
+         int(args.seed))
@@ -0,0 +1,144 @@
+import os
+import bz2
+import sys
+import gzip
+import lzma
+import time
+import random
+import argparse
+import tempfile
+from contextlib import redirect_stdout
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+import make_dnts_algorithm3 as dnts
+import pavlov_tagger_pickle
+from corpus_io import open_binary, open_text, add_suffix
+from synthetic_corpus import write_corpus, timeit
+
+
+# ====== REFERENCE CODECS ====== #
+# the standard library modules, unthreaded, to compress the inputs and read the outputs back
+def zstd_open(filename, mode):
+    import zstandard
+    f = open(filename, mode)
+    if mode == "rb":
+        return zstandard.ZstdDecompressor().stream_reader(f, closefd = True)
+    return zstandard.ZstdCompressor().stream_writer(f, closefd = True)
+
+CODECS = {".gz": gzip.open, ".xz": lzma.open, ".bz2": bz2.open, ".zst": zstd_open}
+
+def available_codecs():
+    try:
+        import zstandard
+    except ImportError:
+        print("zstandard is not installed, .zst is skipped")
+        return [".gz", ".xz", ".bz2"]
+    return list(CODECS)
+
+def compress(filename, output, ext):
+    with open(filename, "rb") as f, CODECS[ext](output, "wb") as out:
+        out.write(f.read())
+
+def decompress(filename, ext):
+    with CODECS[ext](filename, "rb") as f:
+        return f.read()
+
+def read(filename):
+    with open(filename, "rb") as f:
+        return f.read()
+
+
+# ====== RUNS ====== #
+def run_dnts(paths, augment_prob, seed):
+    # .dnts5 outputs and alignment log, compressed like the inputs
+    with redirect_stdout(open(os.devnull, "w")):
+        dnts.main(paths["source_pavlov"], paths["target_pavlov"], paths["alignments"], .2, augment_prob, 1, seed = seed)
+    return [add_suffix(paths["source_pavlov"], ".dnts5"), add_suffix(paths["target_pavlov"], ".dnts5")]
+
+def run_tagger(paths):
+    with redirect_stdout(open(os.devnull, "w")):
+        pavlov_tagger_pickle.main(paths["source"], paths["target"], 1_000_000, tagger = "standin")
+
+
+def check_streams(plain, compressed, ext, rng):
+    # reads: whole, by lines and by odd sized blocks; writes: odd sized blocks, read back by the reference codec
+    data = read(plain)
+    with open_binary(compressed, "rb") as f:
+        assert f.read() == data, f"open_binary read of {ext} differs"
+    with open_text(compressed, "r", encoding = "utf-8") as f, open(plain, encoding = "utf-8") as p:
+        assert f.readlines() == p.readlines(), f"open_text lines of {ext} differ"
+    with open_binary(compressed, "rb") as f:
+        blocks = iter(lambda: f.read(rng.randint(1, 1 << 16)), b"")
+        assert b"".join(blocks) == data, f"block reads of {ext} differ"
+
+    output = compressed + ".written" + ext
+    with open_binary(output, "wb") as out:
+        k = 0
+        while k < len(data):
+            size = rng.randint(1, 1 << 16)
+            out.write(data[k: k + size])
+            k += size
+    assert decompress(output, ext) == data, f"open_binary writes of {ext} differ"
+
+
+def main(n_sentences, augment_prob, seed):
+
+    rng = random.Random(seed)
+    codecs = available_codecs()
+    with tempfile.TemporaryDirectory() as tmp:
+        plain = write_corpus(os.path.join(tmp, "plain"), n_sentences, quirks = ["numbers", "translit", "ur"], seed = seed)
+        # the same corpus with every input compressed, before the tagger rewrites the .pavlov files
+        compressed = {}
+        for ext in codecs:
+            directory = os.path.join(tmp, ext[1:])
+            os.makedirs(directory)
+            compressed[ext] = {name: os.path.join(directory, os.path.basename(filename) + ext) for name, filename in plain.items()}
+            for name, filename in compressed[ext].items():
+                compress(plain[name], filename, ext)
+
+        start = time.perf_counter()
+        expected_dnts = [read(filename) for filename in run_dnts(plain, augment_prob, seed)]
+        dnts_seconds = {"plain": time.perf_counter() - start}
+        expected_log = read(os.path.join(tmp, "plain", "alignments4.log"))
+        run_tagger(plain)
+        expected_pavlov = [read(plain["source_pavlov"]), read(plain["target_pavlov"])]
+
+        read_seconds = {"plain": timeit(lambda: sum(1 for _ in open_binary(plain["source"], "rb")))}
+        reference_seconds = {}
+        for ext, paths in compressed.items():
+            check_streams(plain["source"], paths["source"], ext, rng)
+
+            # parity: decompressed outputs of the scripts identical to the plain ones
+            start = time.perf_counter()
+            outputs = run_dnts(paths, augment_prob, seed)
+            dnts_seconds[ext] = time.perf_counter() - start
+            for filename, expected in zip(outputs, expected_dnts):
+                assert filename.endswith(ext) and decompress(filename, ext) == expected, f"{os.path.basename(filename)} differs from the plain run"
+            assert read(os.path.join(tmp, ext[1:], "alignments4.log")) == expected_log, f"alignments4.log of the {ext} run differs"
+
+            run_tagger(paths)
+            for name, expected in zip(("source_pavlov", "target_pavlov"), expected_pavlov):
+                assert decompress(paths[name], ext) == expected, f"tagged {os.path.basename(paths[name])} differs from the plain run"
+
+            read_seconds[ext] = timeit(lambda: sum(1 for _ in open_binary(paths["source"], "rb")))
+            reference_seconds[ext] = timeit(lambda: sum(1 for _ in CODECS[ext](paths["source"], "rb")))
+
+    print(f"{n_sentences:,} sentence pairs: streams, make_dnts and tagger outputs identical to the plain files with {', '.join(codecs)}\n")
+    print(f"{'':>6} {'read lines (s)':>15} {'unthreaded (s)':>15} {'make_dnts (s)':>14}")
+    print(f"{'plain':>6} {read_seconds['plain']:>15.3f} {'-':>15} {dnts_seconds['plain']:>14.2f}")
+    for ext in codecs:
+        print(f"{ext:>6} {read_seconds[ext]:>15.3f} {reference_seconds[ext]:>15.3f} {dnts_seconds[ext]:>14.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Check reads, writes and script outputs on .gz/.xz/.bz2/.zst corpora against plain files, and time them")
+    parser.add_argument("-n", "--sentences", help = "Sentence pairs of the synthetic corpus", default = 20_000)
+    parser.add_argument("-g", "--augment", help = "Augment probability of the make_dnts runs", default = .5)
+    parser.add_argument("--seed", help = "Random seed", default = 0)
+
+    args = parser.parse_args()
+
+    main(int(args.sentences),
+         float(args.augment),
+         int(args.seed))
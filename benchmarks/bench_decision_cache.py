@@ -0,0 +1,82 @@
+import io
+import os
+import re
+import sys
+import time
+import argparse
+import tempfile
+from contextlib import redirect_stdout
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+import make_dnts_algorithm3 as dnts
+from synthetic_corpus import write_corpus
+
+
+def run(paths, probability, augment_prob, seed, cache_size, cache_file = None, workers = 1):
+    # outputs, alignment log, printed totals and cache hit rate of one run
+    stdout = io.StringIO()
+    start = time.perf_counter()
+    with redirect_stdout(stdout):
+        dnts.main(paths["source_pavlov"], paths["target_pavlov"], paths["alignments"], probability, augment_prob, 1,
+                  workers = workers, seed = seed, decision_cache_path = cache_file, decision_cache_size = cache_size)
+    seconds = time.perf_counter() - start
+    outputs = []
+    for filename in (paths["source_pavlov"] + ".dnts5", paths["target_pavlov"] + ".dnts5",
+                     os.path.join(os.path.dirname(paths["source_pavlov"]), "alignments4.log")):
+        with open(filename, "rb") as f:
+            outputs.append(f.read())
+        os.remove(filename)
+    lines = stdout.getvalue().splitlines()
+    totals = [line for line in lines if line.startswith(("DNTs in each corpora", "Entities ="))]
+    hit_rate = next(re.search(r"\(([\d.]+)% hit rate\)", line).group(1) for line in lines if line.startswith("Decision cache ="))
+    return outputs, totals, float(hit_rate), seconds
+
+
+def main(n_sentences, probability, warm_probability, augment_prob, workers, seed):
+
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = write_corpus(tmp, n_sentences, entity_density = .2, quirks = ["translit", "retag", "numbers"], seed = seed)
+        cache_file = os.path.join(tmp, "decisions.pkl")
+
+        # a cache of 0 entries evicts everything it is given: every decision is computed again
+        expected, expected_totals, _, uncached = run(paths, probability, augment_prob, seed, 0)
+        runs = [("default size", dict(cache_size = dnts.DECISION_CACHE_SIZE)),
+                # entries evicted all the time, lower bounds of distances replaced by exact ones and back
+                ("64 entries", dict(cache_size = 64)),
+                (f"{workers} workers", dict(cache_size = dnts.DECISION_CACHE_SIZE, workers = workers)),
+                # a file saved by a run with another -p, then reloaded by this one
+                (f"warm from -p {warm_probability}", dict(cache_size = dnts.DECISION_CACHE_SIZE, cache_file = cache_file))]
+
+        print(f"{n_sentences:,} sentence pairs, -p {probability} -g {augment_prob}: {expected_totals[0]}\n")
+        print(f"{'decision cache':>22} {'hit rate':>9} {'seconds':>9} {'speedup':>9}")
+        print(f"{'off':>22} {'-':>9} {uncached:>9.2f} {1:>8.1f}x")
+        for label, kwargs in runs:
+            if "cache_file" in kwargs:
+                run(paths, warm_probability, augment_prob, seed, **kwargs)
+            outputs, totals, hit_rate, seconds = run(paths, probability, augment_prob, seed, **kwargs)
+            # parity: byte-identical outputs, log and totals with the cache on or off
+            for name, got, wanted in zip(("source .dnts5", "target .dnts5", "alignments4.log"), outputs, expected):
+                assert got == wanted, f"{name} with the decision cache ({label}) differs from the run without it"
+            assert totals == expected_totals, f"totals with the decision cache ({label}) differ: {totals} != {expected_totals}"
+            print(f"{label:>22} {hit_rate:>8.1f}% {seconds:>9.2f} {uncached / seconds:>8.1f}x")
+    print("\noutputs, alignment log and totals identical with the decision cache on and off")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Check that make_dnts outputs are byte-identical with the entity pair decision cache on and off (small, with workers, persisted), and time them")
+    parser.add_argument("-n", "--sentences", help = "Sentence pairs of the synthetic corpus", default = 20_000)
+    parser.add_argument("-p", "--probability", help = "Probability filter of the compared runs", default = .2)
+    parser.add_argument("--warm-probability", help = "Probability filter of the run saving the cache file", default = .5)
+    parser.add_argument("-g", "--augment", help = "Augment probability of the runs", default = .5)
+    parser.add_argument("-w", "--workers", help = "Worker processes of the run with workers", default = 2)
+    parser.add_argument("--seed", help = "Random seed of the corpus and of the runs", default = 0)
+
+    args = parser.parse_args()
+
+    main(int(args.sentences),
+         float(args.probability),
+         float(args.warm_probability),
+         float(args.augment),
+         int(args.workers),
+         int(args.seed))
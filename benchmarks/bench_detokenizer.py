@@ -0,0 +1,95 @@
+import os
+import re
+import sys
+import random
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from make_dnts_algorithm3 import Detokenizer, get_detokenizer, register_language_rule
+from pavlov_binary import load_pavlov
+from synthetic_corpus import make_corpus, timeit
+
+
+# ====== LEGACY ====== #
+def legacy_transform_string(input_string, lng_trg):
+    # transform_string before the Detokenizer, kept verbatim as the golden reference
+    transformed_string = re.sub(r'\s*([.,:%;!?\])])\s*', r'\1 ', input_string)
+    transformed_string = re.sub(r'\s*-\s*', '-', transformed_string)
+    transformed_string = re.sub(r'\(\s*', '(', transformed_string)
+    transformed_string = re.sub(r'\[\s*', '[', transformed_string)
+    transformed_string = re.sub(r'(\d+([.,]\s*\d+)+)', lambda m: re.sub(r'\s*', '', m.group()), transformed_string)
+    transformed_string = re.sub(r'" ([^"]+) "', r'"\1"', transformed_string)
+    transformed_string = re.sub(r'([^a-zA-Z\d])\s+\1(\s+\1)*', lambda m: m.group(0).replace(" ", "") if m.group(0).isascii()
+                                                                  else m.group(0).replace(" ", " ") , transformed_string)
+    transformed_string = re.sub(r'. ([,;:])', r'.\1', transformed_string)
+    transformed_string = re.sub(r'([A-Z]\.) ([A-Z]\.)', r'\1\2', transformed_string)
+    transformed_string = re.sub(r"(\.) ([A-z]{2,3})", r"\1\2", transformed_string)
+    if lng_trg == "ur":
+        transformed_string = re.sub(r'(\w)\s+([ًٌٍَُِْ])\s+(\w)', r'\1\2\3', transformed_string)
+    return transformed_string
+
+
+# ====== CORPUS ====== #
+ALPHABET = list("aAbZ09.,:;%!?()[]-\"'/_*é~") + ["U.", "K.", "com", "js", "{DNT0}", "1.5", "ب", "َ", "ِ", "12", ",", ".", " "]
+
+def make_fuzz(n_sentences, seed):
+    # random token lists built to trigger every rule and their interactions, which real sentences rarely do
+    rng = random.Random(seed)
+    corpus = []
+    for _ in range(n_sentences):
+        tokens = []
+        for _ in range(rng.randint(1, 30)):
+            if rng.random() < .5:
+                tokens.append("".join(rng.choices("abcdefgh", k = rng.randint(1, 8))))
+            else:
+                tokens.append("".join(rng.choices(ALPHABET, k = rng.randint(1, 3))))
+        corpus.append(tokens)
+    return corpus
+
+def make_prose(n_sentences, seed):
+    # target sides of synthetic pairs: split numbers, DNT tags and detached urdu diacritics
+    return [[word for word, _ in trg] for _, trg, _ in make_corpus(n_sentences, quirks = ["numbers", "dnt", "ur"], seed = seed)]
+
+def pavlov_corpus(filename):
+    return [[word for word, _ in sentence] for sentence in load_pavlov(filename)]
+
+
+def check_registered_rule():
+    # a rule registered after the detokenizer of its language was built is applied from then on
+    get_detokenizer("xx")
+    register_language_rule("xx", r"\bcolour\b", "color")
+    assert get_detokenizer("xx")(["the", "colour"]) == "the color", "registered rule ignored by the cached detokenizer"
+
+
+def main(n_sentences, pavlov_files, repeat, seed):
+
+    check_registered_rule()
+    corpora = [("random", make_fuzz(n_sentences, seed)), ("prose", make_prose(n_sentences, seed))]
+    corpora += [(os.path.basename(filename), pavlov_corpus(filename)) for filename in pavlov_files]
+
+    print(f"{'corpus':>28} {'lang':>5} {'legacy (s)':>12} {'new (s)':>12} {'speedup':>9}")
+    for name, corpus in corpora:
+        for language in ("", "ur"):
+            detokenizer = Detokenizer(language)
+
+            # golden check: byte-identical output on every sentence
+            for tokens in corpus:
+                expected = legacy_transform_string(" ".join(tokens), language)
+                assert detokenizer(tokens) == expected, f"{tokens!r}: {detokenizer(tokens)!r} != {expected!r}"
+
+            legacy = timeit(lambda: [legacy_transform_string(" ".join(tokens), language) for tokens in corpus], repeat)
+            new = timeit(lambda: [detokenizer(tokens) for tokens in corpus], repeat)
+            print(f"{name:>28} {language or '-':>5} {legacy:>12.4f} {new:>12.4f} {legacy / new:>8.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Check the Detokenizer against the legacy transform_string and compare their speed")
+    parser.add_argument("-n", "--sentences", help = "Random and synthetic sentences", default = 50_000)
+    parser.add_argument("-p", "--pavlov", help = "Tagged .pavlov files used as extra golden corpora", nargs = "*", default = [])
+    parser.add_argument("-r", "--repeat", help = "Repetitions, best time is reported", default = 3)
+    parser.add_argument("--seed", help = "Random seed", default = 0)
+
+    args = parser.parse_args()
+
+    main(int(args.sentences), args.pavlov, int(args.repeat), int(args.seed))
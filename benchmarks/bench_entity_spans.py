@@ -0,0 +1,86 @@
+import os
+import sys
+import random
+import argparse
+from array import array
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from make_dnts_algorithm3 import Sentence, get_entities_align, find_entity_spans, make_dnt_BIO, make_dnt_BIO_batch, TAGS
+from synthetic_corpus import make_rows, timeit
+
+
+# ====== CORPUS ====== #
+TAG_POOL = ["O"] * 8 + ["B-PERSON", "B-GPE", "B-ORG", "B-MISC", "B-DATE", "I-PERSON", "I-GPE", "I-ORG", "I-MISC", "I-DATE", "ENTITY"]
+
+def make_tags(n_sentences, length, seed):
+    # dense random BIO tags: spans at sentence starts and ends, "I-" runs after a sentence boundary, empty sentences
+    rng = random.Random(seed)
+    return [[(f"w{k}", rng.choice(TAG_POOL)) for k in range(rng.randint(0, 2 * length))] for _ in range(n_sentences)]
+
+
+# ====== SPANS ====== #
+def per_sentence(sentences):
+    return [[(entity_words_idx[0], entity_words_idx[-1] + 1) for _, _, entity_words_idx in get_entities_align(src)]
+            for src in sentences]
+
+def batched(sentences):
+    tag_ids = array("i")
+    offsets = [0]
+    for src in sentences:
+        tag_ids.extend(src.tags)
+        offsets.append(len(tag_ids))
+    starts, ends = find_entity_spans(tag_ids, offsets)
+
+    res = [[] for _ in sentences]
+    k = 0
+    for start, end in zip(starts.tolist(), ends.tolist()):
+        while offsets[k + 1] <= start:
+            k += 1
+        res[k].append((start - offsets[k], end - offsets[k]))
+    return res
+
+def main(n_sentences, lengths, batch_size, repeat, seed):
+
+    print(f"{'length':>8} {'spans':>8} {'per sentence (s)':>17} {'batched (s)':>12} {'speedup':>9}")
+    for length in lengths:
+        sentences = [Sentence(tokens, None, None) for tokens in make_tags(n_sentences, length, seed)]
+
+        # parity: same spans as get_entities_align, sentence by sentence
+        assert per_sentence(sentences) == batched(sentences), "entity spans differ"
+
+        n_spans = sum(map(len, per_sentence(sentences)))
+        single = timeit(lambda: per_sentence(sentences), repeat)
+        batch = timeit(lambda: batched(sentences), repeat)
+        print(f"{length:>8} {n_spans:>8,} {single:>17.4f} {batch:>12.4f} {single / batch:>8.1f}x")
+
+    # parity of the whole batched front end against make_dnt_BIO, line by line
+    corpus = make_rows(n_sentences, lengths[-1], .15, ["translit", "retag", "numbers", "dnt"], seed)
+    for probability, augment_prob in ((0, 0), (.5, .5)):
+        expected = []
+        for i, row in enumerate(corpus):
+            found_als = []
+            expected.append((*make_dnt_BIO(*row, found_als, probability, augment_prob, rng = random.Random(f"{seed}:{i}")), found_als))
+        res = []
+        for start in range(0, len(corpus), batch_size):
+            rows = corpus[start:start + batch_size]
+            res += make_dnt_BIO_batch(rows, probability, augment_prob, rngs = [random.Random(f"{seed}:{i}") for i in range(start, start + len(rows))])
+        assert res == expected, f"make_dnt_BIO_batch differs with probability {probability}, augment {augment_prob}"
+    print(f"\nmake_dnt_BIO_batch == make_dnt_BIO on {len(corpus):,} sentence pairs ({len(TAGS.names)} distinct tags)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Check the vectorized entity spans against get_entities_align and compare their speed")
+    parser.add_argument("-n", "--sentences", help = "Sentences per length", default = 20_000)
+    parser.add_argument("-l", "--lengths", help = "Comma separated average sentence lengths", default = "10,25,50,100")
+    parser.add_argument("-b", "--batch-size", help = "Sentences per make_dnt_BIO_batch call in the parity check", default = 2_000)
+    parser.add_argument("-r", "--repeat", help = "Repetitions, best time is reported", default = 3)
+    parser.add_argument("--seed", help = "Random seed", default = 0)
+
+    args = parser.parse_args()
+
+    main(int(args.sentences),
+         [int(el) for el in args.lengths.split(",")],
+         int(args.batch_size),
+         int(args.repeat),
+         int(args.seed))
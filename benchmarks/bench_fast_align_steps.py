@@ -0,0 +1,103 @@
+import os
+import sys
+import time
+import argparse
+import tempfile
+import subprocess
+from contextlib import redirect_stdout
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+import merge_and_fast_align
+from pavlov_binary import load_pavlov
+from synthetic_corpus import write_corpus
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+
+# stand-in for the fast_align binary: diagonal links for every line of -i, after `STUB_DELAY`
+# seconds (forward only), and the reverse direction fails at once when `STUB_FAIL` is set
+STUB_FAST_ALIGN = f"""#!{sys.executable}
+import os, sys, time
+args = sys.argv[1:]
+if "-r" in args and os.environ.get("STUB_FAIL"):
+    sys.exit("stub fast_align: reverse direction failed")
+if "-r" not in args:
+    time.sleep(float(os.environ.get("STUB_DELAY", 0)))
+for line in open(args[args.index("-i") + 1]):
+    src, trg = line.split(" ||| ")
+    print(" ".join(f"{{k}}-{{k}}" for k in range(min(len(src.split()), len(trg.split())))))
+"""
+
+# stand-in for atools: the native symmetrization takes the same options
+STUB_ATOOLS = f"""#!/bin/sh
+exec {sys.executable} {os.path.abspath(os.path.join(SRC, "symmetrize.py"))} "$@"
+"""
+
+
+def write_stub(path, text):
+    with open(path, "w") as f:
+        f.write(text)
+    os.chmod(path, 0o755)
+
+def run(paths, fast_align, atools, **env):
+    os.environ.update(env)
+    try:
+        start = time.perf_counter()
+        with redirect_stdout(open(os.devnull, "w")):
+            merge_and_fast_align.main(paths["source_pavlov"], paths["target_pavlov"], 5, "union", fast_align, atools)
+        return time.perf_counter() - start
+    finally:
+        for name in env:
+            del os.environ[name]
+
+
+def main(n_sentences, delay, seed):
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = write_corpus(os.path.join(tmp, "corpus"), n_sentences, seed = seed)
+        fast_align, atools = os.path.join(tmp, "fast_align"), os.path.join(tmp, "atools")
+        write_stub(fast_align, STUB_FAST_ALIGN)
+        write_stub(atools, STUB_ATOOLS)
+        # the alignments folder is relative to the working directory
+        os.chdir(tmp)
+        try:
+            # success: merged corpus, both directions and their union
+            seconds = run(paths, fast_align, atools, STUB_DELAY = str(delay))
+            merged = [" ".join(word for word, _ in src) + " ||| " + " ".join(word for word, _ in trg) + "\n"
+                      for src, trg in zip(load_pavlov(paths["source_pavlov"]), load_pavlov(paths["target_pavlov"]))]
+            with open(os.path.join(tmp, "corpus", "merged")) as f:
+                assert f.readlines() == merged, "merged corpus differs from the .pavlov files"
+            for name in ("forward.align", "reverse.align", "symm.union.align"):
+                with open(os.path.join(tmp, "alignments", name)) as f:
+                    assert sum(1 for _ in f) == n_sentences, f"{name} does not have one line per sentence pair"
+            with open(os.path.join(tmp, "alignments", "forward.align")) as forward, \
+                 open(os.path.join(tmp, "alignments", "symm.union.align")) as union:
+                assert forward.read() == union.read(), "union of two identical directions differs from them"
+            print(f"success: {n_sentences:,} pairs merged, aligned both ways and symmetrized in {seconds:.1f}s (forward takes {delay:.1f}s)")
+
+            # a direction failing at once stops the other one instead of waiting for it
+            start = time.perf_counter()
+            try:
+                run(paths, fast_align, atools, STUB_DELAY = str(delay), STUB_FAIL = "1")
+            except subprocess.CalledProcessError as error:
+                seconds = time.perf_counter() - start
+                assert seconds < delay, f"the failure was only raised after {seconds:.1f}s, once the forward direction was done"
+                print(f"fast failure: exit code {error.returncode} of '{os.path.basename(error.cmd[0])} {' '.join(error.cmd[1:])}' "
+                      f"raised after {seconds:.1f}s, forward direction stopped")
+            else:
+                raise AssertionError("a failing fast_align did not stop the pipeline")
+        finally:
+            os.chdir(cwd)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Check merge_and_fast_align.py with stub fast_align/atools binaries: outputs, and a failing direction stopping the other one")
+    parser.add_argument("-n", "--sentences", help = "Sentence pairs", default = 2_000)
+    parser.add_argument("-d", "--delay", help = "Seconds the stub forward direction takes", default = 4)
+    parser.add_argument("--seed", help = "Random seed of the corpus", default = 0)
+
+    args = parser.parse_args()
+
+    main(int(args.sentences),
+         float(args.delay),
+         int(args.seed))
@@ -0,0 +1,73 @@
+import os
+import sys
+import time
+import argparse
+import tempfile
+from contextlib import redirect_stdout
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+import dnt_pipeline
+from synthetic_corpus import write_corpus
+
+
+def concat(output, *inputs):
+    with open(output, "wb") as out:
+        for filename in inputs:
+            with open(filename, "rb") as f:
+                out.write(f.read())
+
+def run(corpus, output_dir, augment_prob, shards = None, shard_size = None):
+    start = time.perf_counter()
+    with redirect_stdout(open(os.devnull, "w")):
+        dnt_pipeline.main(corpus["source"], corpus["target"], output_dir, "en", "it", tagger = "standin", alignments = corpus["alignments"],
+                          augment_prob = augment_prob, shards = shards, shard_size = shard_size)
+    return time.perf_counter() - start
+
+def read_outputs(corpus, output_dir):
+    res = []
+    for side in ("source", "target"):
+        for suffix in (".pavlov", ".pavlov.dnts5"):
+            with open(os.path.join(output_dir, os.path.basename(corpus[side]) + suffix), "rb") as f:
+                res.append(f.read())
+    return res
+
+
+def main(n_sentences, n_new, shard_size, augment_prob, seed):
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # yesterday's corpus, and today's: the same lines with new ones appended
+        old = write_corpus(os.path.join(tmp, "old"), n_sentences, seed = seed)
+        new = write_corpus(os.path.join(tmp, "new"), n_new, seed = seed + 1)
+        today = {name: os.path.join(tmp, os.path.basename(old[name])) for name in ("source", "target", "alignments")}
+        for name, path in today.items():
+            concat(path, old[name], new[name])
+        store = os.path.join(tmp, "store")
+
+        run(old, os.path.join(tmp, "out"), augment_prob, store, shard_size)
+
+        print(f"{n_sentences:,} pairs + {n_new:,} appended, shards of {shard_size:,} lines\n")
+        print(f"{'':>20} {'full run (s)':>13} {'incremental (s)':>16} {'speedup':>9}")
+        for label, augment in (("appended lines", augment_prob), ("-g changed", augment_prob / 2)):
+            full = run(today, os.path.join(tmp, "full"), augment)
+            incremental = run(today, os.path.join(tmp, "out"), augment, store, shard_size)
+            # parity: stitched outputs byte-identical to a full run
+            assert read_outputs(today, os.path.join(tmp, "out")) == read_outputs(today, os.path.join(tmp, "full")), f"outputs differ after {label}"
+            print(f"{label:>20} {full:>13.2f} {incremental:>16.2f} {full / incremental:>8.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Check incremental dnt_pipeline runs (shard store) against full runs after appending lines and after changing -g, and time them")
+    parser.add_argument("-n", "--sentences", help = "Sentence pairs of the existing corpus", default = 20_000)
+    parser.add_argument("-a", "--appended", help = "Sentence pairs appended to it", default = 1_000)
+    parser.add_argument("-s", "--shard-size", help = "Lines per shard", default = 2_000)
+    parser.add_argument("-g", "--augment", help = "Augment probability of the first runs, halved in the last one", default = .5)
+    parser.add_argument("--seed", help = "Random seed of the corpus", default = 0)
+
+    args = parser.parse_args()
+
+    main(int(args.sentences),
+         int(args.appended),
+         int(args.shard_size),
+         float(args.augment),
+         int(args.seed))
@@ -0,0 +1,101 @@
+import os
+import sys
+import random
+import argparse
+from unidecode import unidecode
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from make_dnts_algorithm3 import levenshtein_distance, normalize_word
+from synthetic_corpus import make_corpus, timeit
+
+# the cutoffs replace_entities compares against, and None for the exact distance
+THRESHOLDS = [0, 1, 2, 3, 4, 5, 6, None]
+
+# words the synthetic corpus does not produce: empty, case changes that alter the length, non latin
+EDGE_WORDS = ["", "a", "İstanbul", "STRASSE", "Straße", "東京", "Ελλάδα", "Zürich", "zurich", "ZÜRICH", "${DNT0}3"]
+
+
+# ====== PREVIOUS FUNCTION ====== #
+def reference_distance(s1, s2):
+    # the full (m+1)x(n+1) DP levenshtein_distance used before the cutoff
+    m = len(s1)
+    n = len(s2)
+    dp = [[0] * (n + 1) for _ in range(m + 1)]
+    for i in range(m + 1):
+        dp[i][0] = i
+    for j in range(n + 1):
+        dp[0][j] = j
+    for i in range(1, m + 1):
+        for j in range(1, n + 1):
+            if s1[i - 1] == s2[j - 1]:
+                dp[i][j] = dp[i - 1][j - 1]
+            else:
+                dp[i][j] = min(dp[i - 1][j] + 1,
+                               dp[i][j - 1] + 1,
+                               dp[i - 1][j - 1] + 1)
+    return dp[m][n]
+
+
+# ====== INPUTS ====== #
+def make_pairs(n_sentences, seed):
+    # source entity words against their linked target words, as replace_entities compares them,
+    # and against random target words, most of them far apart
+    rng = random.Random(seed)
+    pairs = []
+    for src, trg, links in make_corpus(n_sentences, entity_density = .3, quirks = ["translit", "retag"], seed = seed):
+        for i, j in links:
+            if src[i][1] != "O":
+                pairs.append((src[i][0], trg[j][0]))
+                pairs.append((src[i][0], rng.choice(trg)[0]))
+    pairs += [(a, b) for a in EDGE_WORDS for b in EDGE_WORDS]
+    return pairs
+
+
+def check(pairs):
+    failures = []
+    for a, b in set(pairs):
+        for s1, s2 in ((a, b), (unidecode(a.lower()), unidecode(b.lower())), (a.lower(), b.lower())):
+            expected = reference_distance(s1, s2)
+            for threshold in THRESHOLDS:
+                got = levenshtein_distance(s1, s2, threshold)
+                # exact under the cutoff, threshold + 1 over it
+                wanted = expected if threshold is None or expected <= threshold else threshold + 1
+                if got != wanted:
+                    failures.append(f"levenshtein_distance({s1!r}, {s2!r}, {threshold}) = {got}, expected {wanted}")
+        for word in (a, b):
+            if normalize_word(word) != unidecode(word.lower()) or normalize_word(word, False) != word.lower():
+                failures.append(f"normalize_word({word!r}) differs from unidecode/lower")
+    return failures
+
+
+def main(n_sentences, repeat, seed):
+
+    pairs = make_pairs(n_sentences, seed)
+    failures = check(pairs)
+    for failure in failures[:20]:
+        print(failure)
+    if failures:
+        raise AssertionError(f"{len(failures)} results differ from the previous levenshtein_distance")
+    print(f"{len(pairs):,} word pairs ({len(set(pairs)):,} distinct): every threshold decision ({', '.join(map(str, THRESHOLDS))}) identical to the previous function\n")
+
+    normalize_word.cache_clear()
+    previous = timeit(lambda: [reference_distance(unidecode(a.lower()), unidecode(b.lower())) for a, b in pairs], repeat)
+    print(f"{'':>34} {'seconds':>9} {'speedup':>9}")
+    print(f"{'previous (full DP, unidecode)':>34} {previous:>9.3f}")
+    for threshold in (2, 5, 6, None):
+        seconds = timeit(lambda: [levenshtein_distance(normalize_word(a), normalize_word(b), threshold) for a, b in pairs], repeat)
+        print(f"{f'cutoff {threshold}, cached normalize':>34} {seconds:>9.3f} {previous / seconds:>8.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Check the threshold-bounded levenshtein_distance and normalize_word against the previous full DP on synthetic entity pairs, and time them")
+    parser.add_argument("-n", "--sentences", help = "Sentence pairs the entity words come from", default = 2_000)
+    parser.add_argument("-r", "--repeat", help = "Repetitions, best time is reported", default = 3)
+    parser.add_argument("--seed", help = "Random seed", default = 0)
+
+    args = parser.parse_args()
+
+    main(int(args.sentences),
+         int(args.repeat),
+         int(args.seed))
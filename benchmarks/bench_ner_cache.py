@@ -0,0 +1,102 @@
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import multiprocessing
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from pavlov_tagger_pickle import StandInTagger, tag_lines
+from ner_cache import NERCache, format_stats
+from synthetic_corpus import make_corpus
+from bench_tagger_farm import SlowTagger
+
+
+def make_pairs(n_sentences, duplicates, seed):
+    # crawled corpora repeat lines: a `duplicates` fraction of the pairs are copies of earlier ones
+    rng = random.Random(seed)
+    unique = [(" ".join(word for word, _ in src), " ".join(word for word, _ in trg)) for src, trg, _ in make_corpus(n_sentences, seed = seed)]
+    pairs = []
+    for pair in unique:
+        pairs.append(rng.choice(pairs) if pairs and rng.random() < duplicates else pair)
+    return pairs
+
+
+def tag_shared(path, pairs, batch_size, read_ahead, queue):
+    cache = NERCache(path, StandInTagger.cache_key)
+    queue.put((list(tag_lines(StandInTagger(), pairs, batch_size, read_ahead, cache)), cache.drain()))
+    cache.close()
+
+
+def main(n_sentences, duplicates, cost, batch_size, read_ahead, seed):
+
+    pairs = make_pairs(n_sentences, duplicates, seed)
+    tagger = SlowTagger(cost)
+
+    start = time.perf_counter()
+    expected = list(tag_lines(tagger, pairs, batch_size, read_ahead))
+    plain = time.perf_counter() - start
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "ner.sqlite")
+        print(f"{n_sentences:,} pairs, {duplicates:.0%} duplicated\n")
+        print(f"{'':>12} {'seconds':>9} {'lines/sec':>11}")
+        print(f"{'no cache':>12} {plain:>9.2f} {n_sentences / plain:>11,.1f}")
+
+        for run in ("cold cache", "warm cache"):
+            cache = NERCache(path, StandInTagger.cache_key)
+            start = time.perf_counter()
+            res = list(tag_lines(tagger, pairs, batch_size, read_ahead, cache))
+            seconds = time.perf_counter() - start
+            assert res == expected, f"the {run} changed the output"
+            print(f"{run:>12} {seconds:>9.2f} {n_sentences / seconds:>11,.1f}   {format_stats(cache.drain(), len(cache))}")
+            cache.close()
+
+        # another model never sees these entries
+        cache = NERCache(path, "other-model")
+        assert all(tagged is None for tagged in cache.get_many([pairs[0][0]])), "entries leaked across model keys"
+        cache.close()
+
+        # a small cache stays bounded, output unchanged
+        small = max(n_sentences // 4, 1)
+        cache = NERCache(os.path.join(tmp, "small.sqlite"), StandInTagger.cache_key, small)
+        assert list(tag_lines(tagger, pairs, batch_size, read_ahead, cache)) == expected, "eviction changed the output"
+        stats = cache.drain()
+        assert len(cache) <= small and stats["evictions"], "the cache outgrew its size"
+        print(f"\nbounded to {small:,}: {format_stats(stats, len(cache))}")
+        cache.close()
+
+        # two processes filling the same cache at once
+        path = os.path.join(tmp, "shared.sqlite")
+        queue = multiprocessing.get_context("spawn").Queue()
+        processes = [multiprocessing.get_context("spawn").Process(target = tag_shared, args = (path, pairs, batch_size, read_ahead, queue))
+                     for _ in range(2)]
+        for process in processes:
+            process.start()
+        results = [queue.get() for _ in processes]
+        for process in processes:
+            process.join()
+        assert all(res == expected for res, _ in results), "concurrent writers changed the output"
+        cache = NERCache(path, StandInTagger.cache_key)
+        print("2 concurrent processes: " + ", ".join(format_stats(stats) for _, stats in results) + f", {len(cache):,} entries shared")
+        cache.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Check the NER cache against uncached tagging (eviction, concurrent processes) and time it")
+    parser.add_argument("-n", "--sentences", help = "Sentence pairs", default = 4_000)
+    parser.add_argument("-d", "--duplicates", help = "Fraction of pairs repeating an earlier pair", default = .3)
+    parser.add_argument("-c", "--cost", help = "Simulated CPU seconds per sentence of the stand-in model", default = .0005)
+    parser.add_argument("-b", "--batch-size", help = "Sentences per model call", default = 32)
+    parser.add_argument("-k", "--read-ahead", help = "Pairs per window", default = 256)
+    parser.add_argument("--seed", help = "Random seed of the corpus", default = 0)
+
+    args = parser.parse_args()
+
+    main(int(args.sentences),
+         float(args.duplicates),
+         float(args.cost),
+         int(args.batch_size),
+         int(args.read_ahead),
+         int(args.seed))
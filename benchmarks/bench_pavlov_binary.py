@@ -0,0 +1,83 @@
+import os
+import sys
+import random
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from pavlov_binary import PavlovBinaryReader, PavlovBinaryWriter, open_pavlov_writer, load_pavlov, load_pickle, convert, is_pavlov_binary
+from synthetic_corpus import make_corpus, timeit
+
+# sentences the synthetic corpus does not produce: empty, non-ascii, empty tokens, rare tags
+EDGE_CASES = [[],
+              [("città", "B-GPE"), ("Größe", "O"), ("東京", "B-LOC"), ("🙂", "O")],
+              [("", "O"), ("word", "I-WORK_OF_ART")]]
+
+
+def main(n_sentences, length, n_random, repeat, seed):
+
+    rng = random.Random(seed)
+    sentences = [src for src, _, _ in make_corpus(n_sentences, length, quirks = ["translit"], seed = seed)]
+    for sentence in EDGE_CASES:
+        sentences.insert(rng.randrange(len(sentences) + 1), sentence)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        pickled, binary = os.path.join(tmp, "corpus.pavlov"), os.path.join(tmp, "corpus.binary.pavlov")
+        with open_pavlov_writer(pickled) as out:
+            for sentence in sentences:
+                out.write(sentence)
+        convert(pickled, binary)
+
+        # parity: the binary file reads back exactly what the pickle stream holds
+        expected = list(load_pickle(pickled))
+        assert expected == sentences, "the pickle stream does not round-trip"
+        assert is_pavlov_binary(binary) and not is_pavlov_binary(pickled), "format detection is wrong"
+        assert list(load_pavlov(binary)) == expected, "load_pavlov of the binary file differs from the pickle stream"
+
+        # random access: single sentences, negative indexes, slices and line ranges
+        lines = [rng.randrange(len(expected)) for _ in range(n_random)]
+        ranges = sorted(rng.randrange(len(expected) + 1) for _ in range(2))
+        with PavlovBinaryReader(binary) as reader:
+            assert len(reader) == len(expected)
+            assert [reader[n] for n in lines] == [expected[n] for n in lines], "random access differs"
+            assert reader[-1] == expected[-1], "negative index differs"
+            assert reader[ranges[0]:ranges[1]] == expected[ranges[0]:ranges[1]], "slice differs"
+            assert list(reader.lines(*ranges)) == expected[ranges[0]:ranges[1]], "line range differs"
+        for source in (pickled, binary):
+            assert list(load_pavlov(source, *ranges)) == expected[ranges[0]:ranges[1]], f"load_pavlov range of {source} differs"
+
+        # a write failing halfway leaves no file that could pass for a complete one
+        broken = os.path.join(tmp, "broken.pavlov")
+        try:
+            with PavlovBinaryWriter(broken) as out:
+                out.write(expected[0])
+                raise RuntimeError("interrupted")
+        except RuntimeError:
+            pass
+        assert not os.path.exists(broken), "an interrupted write left a .pavlov file behind"
+
+        print(f"{len(expected):,} sentences: pickle {os.path.getsize(pickled):,} bytes, binary {os.path.getsize(binary):,} bytes, identical contents\n")
+        print(f"{'':>24} {'pickle (s)':>11} {'binary (s)':>11}")
+        print(f"{'full read':>24} {timeit(lambda: list(load_pavlov(pickled)), repeat):>11.3f} {timeit(lambda: list(load_pavlov(binary)), repeat):>11.3f}")
+        with PavlovBinaryReader(binary) as reader:
+            # the pickle stream has no index, a line is reached by reading every line before it
+            last = len(expected) // 2
+            print(f"{'line ' + format(last, ','):>24} {timeit(lambda: next(load_pavlov(pickled, last)), repeat):>11.3f} {timeit(lambda: reader[last], repeat):>11.6f}")
+            print(f"{f'{n_random:,} random lines':>24} {'-':>11} {timeit(lambda: [reader[n] for n in lines], repeat):>11.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Check that binary .pavlov files read back the same sentences as the pickle stream, also by random access, and time both")
+    parser.add_argument("-n", "--sentences", help = "Sentences", default = 50_000)
+    parser.add_argument("-l", "--length", help = "Average sentence length (tokens)", default = 25)
+    parser.add_argument("-k", "--random", help = "Random lines read", default = 10_000)
+    parser.add_argument("-r", "--repeat", help = "Repetitions, best time is reported", default = 3)
+    parser.add_argument("--seed", help = "Random seed", default = 0)
+
+    args = parser.parse_args()
+
+    main(int(args.sentences),
+         int(args.length),
+         int(args.random),
+         int(args.repeat),
+         int(args.seed))
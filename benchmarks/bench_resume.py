@@ -0,0 +1,143 @@
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+from contextlib import redirect_stdout
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+import pavlov_tagger_pickle
+from pavlov_binary import PavlovPickleWriter
+from synthetic_corpus import write_corpus
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+
+# the tagger script in a child process whose stand-in tagger kills it, without any cleanup,
+# once `crash_after` lines are tagged: outputs are left past the last checkpoint
+CRASHING_RUN = f"""
+import os, sys, json
+sys.path.insert(0, {os.path.abspath(SRC)!r})
+import pavlov_tagger_pickle
+
+class CrashingTagger(pavlov_tagger_pickle.StandInTagger):
+    tagged = 0
+
+    def __call__(self, sentences):
+        # source and target sentences of a line are tagged together
+        CrashingTagger.tagged += len(sentences)
+        if CrashingTagger.tagged > 2 * crash_after:
+            os._exit(3)
+        return super().__call__(sentences)
+
+kwargs, crash_after = json.loads(sys.argv[1])
+pavlov_tagger_pickle.TAGGERS["standin"] = CrashingTagger
+pavlov_tagger_pickle.main(**kwargs)
+"""
+
+
+def settings(paths, checkpoint_every, read_ahead):
+    # a run that crashed before its first checkpoint is started again, without --resume
+    return {"input_source_file": paths["source"], "input_target_file": paths["target"], "DISPLAY_ITERATION": 1_000_000,
+            "tagger": "standin", "read_ahead": read_ahead, "checkpoint_every": checkpoint_every,
+            "resume": os.path.exists(paths["source"] + ".pavlov.ckpt")}
+
+def run(paths, checkpoint_every, read_ahead):
+    start = time.perf_counter()
+    with redirect_stdout(open(os.devnull, "w")):
+        pavlov_tagger_pickle.main(**settings(paths, checkpoint_every, read_ahead))
+    return time.perf_counter() - start
+
+def crash(paths, checkpoint_every, read_ahead, crash_after):
+    # the line the next run resumes from
+    kwargs = settings(paths, checkpoint_every, read_ahead)
+    process = subprocess.run([sys.executable, "-c", CRASHING_RUN, json.dumps([kwargs, crash_after])], capture_output = True)
+    assert process.returncode == 3, f"the crashing run did not crash: {process.stderr.decode()}"
+    if not os.path.exists(paths["source"] + ".pavlov.ckpt"):
+        return 0
+    with open(paths["source"] + ".pavlov.ckpt") as f:
+        return json.load(f)["lines"]
+
+def read_outputs(paths):
+    res = []
+    for name in ("source_pavlov", "target_pavlov"):
+        with open(paths[name], "rb") as f:
+            res.append(f.read())
+    return res
+
+def clean(paths):
+    for filename in (paths["source_pavlov"], paths["target_pavlov"], paths["source"] + ".pavlov.ckpt"):
+        if os.path.exists(filename):
+            os.remove(filename)
+
+
+def main(n_sentences, checkpoint_every, read_ahead, crash_points, seed):
+
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = write_corpus(tmp, n_sentences, quirks = ["numbers", "translit"], seed = seed)
+        clean(paths)
+
+        uninterrupted = run(paths, n_sentences + 1, read_ahead)
+        expected = read_outputs(paths)
+        clean(paths)
+        checkpointed = run(paths, checkpoint_every, read_ahead)
+        assert read_outputs(paths) == expected, "checkpoints change the outputs"
+        clean(paths)
+
+        print(f"{n_sentences:,} line pairs, checkpoints every {checkpoint_every:,} lines\n")
+        print(f"{'crashes after':>30} {'resumed from':>25}")
+        for crashes in crash_points:
+            # every crash counts tagged lines from the start of its own run
+            resumed = [crash(paths, checkpoint_every, read_ahead, crash_after) for crash_after in crashes]
+            run(paths, checkpoint_every, read_ahead)
+            # parity: the resumed outputs are byte-identical to an uninterrupted run
+            assert read_outputs(paths) == expected, f"outputs resumed after crashes at {crashes} differ from an uninterrupted run"
+            print(f"{', '.join(f'{c:,}' for c in crashes):>30} {', '.join(f'{r:,}' for r in resumed):>25}")
+            clean(paths)
+
+        # a checkpoint left on other inputs: refused by --resume, deleted by a run without it
+        crash(paths, checkpoint_every, read_ahead, 2 * checkpoint_every)
+        for name in ("source", "target"):
+            with open(paths[name], encoding = "utf-8") as f:
+                lines = f.readlines()
+            with open(paths[name], "w", encoding = "utf-8") as f:
+                f.writelines(lines[:checkpoint_every // 2])
+        kwargs = settings(paths, checkpoint_every, read_ahead)
+        try:
+            run(paths, checkpoint_every, read_ahead)
+            raise AssertionError("--resume accepted a checkpoint taken on other inputs")
+        except ValueError:
+            pass
+        kwargs["resume"] = False
+        with redirect_stdout(open(os.devnull, "w")):
+            pavlov_tagger_pickle.main(**kwargs)
+        assert not os.path.exists(paths["source"] + ".pavlov.ckpt"), "a completed run left its checkpoint"
+        size = os.path.getsize(paths["source_pavlov"])
+        try:
+            PavlovPickleWriter(paths["source_pavlov"], size + 1)
+            raise AssertionError("the writer resumed past the end of its output")
+        except ValueError:
+            pass
+        assert os.path.getsize(paths["source_pavlov"]) == size, "resuming past the end of the output changed it"
+
+    print("\nresumed outputs identical to an uninterrupted run, stale checkpoints refused")
+    print(f"uninterrupted run {uninterrupted:.2f}s, with checkpoints {checkpointed:.2f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Check that pavlov_tagger_pickle.py runs killed mid-way and continued with --resume give the same outputs as an uninterrupted run, and time the checkpoints")
+    parser.add_argument("-n", "--sentences", help = "Line pairs of the synthetic corpus", default = 10_000)
+    parser.add_argument("-c", "--checkpoint-every", help = "Lines between two checkpoints", default = 1_000)
+    parser.add_argument("-k", "--read-ahead", help = "Lines read ahead and sorted by length before batching", default = 128)
+    parser.add_argument("-x", "--crashes", help = "Crash points, each as lines tagged before every crash (e.g. 2500 or 1500:3000)", nargs = "+",
+                        default = ["500", "2500", "5001", "1500:3000", "1500:100"])
+    parser.add_argument("--seed", help = "Random seed of the corpus", default = 0)
+
+    args = parser.parse_args()
+
+    main(int(args.sentences),
+         int(args.checkpoint_every),
+         int(args.read_ahead),
+         [[int(el) for el in spec.split(":")] for spec in args.crashes],
+         int(args.seed))
@@ -0,0 +1,275 @@
+import gc
+import os
+import sys
+import random
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from make_dnts_algorithm3 import (AlignmentIndex, Sentence, make_dnt_BIO, decision_cache, normalize_word, dnt_augment,
+                                  get_detokenizer, admitted_tags, not_admitted_languages, lng_trg)
+from synthetic_corpus import make_rows, timeit
+
+
+# ====== LEGACY ====== #
+# dict-of-dicts sentences before the Sentence model, kept verbatim as the golden reference
+def legacy_get_entities_align(src_sentence: tuple):
+    res = list()
+    
+    idx = 0
+    while idx < len(src_sentence):
+        src_word, src_tag = src_sentence[idx]
+        
+        #admitted_tags.add("PRODUCT")
+        if src_tag.startswith("B-") and src_tag[2:] in admitted_tags:
+            entity: list = [src_sentence[idx][0]]
+            entity_words_idx: list = [idx]
+            
+            # link the whole entity by B/I tags
+            j = idx + 1
+            while j < len(src_sentence) and src_sentence[j][1].startswith("I-"):
+                entity.append(src_sentence[j][0])
+                entity_words_idx.append(j)
+                j += 1
+                
+            res.append( (entity, src_tag, entity_words_idx) )
+        # Se la parola non ha un tag utile, ci spostiamo alla successiva 
+        idx += 1
+    return res
+
+def legacy_replace_entities(idx, src, trg, src_tag, src_entity_list, entity_words_idx, to_sample, found_als):
+    
+    if len(src_entity_list) > 1:
+        
+        """
+        Check links related to a specific "B-" starting entity.
+        If there's any and the first (smallest) one it's equal to the source_tag:
+        - Create the whole entity as string type, put it inside the original source[idx]['word'] and delete all relatives 'I-' indexes from dictionary.
+        - Extract a random 'POP', substitute in SRC dictionary.
+        - Return the link and the .pop() element
+        """
+
+        links = src[entity_words_idx[0]]["to"]
+        
+        if links:
+            link = links[0]
+            if link in trg:
+                trg_word, trg_tag, _ = trg[link].values()
+                
+                if (trg_tag == src_tag): # or distance < 5
+                    
+                    # explicit SRC entity
+                    new_word_src = " ".join(el for el in src_entity_list)
+
+                    #explicit TRG entity
+                    trg_entity: str = trg[link]["word"]
+                    trg_entity_list: list[str] = [trg_entity]
+                    trg_entity_idx: list[int] = [link]
+
+                    i = link + 1
+                    cont = 0
+                    while i < len(trg) and cont < len(src_entity_list)-1 and i in trg.keys():
+                        middle_distance = decision_cache.distance(normalize_word(trg[i-1]["word"], False),
+                                                                  normalize_word(src_entity_list[cont], False), 5)
+                        
+                        if trg[i]["tag"].startswith("I-") or middle_distance < 6:                    
+                            trg_entity = trg[i]["word"]
+                            trg_entity_list.append(trg_entity)
+                            trg_entity_idx.append(i)
+                            i += 1
+                            cont += 1
+                        else:
+                            break
+                    
+                    new_word_trg = " ".join(el for el in trg_entity_list)
+                    if decision_cache.span_rejected(src_entity_list, trg_entity_list):
+                        return False
+                    
+                    pop = to_sample.pop()
+                    if "DNT" not in new_word_trg:
+                        found_als.append(f"[{src_tag[2:]}][{new_word_src}] -> [{trg[link]['tag'][2:]}][{new_word_trg}]")
+
+                        # Replace SRC
+                        src[idx] = {"word": new_word_src}
+                        for i in entity_words_idx[1:]:
+                            del src[i]
+                        src[idx]['word'] = "${DNT0}" + str(pop)
+                        src[idx]['tag'] = "ENTITY"
+
+                        # Replace TRG
+                        for i in trg_entity_idx[1:]:
+                            del trg[i]
+                        trg[link]['word'] = "${DNT0}" + str(pop)
+                        trg[link]['tag'] = "ENTITY"
+
+    elif len(src_entity_list) == 1 and len(src_entity_list[0]) > 1:
+        
+        """
+        Check links related to a specific entity;
+        If there are links, get the first (smallest) one and check if it's equal to the source_tag's one.
+        In that case replace both SRC and TRG dictionary's word with 'POP'
+        """
+        src_word = src_entity_list[0]
+        
+        closest = None # (distance, link, trg_word, trg_tag) of the closest eligible link
+        links = src[idx]["to"] #links [SRC ENTITY] -> [TRG ENTITIES]
+        if links:
+            for link in links:
+                if link in trg:
+                    trg_word, trg_tag= trg[link]["word"], trg[link]["tag"]
+                    
+                    # if we process very low resource language, just get the first link
+                    if lng_trg in not_admitted_languages:
+                        if "{DNT0}" not in trg_word and trg_word.isalnum():
+                            closest = (0, link, trg_word, trg_tag)
+                        break
+                    
+                    # otherwise keep parsing them all
+                    if "{DNT0}" in trg_word or not trg_word.isalnum():
+                        continue
+
+                    # a link only wins if strictly closer than the current one (first one wins on ties),
+                    # links with a different tag must also be closer than 3
+                    limit = closest[0] - 1 if closest else None
+                    if trg_tag != src_tag:
+                        limit = 2 if limit is None else min(limit, 2)
+
+                    distance = decision_cache.distance(normalize_word(src_word), normalize_word(trg_word), limit)
+                    if limit is None or distance <= limit:
+                        #print(f"{idx} = [{src_tag}]{src_word}:{unidecode(src_word)} -> {idx} = [{trg_tag}]{trg_word}:{unidecode(src_word)}")
+                        closest = (distance, link, trg_word, trg_tag)
+                        if distance == 0:
+                            break
+                    
+
+        #if there is any eligible entity, process the closest one             
+        if closest:
+            _, link, trg_word, trg_tag  = closest
+
+            found_als.append(f"[{src_tag[2:]}][{src_word}] -> [{trg_tag[2:]}][{trg_word}]")
+            #print(f"{idx} = [{src_tag}][{src_word}] -> {link} = [{trg_tag}][{trg_word}]")
+                
+            # extract a random number and replace in dictionary
+            pop = "${DNT0}" + str(to_sample.pop())
+            src[idx]['word'] = pop
+            trg[link]['word'] = pop
+
+def legacy_make_dnt_BIO(src_sentence, src_origin, trg_sentence, trg_origin, alignments, found_als, probability, augment_prob, verbosity = 0, rng = random, detokenizer = None) -> tuple: 
+
+    
+    to_sample = rng.sample(population = range(25) if 25 > len(src_sentence) else range(len(src_sentence)), 
+                              k = len(src_sentence))
+    
+    links = AlignmentIndex(alignments, len(src_sentence), len(trg_sentence))
+
+    src = {
+        index: {
+            "word": word,
+            "tag": tag,
+            "to": links.forward(index)
+        }
+    for index, (word, tag) in enumerate(src_sentence)
+    }
+
+
+    trg = {
+        index: {
+            "word": word,
+            "tag": tag,
+            "to": links.reverse(index)
+        }
+        for index, (word, tag) in enumerate(trg_sentence)
+    }
+
+    # ====== PROCESSING WITH FAST ALIGN ====== #
+    src_entities = legacy_get_entities_align(src_sentence)
+    for entity, src_tag, entity_words_idx in src_entities:
+        current_idx = entity_words_idx[0]
+        
+        current_prob = rng.random()
+        if current_prob >= probability: 
+            legacy_replace_entities(current_idx, src, trg, src_tag, entity, entity_words_idx, to_sample, found_als)
+
+
+    if detokenizer is None:
+        detokenizer = get_detokenizer(lng_trg)
+    src_res = detokenizer([res["word"] for res in src.values()]).rstrip()
+    trg_res = detokenizer([res["word"] for res in trg.values()]).rstrip()
+    
+    
+    # ====== DNTS AUGMENTING ======= #
+    if "{DNT0}" in src_res:
+        if augment_prob > 0:
+            src_res, trg_res = dnt_augment(src_res, trg_res, augment_prob, to_sample, rng)
+        src_res = src_origin + src_res
+        trg_res = trg_origin + trg_res
+        
+        return src_res, trg_res 
+    
+    
+    return src_origin.strip(), trg_origin.strip()
+
+
+# ====== MEASURES ====== #
+def legacy_sentences(src_sentence, trg_sentence, alignments):
+    links = AlignmentIndex(alignments, len(src_sentence), len(trg_sentence))
+    src = {index: {"word": word, "tag": tag, "to": links.forward(index)} for index, (word, tag) in enumerate(src_sentence)}
+    trg = {index: {"word": word, "tag": tag, "to": links.reverse(index)} for index, (word, tag) in enumerate(trg_sentence)}
+    return src, trg
+
+def new_sentences(src_sentence, trg_sentence, alignments):
+    links = AlignmentIndex(alignments, len(src_sentence), len(trg_sentence))
+    return (Sentence(src_sentence, links.src_offsets, links.src_links),
+            Sentence(trg_sentence, links.trg_offsets, links.trg_links))
+
+def memory(build, corpus):
+    # bytes held by the sentence representations of the whole corpus
+    gc.collect()
+    tracemalloc.start()
+    kept = [build(src, trg, alignments) for src, _, trg, _, alignments in corpus]
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del kept
+    return size
+
+def run(func, corpus, probability, augment_prob, seed):
+    found_als, res = [], []
+    for i, row in enumerate(corpus):
+        res.append(func(*row, found_als, probability, augment_prob, rng = random.Random(f"{seed}:{i}")))
+    return res, found_als
+
+def main(n_sentences, lengths, repeat, seed):
+
+    print(f"{'length':>8} {'legacy (s)':>12} {'new (s)':>12} {'speedup':>9} {'legacy (KB)':>12} {'new (KB)':>12} {'ratio':>7}")
+    for length in lengths:
+        # entities misspelled, retagged or cut in the target and non admitted types: every replacement path is taken
+        corpus = make_rows(n_sentences, length, .15, ["translit", "retag", "numbers", "dnt"], seed)
+
+        # golden check: same outputs and logged alignments for several probabilities
+        for probability, augment_prob in ((0, 0), (.5, 0), (0, .5), (.3, .7)):
+            old = run(legacy_make_dnt_BIO, corpus, probability, augment_prob, seed)
+            new = run(make_dnt_BIO, corpus, probability, augment_prob, seed)
+            assert old == new, f"outputs differ with probability {probability}, augment {augment_prob}"
+
+        legacy = timeit(lambda: run(legacy_make_dnt_BIO, corpus, 0, .5, 0), repeat)
+        compact = timeit(lambda: run(make_dnt_BIO, corpus, 0, .5, 0), repeat)
+        legacy_bytes = memory(legacy_sentences, corpus)
+        compact_bytes = memory(new_sentences, corpus)
+        print(f"{length:>8} {legacy:>12.4f} {compact:>12.4f} {legacy / compact:>8.1f}x"
+              f" {legacy_bytes / 1024:>12,.0f} {compact_bytes / 1024:>12,.0f} {legacy_bytes / compact_bytes:>6.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Compare the dict-of-dicts sentences with the compact Sentence model (outputs, speed and memory)")
+    parser.add_argument("-n", "--sentences", help = "Sentences per length", default = 5_000)
+    parser.add_argument("-l", "--lengths", help = "Comma separated average sentence lengths", default = "10,25,50,100")
+    parser.add_argument("-r", "--repeat", help = "Repetitions, best time is reported", default = 3)
+    parser.add_argument("--seed", help = "Random seed", default = 0)
+
+    args = parser.parse_args()
+
+    main(int(args.sentences),
+         [int(el) for el in args.lengths.split(",")],
+         int(args.repeat),
+         int(args.seed))
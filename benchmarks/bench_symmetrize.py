@@ -0,0 +1,248 @@
+import io
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+from contextlib import redirect_stdout
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+import make_dnts_algorithm3 as dnts
+from symmetrize import symmetrize, parse_links, format_links, HEURISTICS, DIAG_NEIGHBORS
+from synthetic_corpus import make_corpus, write_corpus
+
+
+# ====== ATOOLS CASES ====== #
+# forward, reverse and the output of `atools -c <command>` on them, worked out by hand from
+# atools.cc: intersection first, then grow-diag sweeps the grid in (i, j) order trying the
+# neighbours (-1,0) (0,-1) (1,0) (0,1) then the diagonals (-1,-1) (-1,1) (1,-1) (1,1),
+# then the final(-and) pass goes over the forward links, then over the reverse ones.
+CASES = [
+    {"name": "neighbours before diagonals",
+     # (1,1) adds (0,1) first, which aligns source word 0: the diagonal (0,2) is then refused
+     "forward": "1-1 3-2 0-1",
+     "reverse": "1-1 3-2 0-2",
+     "expected": {"intersect": "1-1 3-2",
+                  "union": "0-1 0-2 1-1 3-2",
+                  "grow-diag": "0-1 1-1 3-2",
+                  "grow-diag-final": "0-1 1-1 3-2",
+                  "grow-diag-final-and": "0-1 1-1 3-2"}},
+    {"name": "side neighbour before diagonal",
+     # (1,1) adds (1,0) with (0,-1), which aligns target word 0: (2,0) is then refused, source word 2 being aligned to 3
+     "forward": "1-1 2-3 1-0",
+     "reverse": "1-1 2-3 2-0",
+     "expected": {"intersect": "1-1 2-3",
+                  "union": "1-0 1-1 2-0 2-3",
+                  "grow-diag": "1-0 1-1 2-3",
+                  "grow-diag-final": "1-0 1-1 2-3",
+                  "grow-diag-final-and": "1-0 1-1 2-3"}},
+    {"name": "forward before reverse in the final pass",
+     # no intersection: the forward (0,0) is added first, the reverse (0,1) only when one word may be aligned already
+     "forward": "0-0",
+     "reverse": "0-1",
+     "expected": {"intersect": "",
+                  "union": "0-0 0-1",
+                  "grow-diag": "",
+                  "grow-diag-final": "0-0 0-1",
+                  "grow-diag-final-and": "0-0"}},
+    {"name": "final-and refuses half aligned words",
+     "forward": "0-0 1-2 2-1",
+     "reverse": "0-0 2-2",
+     "expected": {"intersect": "0-0",
+                  "union": "0-0 1-2 2-1 2-2",
+                  "grow-diag": "0-0",
+                  "grow-diag-final": "0-0 1-2 2-1",
+                  "grow-diag-final-and": "0-0 1-2 2-1"}},
+    {"name": "diagonal chain grown in one sweep",
+     "forward": "0-0 1-1 2-2 3-3",
+     "reverse": "0-0",
+     "expected": {"intersect": "0-0",
+                  "union": "0-0 1-1 2-2 3-3",
+                  "grow-diag": "0-0 1-1 2-2 3-3",
+                  "grow-diag-final": "0-0 1-1 2-2 3-3",
+                  "grow-diag-final-and": "0-0 1-1 2-2 3-3"}},
+    {"name": "points added during a sweep grow in the same sweep",
+     # (0,0) adds (0,1) and (1,1), the sweep goes on to (1,1) which adds (2,1), then (2,1) adds (2,2)
+     "forward": "0-0 1-1 0-1 2-1",
+     "reverse": "0-0 2-2",
+     "expected": {"intersect": "0-0",
+                  "union": "0-0 0-1 1-1 2-1 2-2",
+                  "grow-diag": "0-0 0-1 1-1 2-1 2-2",
+                  "grow-diag-final": "0-0 0-1 1-1 2-1 2-2",
+                  "grow-diag-final-and": "0-0 0-1 1-1 2-1 2-2"}},
+    {"name": "empty and one-sided lines",
+     "forward": "",
+     "reverse": "0-0 1-1",
+     "expected": {"intersect": "",
+                  "union": "0-0 1-1",
+                  "grow-diag": "",
+                  "grow-diag-final": "0-0 1-1",
+                  "grow-diag-final-and": "0-0 1-1"}},
+]
+
+
+# the previous grow-diag, sweeping the dense grid until nothing is added, as the reference of the worklist one
+def sweep_grow_diag(a, b, final = False, final_and = False):
+    a, b = set(a), set(b)
+    either = a | b
+    width = 1 + max((i for i, _ in either), default = -1)
+    height = 1 + max((j for _, j in either), default = -1)
+    res = [[False] * height for _ in range(width)]
+    i_aligned = [False] * width
+    j_aligned = [False] * height
+    def align(i, j):
+        res[i][j] = i_aligned[i] = j_aligned[j] = True
+    for i, j in a & b:
+        align(i, j)
+    added = True
+    while added:
+        added = False
+        for i in range(width):
+            for j in range(height):
+                if not res[i][j]:
+                    continue
+                for di, dj in DIAG_NEIGHBORS:
+                    i2, j2 = i + di, j + dj
+                    if 0 <= i2 < width and 0 <= j2 < height and not res[i2][j2] \
+                        and (not i_aligned[i2] or not j_aligned[j2]) and (i2, j2) in either:
+                        align(i2, j2)
+                        added = True
+    if final:
+        for direction in (a, b):
+            for i, j in sorted(direction):
+                if not res[i][j] and ((not i_aligned[i] and not j_aligned[j]) if final_and else (not i_aligned[i] or not j_aligned[j])):
+                    align(i, j)
+    return [(i, j) for i in range(width) for j in range(height) if res[i][j]]
+
+SWEEPS = {"grow-diag": sweep_grow_diag,
+          "grow-diag-final": lambda a, b: sweep_grow_diag(a, b, final = True),
+          "grow-diag-final-and": lambda a, b: sweep_grow_diag(a, b, final = True, final_and = True)}
+
+
+def check_cases():
+    failures = []
+    for case in CASES:
+        for command, expected in case["expected"].items():
+            got = format_links(next(symmetrize([case["forward"]], [case["reverse"]], command)))
+            if got != expected:
+                failures.append(f"{case['name']}, -c {command}: expected '{expected}', got '{got}'")
+        # invert swaps the forward links
+        inverted = format_links(next(symmetrize([case["forward"]], None, "invert")))
+        if inverted != format_links(sorted((j, i) for i, j in parse_links(case["forward"]))):
+            failures.append(f"{case['name']}, -c invert: got '{inverted}'")
+    return failures
+
+
+def perturb(links, trg_length, rng):
+    # reverse links: some links dropped or moved by one target word
+    return sorted({(i, min(max(j + rng.choice((-1, 1)), 0), trg_length - 1)) if rng.random() < .2 else (i, j)
+                   for i, j in links if rng.random() > .1})
+
+def make_directions(n_sentences, length, seed):
+    # forward links of the synthetic corpus, and their perturbed reverse
+    rng = random.Random(seed)
+    forward, reverse = [], []
+    for _, trg, links in make_corpus(n_sentences, length, seed = seed):
+        forward.append(links)
+        reverse.append(perturb(links, len(trg), rng))
+    return forward, reverse
+
+
+def make_tangles(n, seed):
+    # small grids crowded with links, where the order points are grown in decides the result
+    rng = random.Random(seed)
+    res = []
+    for _ in range(n):
+        width, height = rng.randint(1, 8), rng.randint(1, 8)
+        density = rng.random()
+        res.append([sorted((i, j) for i in range(width) for j in range(height) if rng.random() < density / 2) for _ in range(2)])
+    return res
+
+
+def run_dnts(paths, workers, seed, **kwargs):
+    # .dnts5 outputs of one make_dnts run, and its time
+    start = time.perf_counter()
+    with redirect_stdout(io.StringIO()):
+        dnts.main(paths["source_pavlov"], paths["target_pavlov"], paths["alignments"], .2, .5, 1, workers = workers, seed = seed, **kwargs)
+    seconds = time.perf_counter() - start
+    outputs = []
+    for filename in (paths["source_pavlov"] + ".dnts5", paths["target_pavlov"] + ".dnts5"):
+        with open(filename, "rb") as f:
+            outputs.append(f.read())
+        os.remove(filename)
+    return outputs, seconds
+
+def check_make_dnts(n_sentences, command, workers, seed):
+    # make_dnts --forward/--reverse, symmetrized in the chunks of each worker, against -a with a symmetrized file
+    rng = random.Random(seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = write_corpus(tmp, n_sentences, quirks = ["numbers", "translit"], seed = seed)
+        forward, reverse = os.path.join(tmp, "forward.align"), os.path.join(tmp, "reverse.align")
+        with open(paths["alignments"], encoding = "utf-8") as f, open(paths["target"], encoding = "utf-8") as t, \
+             open(forward, "w", encoding = "utf-8") as out_forward, open(reverse, "w", encoding = "utf-8") as out_reverse:
+            for line, trg in zip(f, t):
+                links = parse_links(line)
+                out_forward.write(line)
+                out_reverse.write(format_links(perturb(links, max(len(trg.split()), 1), rng)) + "\n")
+        with open(forward, encoding = "utf-8") as f, open(reverse, encoding = "utf-8") as r, \
+             open(paths["alignments"], "w", encoding = "utf-8") as out:
+            out.writelines(format_links(links) + "\n" for links in symmetrize(f, r, command))
+
+        expected, reference = run_dnts(paths, 1, seed)
+        print(f"\nmake_dnts -a with a -c {command} file {reference:>6.2f}s")
+        for n in sorted({1, workers}):
+            outputs, seconds = run_dnts(paths, n, seed, forward = forward, reverse = reverse, symmetrize = command)
+            assert outputs == expected, f"make_dnts --forward/--reverse with {n} workers differs from -a"
+            print(f"make_dnts --forward/--reverse, -w {n} {seconds:>6.2f}s")
+
+
+def main(n_sentences, length, command, workers, seed):
+
+    failures = check_cases()
+    for failure in failures:
+        print(failure)
+    if failures:
+        raise AssertionError(f"{len(failures)} outputs differ from atools")
+    print(f"{len(CASES)} handcrafted cases identical to atools for {', '.join(HEURISTICS)}\n")
+
+    forward, reverse = make_directions(n_sentences, length, seed)
+    tangles = make_tangles(n_sentences, seed)
+    print(f"{'command':>20} {'seconds':>9} {'lines/sec':>11} {'grid sweep (s)':>15}")
+    for name in HEURISTICS:
+        start = time.perf_counter()
+        res = list(symmetrize(forward, reverse, name))
+        seconds = time.perf_counter() - start
+        if name not in SWEEPS:
+            print(f"{name:>20} {seconds:>9.2f} {n_sentences / seconds:>11,.0f} {'-':>15}")
+            continue
+        start = time.perf_counter()
+        expected = [SWEEPS[name](a, b) for a, b in zip(forward, reverse)]
+        sweep = time.perf_counter() - start
+        # parity: the worklist grows the same points as the grid sweep, on the corpus and on crowded grids
+        assert res == expected, f"-c {name} differs from the grid sweep on the synthetic corpus"
+        for a, b in tangles:
+            assert HEURISTICS[name](a, b) == SWEEPS[name](a, b), f"-c {name} differs from the grid sweep on {a} / {b}"
+        print(f"{name:>20} {seconds:>9.2f} {n_sentences / seconds:>11,.0f} {sweep:>15.2f}")
+    print(f"\ngrow-diag* identical to the grid sweep on the corpus and on {len(tangles):,} crowded grids")
+
+    check_make_dnts(n_sentences, command, workers, seed)
+    print("make_dnts outputs identical with --forward/--reverse and with -a")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Check the native symmetrization against atools outputs on handcrafted cases, grow-diag* against a grid sweep and make_dnts --forward/--reverse against -a, and time them")
+    parser.add_argument("-n", "--sentences", help = "Sentence pairs timed", default = 20_000)
+    parser.add_argument("-l", "--length", help = "Average sentence length (tokens)", default = 25)
+    parser.add_argument("-c", "--command", help = "Heuristic of the make_dnts runs", choices = list(HEURISTICS), default = "grow-diag-final-and")
+    parser.add_argument("-w", "--workers", help = "Worker processes of the make_dnts --forward/--reverse run", default = 2)
+    parser.add_argument("--seed", help = "Random seed", default = 0)
+
+    args = parser.parse_args()
+
+    main(int(args.sentences),
+         int(args.length),
+         args.command,
+         int(args.workers),
+         int(args.seed))
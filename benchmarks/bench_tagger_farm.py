@@ -0,0 +1,102 @@
+import os
+import sys
+import time
+import argparse
+import tempfile
+from functools import partial
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from pavlov_tagger_pickle import StandInTagger, tag_lines
+from tagger_farm import TaggerFarm
+from synthetic_corpus import make_corpus
+
+
+# ====== STAND-IN MODELS ====== #
+class SlowTagger(StandInTagger):
+    # burns `cost` seconds of CPU per sentence, as a model running on CPU does
+
+    def __init__(self, cost = 0.):
+        self.cost = cost
+
+    def __call__(self, sentences):
+        end = time.process_time() + self.cost * len(sentences)
+        while time.process_time() < end:
+            pass
+        return super().__call__(sentences)
+
+class CrashingTagger(StandInTagger):
+    # kills its process on the batches containing `marker`: once (the first time, flagged in a file) or always
+
+    def __init__(self, marker, flag_file = None):
+        self.marker = marker
+        self.flag_file = flag_file
+
+    def __call__(self, sentences):
+        if any(self.marker in sentence for sentence in sentences):
+            if self.flag_file is None:
+                os._exit(3)
+            if not os.path.exists(self.flag_file):
+                open(self.flag_file, "w").close()
+                os._exit(3)
+        return super().__call__(sentences)
+
+
+def make_pairs(n_sentences, seed):
+    return [(" ".join(word for word, _ in src), " ".join(word for word, _ in trg)) for src, trg, _ in make_corpus(n_sentences, seed = seed)]
+
+
+def main(n_sentences, workers, cost, batch_size, read_ahead, seed):
+
+    pairs = make_pairs(n_sentences, seed)
+
+    start = time.perf_counter()
+    expected = list(tag_lines(SlowTagger(cost), pairs, batch_size, read_ahead))
+    single = time.perf_counter() - start
+    print(f"single process: {n_sentences:,} pairs in {single:.2f} s ({n_sentences / single:,.1f} lines/sec)\n")
+
+    print(f"{'workers':>8} {'seconds':>9} {'lines/sec':>11} {'speedup':>9}")
+    for n in workers:
+        farm = TaggerFarm(partial(SlowTagger, cost), n, batch_size, read_ahead)
+        start = time.perf_counter()
+        res = list(farm.tag(pairs))
+        seconds = time.perf_counter() - start
+        assert res == expected, f"the farm with {n} workers changed the output"
+        print(f"{n:>8} {seconds:>9.2f} {n_sentences / seconds:>11,.1f} {single / seconds:>8.1f}x")
+    print()
+    farm.report()
+
+    # a worker killed in the middle of a window is replaced and the window tagged again
+    with tempfile.TemporaryDirectory() as tmp:
+        marker = pairs[len(pairs) // 2][0]
+        farm = TaggerFarm(partial(CrashingTagger, marker, os.path.join(tmp, "crashed")), max(workers), batch_size, read_ahead)
+        assert list(farm.tag(pairs)) == [pair for pair in tag_lines(StandInTagger(), pairs, batch_size, read_ahead)], "output changed after a crash"
+        assert sum(stats.restarts for stats in farm.stats) == 1, "the crashed worker was not restarted once"
+    print("\ncrash of a worker: restarted, output unchanged")
+
+    # a window that keeps killing workers stops the farm instead of looping
+    farm = TaggerFarm(partial(CrashingTagger, marker), 2, batch_size, read_ahead, max_retries = 2)
+    try:
+        list(farm.tag(pairs))
+    except RuntimeError as error:
+        print(f"poisoned window: {error}")
+    else:
+        raise AssertionError("a window crashing every worker did not stop the farm")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Check the tagging farm against single process tagging, with crashing workers, and time it")
+    parser.add_argument("-n", "--sentences", help = "Sentence pairs", default = 4_000)
+    parser.add_argument("-w", "--workers", help = "Comma separated worker counts", default = "1,2,4")
+    parser.add_argument("-c", "--cost", help = "Simulated CPU seconds per sentence of the stand-in model", default = .0005)
+    parser.add_argument("-b", "--batch-size", help = "Sentences per model call", default = 32)
+    parser.add_argument("-k", "--read-ahead", help = "Pairs per window", default = 256)
+    parser.add_argument("--seed", help = "Random seed of the corpus", default = 0)
+
+    args = parser.parse_args()
+
+    main(int(args.sentences),
+         [int(el) for el in args.workers.split(",")],
+         float(args.cost),
+         int(args.batch_size),
+         int(args.read_ahead),
+         int(args.seed))
@@ -0,0 +1,91 @@
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+from contextlib import redirect_stdout
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+import pavlov_tagger_pickle
+from pavlov_tagger_pickle import StandInTagger, tag_lines
+from pavlov_binary import load_pavlov
+from synthetic_corpus import write_corpus
+
+
+class CountingTagger(StandInTagger):
+    # stand-in tagger counting model calls and the tokens a padded batch costs
+
+    def __init__(self, max_batch = None):
+        self.max_batch = max_batch
+        self.calls = self.tokens = self.padded = 0
+
+    def __call__(self, sentences):
+        assert self.max_batch is None or len(sentences) <= self.max_batch, f"batch of {len(sentences)} sentences over -b {self.max_batch}"
+        lengths = [len(sentence.split()) for sentence in sentences]
+        self.calls += 1
+        self.tokens += sum(lengths)
+        self.padded += max(lengths, default = 0) * len(lengths)
+        return super().__call__(sentences)
+
+
+def read_lines(paths):
+    with open(paths["source"], encoding = "utf-8") as s, open(paths["target"], encoding = "utf-8") as t:
+        return [(src.rstrip("\n"), trg.rstrip("\n")) for src, trg in zip(s, t)]
+
+
+def main(n_sentences, batch_sizes, read_aheads, seed):
+
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = write_corpus(tmp, n_sentences, quirks = ["numbers", "translit"], seed = seed)
+        pairs = read_lines(paths)
+        # lines of very different lengths, next to each other
+        rng = random.Random(seed)
+        for _ in range(n_sentences // 100):
+            k = rng.randrange(len(pairs))
+            pairs.insert(k, ("", "Roma"))
+            pairs.insert(k, (" ".join(pairs[k][0] for _ in range(5)), pairs[k][1]))
+
+        # the previous loop: one model call per line, source and target together
+        reference_tagger = CountingTagger()
+        start = time.perf_counter()
+        expected = [tuple(reference_tagger([src, trg])) for src, trg in pairs]
+        reference = time.perf_counter() - start
+
+        print(f"{len(pairs):,} line pairs\n")
+        print(f"{'-b':>5} {'-k':>6} {'model calls':>12} {'padding':>8} {'seconds':>9}")
+        print(f"{'per line':>12} {reference_tagger.calls:>12,} {1 - reference_tagger.tokens / reference_tagger.padded:>8.1%} {reference:>9.2f}")
+        for batch_size in batch_sizes:
+            for read_ahead in read_aheads:
+                tagger = CountingTagger(batch_size)
+                start = time.perf_counter()
+                tagged = list(tag_lines(tagger, iter(pairs), batch_size, read_ahead))
+                seconds = time.perf_counter() - start
+                # parity: every line back in its input order with the tags of the one-pair call
+                assert tagged == expected, f"tags with -b {batch_size} -k {read_ahead} differ from one call per line"
+                print(f"{batch_size:>5} {read_ahead:>6} {tagger.calls:>12,} {1 - tagger.tokens / tagger.padded:>8.1%} {seconds:>9.2f}")
+
+        # the script end to end: .pavlov outputs of a batched run hold the same sentences as the unbatched one
+        outputs = []
+        for batch_size, read_ahead in ((1, 1), (max(batch_sizes), max(read_aheads))):
+            with redirect_stdout(open(os.devnull, "w")):
+                pavlov_tagger_pickle.main(paths["source"], paths["target"], 10_000, tagger = "standin", batch_size = batch_size, read_ahead = read_ahead)
+            outputs.append((list(load_pavlov(paths["source_pavlov"])), list(load_pavlov(paths["target_pavlov"]))))
+        assert outputs[0] == outputs[1], "pavlov_tagger_pickle.py outputs differ between -b 1 -k 1 and batched runs"
+        assert list(zip(*outputs[0])) == [tuple(StandInTagger()(list(pair))) for pair in read_lines(paths)], "pavlov_tagger_pickle.py outputs differ from one call per line"
+    print("\ntags identical to one model call per line for every -b/-k, also through pavlov_tagger_pickle.py")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Check batched, length-bucketed tagging against one model call per line with the stand-in tagger, and count model calls and padding")
+    parser.add_argument("-n", "--sentences", help = "Line pairs of the synthetic corpus", default = 20_000)
+    parser.add_argument("-b", "--batch-sizes", help = "Comma separated batch sizes", default = "1,7,32,128")
+    parser.add_argument("-k", "--read-aheads", help = "Comma separated read-ahead windows", default = "1,100,1024")
+    parser.add_argument("--seed", help = "Random seed", default = 0)
+
+    args = parser.parse_args()
+
+    main(int(args.sentences),
+         [int(el) for el in args.batch_sizes.split(",")],
+         [int(el) for el in args.read_aheads.split(",")],
+         int(args.seed))
@@ -0,0 +1,72 @@
+import os
+import sys
+import time
+import argparse
+import tempfile
+from contextlib import redirect_stdout
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+import make_dnts_algorithm3 as dnts
+from synthetic_corpus import write_corpus
+
+
+def run(paths, probability, augment_prob, seed, workers, variants = None):
+    start = time.perf_counter()
+    with redirect_stdout(open(os.devnull, "w")):
+        dnts.main(paths["source_pavlov"], paths["target_pavlov"], paths["alignments"], probability, augment_prob, 1,
+                  workers = workers, seed = seed, variants = variants)
+    return time.perf_counter() - start
+
+def read(filename):
+    with open(filename, "rb") as f:
+        return f.read()
+
+
+def main(n_sentences, length, specs, workers, seed):
+
+    variants = [dnts.parse_variant(spec, seed) for spec in specs]
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = write_corpus(tmp, n_sentences, length, quirks = ["numbers", "translit", "retag"], seed = seed)
+        outputs = {"source": paths["source_pavlov"], "target": paths["target_pavlov"]}
+
+        # one standalone run per setting, outputs and logs moved aside
+        standalone = 0
+        for label, probability, augment_prob, variant_seed in variants:
+            standalone += run(paths, probability, augment_prob, variant_seed, workers)
+            for side, pavlov in outputs.items():
+                os.replace(pavlov + ".dnts5", os.path.join(tmp, f"{side}.{label}.expected"))
+            if os.path.exists(os.path.join(tmp, "alignments4.log")):
+                os.replace(os.path.join(tmp, "alignments4.log"), os.path.join(tmp, f"log.{label}.expected"))
+
+        single_pass = run(paths, 0, 0, seed, workers, variants)
+
+        # parity: every variant byte-identical to its standalone run, logs included
+        for label, *_ in variants:
+            for side, pavlov in outputs.items():
+                assert read(f"{pavlov}.{label}.dnts5") == read(os.path.join(tmp, f"{side}.{label}.expected")), f"{side} output of {label} differs"
+            expected_log = os.path.join(tmp, f"log.{label}.expected")
+            if os.path.exists(expected_log):
+                assert read(os.path.join(tmp, f"alignments4.{label}.log")) == read(expected_log), f"alignments log of {label} differs"
+
+    print(f"{len(variants)} variants on {n_sentences:,} sentence pairs, outputs identical to the standalone runs\n")
+    print(f"{'standalone runs (s)':>20} {'single pass (s)':>16} {'speedup':>9}")
+    print(f"{standalone:>20.2f} {single_pass:>16.2f} {standalone / single_pass:>8.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Check make_dnts --variants against one standalone run per setting and compare their speed")
+    parser.add_argument("-n", "--sentences", help = "Sentence pairs of the synthetic corpus", default = 20_000)
+    parser.add_argument("-l", "--length", help = "Average sentence length (tokens)", default = 25)
+    parser.add_argument("-v", "--variants", help = "Settings as probability:augment[:seed]", nargs = "+",
+                        default = [":.5", ".2:.5", ".5:.5", ".2:.8", ".5:.8:1"])
+    parser.add_argument("-w", "--workers", help = "Worker processes of each run", default = 1)
+    parser.add_argument("--seed", help = "Random seed of the corpus and default seed of the variants", default = 0)
+
+    args = parser.parse_args()
+
+    main(int(args.sentences),
+         int(args.length),
+         args.variants,
+         int(args.workers),
+         int(args.seed))
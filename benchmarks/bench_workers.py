@@ -0,0 +1,74 @@
+import io
+import os
+import sys
+import time
+import argparse
+import tempfile
+from contextlib import redirect_stdout
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+import make_dnts_algorithm3 as dnts
+from synthetic_corpus import write_corpus
+
+
+def run(paths, probability, augment_prob, workers, chunk_size, seed):
+    # outputs, alignment log and the printed DNT totals of one run
+    stdout = io.StringIO()
+    start = time.perf_counter()
+    with redirect_stdout(stdout):
+        dnts.main(paths["source_pavlov"], paths["target_pavlov"], paths["alignments"], probability, augment_prob, 1,
+                  workers = workers, seed = seed, chunk_size = chunk_size)
+    seconds = time.perf_counter() - start
+    outputs = []
+    for filename in (paths["source_pavlov"] + ".dnts5", paths["target_pavlov"] + ".dnts5",
+                     os.path.join(os.path.dirname(paths["source_pavlov"]), "alignments4.log")):
+        with open(filename, "rb") as f:
+            outputs.append(f.read())
+        os.remove(filename)
+    totals = [line for line in stdout.getvalue().splitlines() if line.startswith(("DNTs in each corpora", "Entities ="))]
+    return outputs, totals, seconds
+
+
+def main(n_sentences, workers, chunk_sizes, probability, augment_prob, seed):
+
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = write_corpus(tmp, n_sentences, quirks = ["numbers", "translit", "retag", "dnt"], seed = seed)
+
+        # the single process run with the default chunks is the reference
+        expected, expected_totals, reference = run(paths, probability, augment_prob, 1, 2_000, seed)
+        print(f"{n_sentences:,} sentence pairs, -p {probability} -g {augment_prob}: {expected_totals[0]}\n")
+        print(f"{'workers':>8} {'chunk size':>11} {'seconds':>9} {'speedup':>9}")
+        print(f"{1:>8} {2_000:>11,} {reference:>9.2f} {1:>8.1f}x")
+        for n in workers:
+            for chunk_size in chunk_sizes:
+                outputs, totals, seconds = run(paths, probability, augment_prob, n, chunk_size, seed)
+                # parity: byte-identical outputs and log, same totals, whatever the split
+                for name, got, wanted in zip(("source .dnts5", "target .dnts5", "alignments4.log"), outputs, expected):
+                    assert got == wanted, f"{name} with {n} workers and chunks of {chunk_size} differs from the single process run"
+                assert totals == expected_totals, f"totals with {n} workers and chunks of {chunk_size} differ: {totals} != {expected_totals}"
+                print(f"{n:>8} {chunk_size:>11,} {seconds:>9.2f} {reference / seconds:>8.1f}x")
+
+        # a different seed has to change the output, or the per-line generators are not used
+        outputs, _, _ = run(paths, probability, augment_prob, 1, 2_000, seed + 1)
+        assert outputs[:2] != expected[:2], "--seed does not change the output"
+    print(f"\noutputs, alignment log and totals identical with {', '.join(map(str, workers))} workers and chunks of {', '.join(map(str, chunk_sizes))} lines")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Check that make_dnts --workers runs are byte-identical to the single process run for any worker count and chunk size, and time them")
+    parser.add_argument("-n", "--sentences", help = "Sentence pairs of the synthetic corpus", default = 20_000)
+    parser.add_argument("-w", "--workers", help = "Comma separated worker counts", default = "1,2,4")
+    parser.add_argument("-c", "--chunk-sizes", help = "Comma separated chunk sizes", default = "97,2000")
+    parser.add_argument("-p", "--probability", help = "Probability filter of the runs", default = .2)
+    parser.add_argument("-g", "--augment", help = "Augment probability of the runs", default = .5)
+    parser.add_argument("--seed", help = "Random seed of the corpus and of the runs", default = 0)
+
+    args = parser.parse_args()
+
+    main(int(args.sentences),
+         [int(el) for el in args.workers.split(",")],
+         [int(el) for el in args.chunk_sizes.split(",")],
+         float(args.probability),
+         float(args.augment),
+         int(args.seed))
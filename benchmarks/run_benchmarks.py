@@ -0,0 +1,220 @@
+"""
+Times every stage of the pipeline on synthetic corpora of several sizes and stores the
+results as JSON, so that two runs (e.g. two commits) can be compared:
+
+    python benchmarks/run_benchmarks.py -o before.json
+    python benchmarks/run_benchmarks.py -o after.json --compare before.json
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+import subprocess
+from contextlib import redirect_stdout
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "src"))
+sys.path.insert(0, os.path.join(ROOT, "utils"))
+import make_dnts_algorithm3 as dnts
+import shuffle_corpora
+import check_dnt
+from synthetic_corpus import write_corpus, timeit
+
+
+# ====== FIXTURES ====== #
+def make_fixture(output_dir, n_sentences, length, entity_density, quirks, seed):
+    paths = write_corpus(output_dir, n_sentences, length, entity_density, quirks, seed)
+    dnts.lng_trg = "it"
+    with open(paths["source"], "r") as source, open(paths["target"], "r") as target, open(paths["alignments"], "r") as align:
+        sources, targets, align_lines = source.readlines(), target.readlines(), align.readlines()
+    rows = list(zip(dnts.load_pickle(paths["source_pavlov"]), sources,
+                    dnts.load_pickle(paths["target_pavlov"]), targets,
+                    [dnts.make_tuple(line.strip().split()) for line in align_lines]))
+
+    # DNT outputs, the input of dnt_augment and check_dnt
+    outputs = [dnts.make_dnt_BIO(*row, [], 0, 0, rng = random.Random(i)) for i, row in enumerate(rows)]
+    paths["dnts"] = os.path.join(output_dir, "dnts")
+    with open(paths["dnts"], "w") as f:
+        f.writelines(src + "\n" for src, _ in outputs)
+
+    return {"paths": paths, "rows": rows, "align_lines": align_lines, "outputs": outputs, "tmp": output_dir}
+
+
+# ====== BENCHMARKS ====== #
+# each one returns (function to time, number of items it processes)
+def bench_make_tuple(fixture):
+    lines = fixture["align_lines"]
+    return lambda: [dnts.make_tuple(line.strip().split()) for line in lines], len(lines)
+
+def bench_make_dnt_BIO(fixture):
+    rows = fixture["rows"]
+    def run():
+        dnts.decision_cache = dnts.DecisionCache()
+        for i, row in enumerate(rows):
+            dnts.make_dnt_BIO(*row, [], 0, .5, rng = random.Random(i))
+    return run, len(rows)
+
+def bench_make_dnt_BIO_batch(fixture):
+    rows = fixture["rows"]
+    def run():
+        dnts.decision_cache = dnts.DecisionCache()
+        for start in range(0, len(rows), 2_000):
+            batch = rows[start:start + 2_000]
+            dnts.make_dnt_BIO_batch(batch, 0, .5, rngs = [random.Random(i) for i in range(start, start + len(batch))])
+    return run, len(rows)
+
+def bench_make_dnt_BIO_variants(fixture):
+    # three -p/-g settings in one pass
+    rows = fixture["rows"]
+    variants = [(0, .5, 0), (.5, .5, 0), (.8, .2, 1)]
+    def run():
+        dnts.decision_cache = dnts.DecisionCache()
+        for start in range(0, len(rows), 2_000):
+            dnts.make_dnt_BIO_variants(rows[start:start + 2_000], variants, start)
+    return run, len(rows)
+
+def bench_transform_string(fixture):
+    strings = [" ".join(word for word, _ in trg) for _, _, trg, _, _ in fixture["rows"]]
+    return lambda: [dnts.transform_string(string) for string in strings], len(strings)
+
+def bench_levenshtein_distance(fixture):
+    # entity words against the words of their target sentence, as the matching step compares them
+    pairs = [(dnts.normalize_word(src_word), dnts.normalize_word(trg_word))
+             for src, _, trg, _, _ in fixture["rows"][:2_000]
+             for src_word, src_tag in src if src_tag != "O"
+             for trg_word, _ in trg[:10]]
+    return lambda: [dnts.levenshtein_distance(s1, s2) for s1, s2 in pairs], len(pairs)
+
+def bench_dnt_augment(fixture):
+    outputs = [(src, trg) for src, trg in fixture["outputs"] if "{DNT0}" in src]
+    def run():
+        rng = random.Random(0)
+        for src, trg in outputs:
+            dnts.dnt_augment(src, trg, .5, [], rng)
+    return run, len(outputs)
+
+def bench_load_pickle(fixture):
+    paths = fixture["paths"]
+    return lambda: [sum(1 for _ in dnts.load_pickle(paths[key])) for key in ("source_pavlov", "target_pavlov")], 2 * len(fixture["rows"])
+
+def bench_shuffle_corpora(fixture):
+    paths, tmp = fixture["paths"], fixture["tmp"]
+    def run():
+        with redirect_stdout(open(os.devnull, "w")):
+            shuffle_corpora.main(paths["source"], paths["target"], os.path.join(tmp, "shuf_src"), os.path.join(tmp, "shuf_trg"), seed = 0)
+    return run, len(fixture["rows"])
+
+def bench_check_dnt(fixture):
+    paths = fixture["paths"]
+    def run():
+        stats = check_dnt.new_stats()
+        for chunk_stats in check_dnt.run_chunks(check_dnt.read_chunks([paths["dnts"], paths["dnts"]], 50_000), 1, (20, 0)):
+            check_dnt.merge_stats(stats, chunk_stats, 20)
+    return run, len(fixture["rows"])
+
+BENCHMARKS = {"make_tuple": bench_make_tuple,
+              "make_dnt_BIO": bench_make_dnt_BIO,
+              "make_dnt_BIO_batch": bench_make_dnt_BIO_batch,
+              "make_dnt_BIO_variants": bench_make_dnt_BIO_variants,
+              "transform_string": bench_transform_string,
+              "levenshtein_distance": bench_levenshtein_distance,
+              "dnt_augment": bench_dnt_augment,
+              "load_pickle": bench_load_pickle,
+              "shuffle_corpora": bench_shuffle_corpora,
+              "check_dnt": bench_check_dnt}
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd = ROOT, capture_output = True, text = True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+# ====== COMPARE ====== #
+def compare(results, baseline_file, threshold):
+    # ratio of the new time over the baseline one, per benchmark and scale
+    with open(baseline_file, "r") as f:
+        baseline = {(res["benchmark"], res["sentences"]): res for res in json.load(f)["results"]}
+
+    print(f"\n{'benchmark':>22} {'sentences':>10} {'baseline (s)':>13} {'now (s)':>10} {'ratio':>7}")
+    regressions = []
+    for res in results:
+        old = baseline.get((res["benchmark"], res["sentences"]))
+        if old is None:
+            continue
+        ratio = res["seconds"] / old["seconds"]
+        flag = "  REGRESSION" if ratio > threshold else ""
+        print(f"{res['benchmark']:>22} {res['sentences']:>10,} {old['seconds']:>13.4f} {res['seconds']:>10.4f} {ratio:>6.2f}x{flag}")
+        if flag:
+            regressions.append(res)
+    return regressions
+
+
+def main(scales, benchmarks, length, entity_density, quirks, repeat, seed, output, baseline, threshold):
+
+    results = []
+    print(f"{'benchmark':>22} {'sentences':>10} {'items':>10} {'seconds':>10} {'items/s':>12}")
+    for n_sentences in scales:
+        with tempfile.TemporaryDirectory() as tmp:
+            fixture = make_fixture(tmp, n_sentences, length, entity_density, quirks, seed)
+            for name in benchmarks:
+                func, items = BENCHMARKS[name](fixture)
+                seconds = timeit(func, repeat)
+                results.append({"benchmark": name,
+                                "sentences": n_sentences,
+                                "items": items,
+                                "seconds": seconds,
+                                "items_per_second": items / seconds if seconds else None})
+                print(f"{name:>22} {n_sentences:>10,} {items:>10,} {seconds:>10.4f} {items / max(seconds, 1e-9):>12,.0f}")
+
+    report = {"meta": {"revision": git_revision(),
+                       "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                       "python": platform.python_version(),
+                       "platform": platform.platform(),
+                       "corpus": {"length": length, "entity_density": entity_density, "quirks": quirks, "seed": seed},
+                       "repeat": repeat},
+              "results": results}
+    if output:
+        with open(output, "w") as f:
+            json.dump(report, f, indent = 2)
+        print(f"\nResults -> {output}")
+
+    if baseline:
+        regressions = compare(results, baseline, threshold)
+        if regressions:
+            print(f"\n{len(regressions)} benchmarks slower than {threshold:.2f}x the baseline")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Time the pipeline stages on synthetic corpora, store and compare the results as JSON")
+    parser.add_argument("-n", "--scales", help = "Comma separated corpus sizes (sentence pairs)", default = "1000,10000")
+    parser.add_argument("-b", "--benchmarks", help = "Benchmarks to run (all by default)", nargs = "*", choices = list(BENCHMARKS), default = list(BENCHMARKS))
+    parser.add_argument("-l", "--length", help = "Average sentence length (tokens)", default = 25)
+    parser.add_argument("-d", "--entity-density", help = "Probability of an entity at each source position", default = .1)
+    parser.add_argument("-q", "--quirks", help = "Language pair quirks of the synthetic corpus", nargs = "*", default = ["numbers", "translit", "retag"])
+    parser.add_argument("-r", "--repeat", help = "Repetitions, best time is reported", default = 3)
+    parser.add_argument("--seed", help = "Random seed of the corpus", default = 0)
+    parser.add_argument("-o", "--output", help = "JSON file for the results", default = None)
+    parser.add_argument("-c", "--compare", help = "Baseline JSON results, exits with an error on regressions", default = None)
+    parser.add_argument("-t", "--threshold", help = "Slowdown ratio over the baseline reported as a regression", default = 1.2)
+
+    args = parser.parse_args()
+
+    main([int(el) for el in args.scales.split(",")],
+         args.benchmarks,
+         int(args.length),
+         float(args.entity_density),
+         args.quirks,
+         int(args.repeat),
+         int(args.seed),
+         args.output,
+         args.compare,
+         float(args.threshold))
@@ -0,0 +1,84 @@
+import os
+import re
+import sys
+import time
+import argparse
+import statistics
+import subprocess
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# entry points started with --help, which must not pull any heavy dependency
+SCRIPTS = ["make_dnts_algorithm3.py",
+           "dnt_pipeline.py",
+           "src/pavlov_tagger_pickle.py",
+           "src/merge_and_fast_align.py",
+           "src/ibm2_aligner.py",
+           "src/pavlov_binary.py",
+           "src/alignment_cache.py",
+           "src/symmetrize.py",
+           "utils/check_dnt.py",
+           "utils/shuffle_corpora.py"]
+
+IMPORT_TIME = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def run(command):
+    start = time.perf_counter()
+    process = subprocess.run(command, cwd = ROOT, capture_output = True, text = True)
+    return time.perf_counter() - start, process
+
+def top_imports(stderr, top):
+    # modules imported directly by the script, by cumulative time (us)
+    res = []
+    for self_us, cumulative_us, indent, module in IMPORT_TIME.findall(stderr):
+        if len(indent) == 1:
+            res.append((int(cumulative_us), module))
+    return sorted(res, reverse = True)[:top]
+
+
+def main(scripts, repeat, budget_ms, top):
+
+    baseline = statistics.median(run([sys.executable, "-c", "pass"])[0] for _ in range(repeat))
+    print(f"interpreter startup: {baseline * 1000:.0f} ms\n")
+
+    failures = []
+    for script in scripts:
+        times = []
+        for _ in range(repeat):
+            seconds, process = run([sys.executable, "-X", "importtime", script, "--help"])
+            times.append(seconds)
+            if process.returncode != 0:
+                break
+
+        if process.returncode != 0:
+            error = process.stderr.strip().splitlines()[-1] if process.stderr.strip() else f"exit code {process.returncode}"
+            print(f"{script}: FAILED ({error})\n")
+            failures.append(script)
+            continue
+
+        median_ms = statistics.median(times) * 1000
+        over = median_ms > budget_ms
+        print(f"{script}: {median_ms:.0f} ms{'  OVER BUDGET' if over else ''}")
+        for cumulative_us, module in top_imports(process.stderr, top):
+            print(f"    {cumulative_us / 1000:>8.1f} ms  {module}")
+        print()
+        if over:
+            failures.append(script)
+
+    if failures:
+        print(f"{len(failures)} of {len(scripts)} entry points over the {budget_ms} ms budget or failing: {', '.join(failures)}")
+        sys.exit(1)
+    print(f"all {len(scripts)} entry points within the {budget_ms} ms budget")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Import and startup time of every CLI entry point, fails over budget")
+    parser.add_argument("scripts", nargs = "*", help = "Scripts to time, relative to the repository root (all entry points by default)")
+    parser.add_argument("-b", "--budget-ms", help = "Maximum median startup time of a script (ms)", default = 300)
+    parser.add_argument("-r", "--repeat", help = "Runs per script, the median is reported", default = 5)
+    parser.add_argument("-k", "--top", help = "Slowest direct imports shown per script", default = 5)
+
+    args = parser.parse_args()
+
+    main(args.scripts or SCRIPTS, int(args.repeat), float(args.budget_ms), int(args.top))
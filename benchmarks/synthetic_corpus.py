@@ -0,0 +1,177 @@
+"""
+Synthetic parallel corpora for the benchmarks: raw text, BIO-tagged .pavlov files and
+symmetrized `i-j` alignments, with controllable size, sentence length, entity density
+and a few language pair quirks, and the timing helper the benchmarks share.
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from pavlov_binary import open_pavlov_writer
+
+WORDS = ["the", "house", "of", "said", "on", "Monday", "it", "would", "be", "a", "new", "report", "after", "years",
+         "council", "market", "with", "their", "first", "water", "people", "from", "about", "which", "between"]
+PUNCTUATION = [",", ".", "(", ")", "-", ":", "%", '"', ";", "?"]
+NAMES = {"PERSON": ["Mario", "Rossi", "Anna", "Smith", "John", "Dubois", "Ahmed", "Khan", "Müller"],
+         "GPE": ["Rome", "Paris", "Italy", "New", "York", "Lahore", "Zürich"],
+         "LOC": ["Alps", "Danube", "Sahara", "Mont", "Blanc"],
+         "ORG": ["NATO", "European", "Union", "Bank", "UNESCO", "Google"],
+         "FAC": ["Colosseum", "Heathrow", "Louvre"],
+         "NORP": ["Italian", "French", "Pakistani"],
+         "DATE": ["2019", "May", "Tuesday"],
+         "MISC": ["Covid", "Euro"]}
+URDU_WORDS = ["کتاب", "پانی", "شہر", "لوگ", "بازار", "سال"]
+URDU_MARKS = "ًٌٍَُِْ"
+
+# language pair quirks the target side can be generated with
+QUIRKS = {
+    "ur": "non latin target words with detached diacritics",
+    "numbers": "numbers split by the tokenizer, as in 1 . 5 or 10 , 000",
+    "translit": "target entities spelled differently (accents, dropped or changed letters)",
+    "dnt": "lines that already contain ${DNT0} tags",
+    "retag": "target entities tagged with another entity type or without the I- continuation",
+}
+
+
+def misspell(word, rng):
+    choice = rng.randrange(3)
+    if choice == 0:
+        return word.replace("ü", "u").replace("é", "e") if not word.isascii() else word[:-1]
+    if choice == 1:
+        return word + rng.choice("aeiou")
+    return word[0] + word[1:].replace(rng.choice(word[1:] or word), "y", 1)
+
+def make_sentence_pair(rng, length, entity_density, quirks):
+    """
+    (src tokens, trg tokens, alignments): tokens are (word, BIO tag) tuples, the target is
+    a noisy copy of the source and the links follow it.
+    """
+    src, trg, alignments = [], [], []
+    n_tokens = max(1, int(rng.gauss(length, length / 3)))
+    while len(src) < n_tokens:
+        if rng.random() < entity_density:
+            entity_type = rng.choice(list(NAMES))
+            words = rng.choices(NAMES[entity_type], k = rng.choice([1, 1, 1, 2, 2, 3]))
+            trg_type = rng.choice(list(NAMES)) if "retag" in quirks and rng.random() < .15 else entity_type
+            for k, word in enumerate(words):
+                src.append((word, ("B-" if k == 0 else "I-") + entity_type))
+                trg_word = misspell(word, rng) if "translit" in quirks and rng.random() < .3 else word
+                continuation = "O" if "retag" in quirks and rng.random() < .1 else "I-" + trg_type
+                alignments.append((len(src) - 1, len(trg)))
+                trg.append((trg_word, "B-" + trg_type if k == 0 else continuation))
+            continue
+
+        if "numbers" in quirks and rng.random() < .03:
+            tokens = [str(rng.randint(1, 99)), rng.choice(".,"), str(rng.randint(0, 999))]
+        elif "dnt" in quirks and rng.random() < .02:
+            tokens = ["${DNT0}" + str(rng.randrange(10))]
+        elif rng.random() < .1:
+            tokens = [rng.choice(PUNCTUATION)]
+        else:
+            tokens = [rng.choice(WORDS)]
+
+        for token in tokens:
+            src.append((token, "O"))
+            if rng.random() < .1:    # dropped in translation
+                continue
+            if "ur" in quirks and token.isalpha() and rng.random() < .5:
+                trg.append((rng.choice(URDU_WORDS), "O"))
+                if rng.random() < .2:
+                    trg.append((rng.choice(URDU_MARKS), "O"))
+            else:
+                trg.append((token, "O"))
+            alignments.append((len(src) - 1, len(trg) - 1))
+
+    if not trg:
+        trg.append((src[0][0], "O"))
+        alignments.append((0, 0))
+    # a few wrong links around the diagonal, as a real aligner makes
+    for _ in range(int(len(src) * .1)):
+        i = rng.randrange(len(src))
+        alignments.append((i, min(len(trg) - 1, max(0, i * len(trg) // len(src) + rng.randint(-2, 2)))))
+    return src, trg, sorted(set(alignments))
+
+def make_corpus(n_sentences, length = 25, entity_density = .1, quirks = (), seed = 0):
+    rng = random.Random(seed)
+    for _ in range(n_sentences):
+        yield make_sentence_pair(rng, length, entity_density, quirks)
+
+def make_rows(n_sentences, length = 25, entity_density = .1, quirks = (), seed = 0):
+    # (src, src line, trg, trg line, alignments) rows, as make_dnt_BIO takes them
+    return [(src, " ".join(w for w, _ in src) + "\n", trg, " ".join(w for w, _ in trg) + "\n", alignments)
+            for src, trg, alignments in make_corpus(n_sentences, length, entity_density, quirks, seed)]
+
+def format_alignments(alignments):
+    return " ".join(f"{i}-{j}" for i, j in alignments)
+
+def timeit(func, repeat = 3):
+    # best of `repeat` runs of func(), in seconds
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def write_corpus(output_dir, n_sentences, length = 25, entity_density = .1, quirks = (), seed = 0,
+                 src_lang = "en", trg_lang = "it", prefix = "train", binary = False):
+    """
+    Writes <prefix>.<src>-<trg>.<src|trg> raw files, their .pavlov files and <prefix>.<src>-<trg>.align,
+    named as make_dnts_algorithm3.py expects them. Returns the paths.
+    """
+    os.makedirs(output_dir, exist_ok = True)
+    base = os.path.join(output_dir, f"{prefix}.{src_lang}-{trg_lang}.")
+    paths = {"source": base + src_lang,
+             "target": base + trg_lang,
+             "source_pavlov": base + src_lang + ".pavlov",
+             "target_pavlov": base + trg_lang + ".pavlov",
+             "alignments": base + "align"}
+
+    with open(paths["source"], "w") as source, \
+         open(paths["target"], "w") as target, \
+         open(paths["alignments"], "w") as align, \
+         open_pavlov_writer(paths["source_pavlov"], binary) as source_pavlov, \
+         open_pavlov_writer(paths["target_pavlov"], binary) as target_pavlov:
+
+        for src, trg, alignments in make_corpus(n_sentences, length, entity_density, quirks, seed):
+            source.write(" ".join(word for word, _ in src) + "\n")
+            target.write(" ".join(word for word, _ in trg) + "\n")
+            align.write(format_alignments(alignments) + "\n")
+            source_pavlov.write(src)
+            target_pavlov.write(trg)
+    return paths
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Generate a synthetic tagged parallel corpus with its alignments")
+    parser.add_argument("-o", "--output-dir", help = "Output folder", required = True)
+    parser.add_argument("-n", "--sentences", help = "Sentence pairs", default = 10_000)
+    parser.add_argument("-l", "--length", help = "Average source sentence length (tokens)", default = 25)
+    parser.add_argument("-d", "--entity-density", help = "Probability of an entity at each source position", default = .1)
+    parser.add_argument("-q", "--quirks", help = "Language pair quirks: " + ", ".join(f"{k} ({v})" for k, v in QUIRKS.items()),
+                        nargs = "*", choices = list(QUIRKS), default = [])
+    parser.add_argument("--src-lang", help = "Source language code used in the file names", default = "en")
+    parser.add_argument("--trg-lang", help = "Target language code used in the file names", default = "it")
+    parser.add_argument("--prefix", help = "File name prefix", default = "train")
+    parser.add_argument("-f", "--format", help = "Format of the .pavlov files", choices = ["pickle", "binary"], default = "pickle")
+    parser.add_argument("--seed", help = "Random seed", default = 0)
+
+    args = parser.parse_args()
+
+    paths = write_corpus(args.output_dir,
+                         int(args.sentences),
+                         int(args.length),
+                         float(args.entity_density),
+                         args.quirks,
+                         int(args.seed),
+                         args.src_lang,
+                         args.trg_lang,
+                         args.prefix,
+                         args.format == "binary")
+    for name, path in paths.items():
+        print(f"{name:>14} -> {path}")
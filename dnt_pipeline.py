@@ -0,0 +1,473 @@
+"""
+Raw parallel text -> DNT corpora in one command:
+
+    read -> tag -> .pavlov (+ aligner corpus) | align + symmetrize | make_dnt_BIO -> .dnts5
+
+Stages are generators, each running in its own thread and handing items to the next
+one through a bounded queue, so a slow stage holds back the others instead of letting
+intermediate results pile up in memory. Alignment is the only barrier: EM needs the
+whole corpus before it can emit the first link.
+Only the tagged corpora and the DNT outputs are written to disk.
+
+With a shard store (--shards) the run is incremental instead: the corpora are cut in
+fixed-size shards, each stage's output of every shard is kept in the store under a hash
+of its inputs and settings, and only the shards whose hash changed are computed again.
+"""
+
+import os
+import sys
+import time
+import argparse
+import shutil
+import threading
+from queue import Queue
+from collections import Counter
+from itertools import chain, count, islice
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+import make_dnts_algorithm3 as dnts
+from pavlov_binary import open_pavlov_writer, load_pavlov
+from pavlov_tagger_pickle import TAGGERS, tag_lines
+from symmetrize import symmetrize, parse_links, format_links, COMMANDS
+from corpus_io import open_text, add_suffix, split_compression, is_compressed
+from shard_manifest import ShardStore, digest, SHARD_SIZE
+
+END = object()
+
+
+# ====== STAGES ====== #
+class StageStats:
+    __slots__ = ("name", "items", "start", "end", "put_wait", "get_wait")
+
+    def __init__(self, name):
+        self.name = name
+        self.items = 0
+        self.start = self.end = None
+        self.put_wait = 0.    # producer blocked on a full queue: backpressure from downstream
+        self.get_wait = 0.    # consumer blocked on an empty queue: this stage is the bottleneck
+
+    def report(self):
+        elapsed = max((self.end or time.perf_counter()) - self.start, 1e-9)
+        return (f"{self.name:>8}: {self.items:>10,} items {self.items / elapsed:>10,.0f}/s"
+                f" - blocked by downstream {self.put_wait:6.1f}s ({self.put_wait / elapsed:4.0%})"
+                f" - downstream starved {self.get_wait:6.1f}s")
+
+class StageError:
+    def __init__(self, error):
+        self.error = error
+
+def threaded(name, items, queue_size, stages):
+    """
+    Runs the iterator `items` in a thread and yields its items through a bounded queue.
+    Errors in the thread are raised again in the consumer.
+    """
+    stats = StageStats(name)
+    stages.append(stats)
+    queue = Queue(queue_size)
+
+    def produce():
+        stats.start = time.perf_counter()
+        try:
+            for item in items:
+                start = time.perf_counter()
+                queue.put(item)
+                stats.put_wait += time.perf_counter() - start
+                stats.items += 1
+        except BaseException as error:
+            queue.put(StageError(error))
+            return
+        finally:
+            stats.end = time.perf_counter()
+        queue.put(END)
+
+    def consume():
+        while True:
+            start = time.perf_counter()
+            item = queue.get()
+            stats.get_wait += time.perf_counter() - start
+            if item is END:
+                return
+            if isinstance(item, StageError):
+                raise item.error
+            yield item
+
+    threading.Thread(target = produce, name = name, daemon = True).start()
+    return consume()
+
+
+def read_text_pairs(source_file, target_file):
+    with open_text(source_file, "r") as source, open_text(target_file, "r") as target:
+        for src_line, trg_line in zip(source, target):
+            yield src_line.rstrip("\r\n"), trg_line.rstrip("\r\n")
+
+def write_pavlov(tagged, source_pavlov, target_pavlov, binary):
+    # persists the tagged corpora and passes the words on to the aligner
+    with open_pavlov_writer(source_pavlov, binary) as out_src, \
+         open_pavlov_writer(target_pavlov, binary) as out_trg:
+        for src_sentence, trg_sentence in tagged:
+            out_src.write(src_sentence)
+            out_trg.write(trg_sentence)
+            yield [word for word, _ in src_sentence], [word for word, _ in trg_sentence]
+
+def read_alignments(filename):
+    with open_text(filename, "r") as f:
+        for line in f:
+            yield parse_links(line)
+
+
+# ====== INCREMENTAL ====== #
+def read_shards(source_file, target_file, shard_size):
+    # (shard, first line, source lines, target lines), `shard_size` lines each, line ends kept as make_dnt_BIO reads them
+    with open_text(source_file, "r") as source, open_text(target_file, "r") as target:
+        pairs = zip(source, target)
+        for shard in count():
+            chunk = list(islice(pairs, shard_size))
+            if not chunk:
+                return
+            yield shard, shard * shard_size, [src for src, _ in chunk], [trg for _, trg in chunk]
+
+def shard_lines(lines, shard_size):
+    while True:
+        chunk = list(islice(lines, shard_size))
+        if not chunk:
+            return
+        yield chunk
+
+def read_lines(filename):
+    with open_text(filename, "r") as f:
+        for line in f:
+            yield line.rstrip("\r\n")
+
+def describe(store, stage, shard, first, lines):
+    change = store.changed(stage, shard)
+    reason = "new" if change == "new" else f"{change} changed" if change else "not in the store"
+    print(f"    {stage} shard {shard} (lines {first:,}-{first + lines - 1:,}): {reason}")
+
+
+def tag_shards(store, source_file, target_file, tagger, batch_size, read_ahead, binary):
+    # tagged .pavlov of every shard, returns [(text hash, tag key, source, target .pavlov)]
+    ner_model = None
+    settings = {"tagger": TAGGERS[tagger].model_key(), "binary": binary}
+    shards = []
+    for shard, first, src_lines, trg_lines in read_shards(source_file, target_file, store.shard_size):
+        text = digest("".join(src_lines), "".join(trg_lines))
+        key = digest("tag", text, settings)
+        paths = [store.path("tag", key, ".src.pavlov"), store.path("tag", key, ".trg.pavlov")]
+        reused = store.has(paths)
+        if not reused:
+            ner_model = ner_model or TAGGERS[tagger]()
+            with store.write(paths) as (src_path, trg_path), \
+                 open_pavlov_writer(src_path, binary) as out_src, \
+                 open_pavlov_writer(trg_path, binary) as out_trg:
+                pairs = ((src.rstrip("\r\n"), trg.rstrip("\r\n")) for src, trg in zip(src_lines, trg_lines))
+                for src_sentence, trg_sentence in tag_lines(ner_model, pairs, batch_size, read_ahead):
+                    out_src.write(src_sentence)
+                    out_trg.write(trg_sentence)
+        store.record("tag", shard, key, {"text": text}, settings, len(src_lines), paths, reused)
+        if not reused:
+            describe(store, "tag", shard, first, len(src_lines))
+        shards.append((text, key, *paths))
+    return shards
+
+def align_shards(store, tagged, alignments, fa_iterations, command, align_per_shard):
+    """
+    Symmetrized alignments of every shard, as [(alignment hash, "i-j" lines)].
+    EM runs on the whole corpus, its result is only reused when no shard changed. With
+    `align_per_shard` every shard is aligned on its own (and reused as the other stages),
+    which is not the alignment of the whole corpus: EM sees less data.
+    """
+    settings = {"iterations": fa_iterations, "command": command}
+    if alignments:
+        lines = shard_lines(read_lines(alignments), store.shard_size)
+        return [(digest("\n".join(chunk)), chunk) for chunk in lines]
+
+    from ibm2_aligner import FastAlignModel, ParallelCorpus
+
+    def align(shards, paths):
+        def words():
+            for _, _, src_pavlov, trg_pavlov in shards:
+                for src_sentence, trg_sentence in zip(load_pavlov(src_pavlov), load_pavlov(trg_pavlov)):
+                    yield [word for word, _ in src_sentence], [word for word, _ in trg_sentence]
+
+        corpus = ParallelCorpus(words())
+        model = FastAlignModel(iterations = fa_iterations)
+        forward = model.align(corpus)
+        reverse = model.align(corpus, reverse = True)
+        del corpus
+        links = (format_links(line) for line in symmetrize(forward, reverse, command))
+        with store.write(paths) as tmp:
+            for path, chunk in zip(tmp, shard_lines(links, store.shard_size)):
+                with open(path, "w", encoding = "utf-8") as f:
+                    f.writelines(line + "\n" for line in chunk)
+
+    if align_per_shard:
+        groups = [[shard] for shard in tagged]
+        keys = [digest("align", key, settings) for _, key, _, _ in tagged]
+    else:
+        groups = [tagged]
+        keys = [digest("align", [key for _, key, _, _ in tagged], settings)]
+
+    res = []
+    for group, key in zip(groups, keys):
+        first = len(res)
+        paths = [store.path("align", key, f".{shard}.align") for shard in range(len(group))]
+        reused = store.has(paths)
+        if not reused:
+            print(f"    align shard {first}: aligned on its own" if align_per_shard else f"    align: the whole corpus ({len(group):,} shards)")
+            align(group, paths)
+        for shard, path in enumerate(paths, start = first):
+            with open(path, "r", encoding = "utf-8") as f:
+                chunk = [line.rstrip("\n") for line in f]
+            store.record("align", shard, key, {"tagged": tagged[shard][1]}, settings, len(chunk), [path], reused)
+            res.append((digest("\n".join(chunk)), chunk))
+    return res
+
+def dnt_shards(store, source_file, target_file, tagged, aligned, trg_lang, probability, augment_prob, seed, workers, chunk_size, cache_stats):
+    # .dnts5 lines of every shard, returns [(source, target outputs)]
+    dnts.lng_trg = trg_lang
+    detokenizer = dnts.Detokenizer(trg_lang)
+    res = []
+    shards = read_shards(source_file, target_file, store.shard_size)
+    for (shard, first, src_lines, trg_lines), (text, tag_key, src_pavlov, trg_pavlov), (links, align_lines) in zip(shards, tagged, aligned):
+        if len(align_lines) != len(src_lines):
+            raise ValueError(f"Shard {shard} has {len(src_lines):,} lines and {len(align_lines):,} alignments")
+        # line numbers seed the per-line generators: the same line gives the same output in any shard layout
+        settings = {"probability": probability, "augment": augment_prob, "seed": seed, "trg_lang": trg_lang, "first_line": first}
+        key = digest("dnts", text, tag_key, links, settings)
+        paths = [store.path("dnts", key, ".src"), store.path("dnts", key, ".trg")]
+        reused = store.has(paths)
+        if not reused:
+            streams = (load_pavlov(src_pavlov), src_lines, load_pavlov(trg_pavlov), trg_lines, align_lines)
+            chunks = ((first + start, chunk) for start, chunk in dnts.read_chunks(streams, chunk_size))
+            chunk_settings = (1 - probability if probability else .0, 1 - augment_prob if augment_prob else 0, seed, 0, detokenizer)
+            results = chain.from_iterable(dnts.collect_cache_stats(dnts.run_chunks(chunks, workers, chunk_settings), cache_stats, workers > 1))
+            with store.write(paths) as (src_path, trg_path), \
+                 open(src_path, "w", encoding = "utf-8") as source_out, \
+                 open(trg_path, "w", encoding = "utf-8") as target_out:
+                for src_sentence, trg_sentence, _ in results:
+                    source_out.write(src_sentence + "\n")
+                    target_out.write(trg_sentence + "\n")
+        store.record("dnts", shard, key, {"text": text, "tagged": tag_key, "alignments": links}, settings, len(src_lines), paths, reused)
+        if not reused:
+            describe(store, "dnts", shard, first, len(src_lines))
+        res.append(paths)
+    return res
+
+def stitch_pavlov(parts, filename, binary):
+    if binary or is_compressed(filename):
+        # binary files have one string pool, compressed outputs go through their codec
+        with open_pavlov_writer(filename, binary) as out:
+            for part in parts:
+                for sentence in load_pavlov(part):
+                    out.write(sentence)
+        return
+    # pickle streams are concatenated as they are
+    with open(filename, "wb") as out:
+        for part in parts:
+            with open(part, "rb") as f:
+                shutil.copyfileobj(f, out)
+
+def stitch_text(parts, filename):
+    dnt_counts = 0
+    with open_text(filename, "w") as out:
+        for part in parts:
+            with open(part, "r", encoding = "utf-8") as f:
+                for line in f:
+                    out.write(line)
+                    dnt_counts += line.count("{DNT0}")
+    return dnt_counts
+
+def run_sharded(store, source_file, target_file, source_pavlov, target_pavlov, trg_lang, tagger, batch_size, read_ahead, binary,
+                alignments, fa_iterations, command, align_per_shard, probability, augment_prob, seed, workers, chunk_size):
+    pipeline_start = time.perf_counter()
+    timings = []
+
+    print(f"... Tagging shards of {store.shard_size:,} lines ...\n")
+    start_time = time.perf_counter()
+    tagged = tag_shards(store, source_file, target_file, tagger, batch_size, read_ahead, binary)
+    stitch_pavlov([src for _, _, src, _ in tagged], source_pavlov, binary)
+    stitch_pavlov([trg for _, _, _, trg in tagged], target_pavlov, binary)
+    timings.append(("tag", time.perf_counter() - start_time))
+
+    print(f"\n... Aligning{' from ' + alignments if alignments else ''} ...\n")
+    start_time = time.perf_counter()
+    aligned = align_shards(store, tagged, alignments, fa_iterations, command, align_per_shard)
+    if len(aligned) != len(tagged):
+        raise ValueError(f"{len(tagged):,} shards of text and {len(aligned):,} of alignments")
+    timings.append(("align", time.perf_counter() - start_time))
+
+    print("\n... Generating DNTs ...\n")
+    start_time = time.perf_counter()
+    cache_stats = Counter()
+    parts = dnt_shards(store, source_file, target_file, tagged, aligned, trg_lang, probability, augment_prob, seed, workers, chunk_size, cache_stats)
+    out_src = add_suffix(source_pavlov, ".dnts5")
+    out_trg = add_suffix(target_pavlov, ".dnts5")
+    dnt_counts = stitch_text([src for src, _ in parts], out_src) + stitch_text([trg for _, trg in parts], out_trg)
+    timings.append(("dnts", time.perf_counter() - start_time))
+
+    removed = store.save()
+
+    print("  ================================  ")
+    for stage, seconds in timings:
+        print(f"{store.report(stage)} in {seconds:.1f}s")
+    print(f"Total = {time.perf_counter() - pipeline_start:.1f}s")
+    print(f"DNTs in each corpora = {dnt_counts // 2:,}")
+    print(f"Shard store = {store.directory}, {removed:,} stale outputs removed")
+    print(f"Outputs -> {out_src}, {out_trg}")
+    print("  ================================  ")
+
+
+def main(source_file,
+         target_file,
+         output_dir = None,
+         src_lang = None,
+         trg_lang = None,
+         tagger = "deeppavlov",
+         batch_size = 32,
+         read_ahead = 1024,
+         binary = True,
+         alignments = None,
+         fa_iterations = 5,
+         command = "union",
+         probability = .0,
+         augment_prob = .0,
+         seed = 0,
+         workers = 1,
+         chunk_size = 2_000,
+         queue_size = 1024,
+         shards = None,
+         shard_size = SHARD_SIZE,
+         align_per_shard = False):
+
+    output_dir = output_dir or os.path.dirname(os.path.abspath(source_file))
+    os.makedirs(output_dir, exist_ok = True)
+    # outputs keep the compression of their input: train.en.xz -> train.en.pavlov.xz, train.en.pavlov.dnts5.xz
+    source_pavlov = os.path.join(output_dir, add_suffix(os.path.basename(source_file), ".pavlov"))
+    target_pavlov = os.path.join(output_dir, add_suffix(os.path.basename(target_file), ".pavlov"))
+    src_lang = src_lang or os.path.splitext(split_compression(source_file)[0])[1][1:]
+    trg_lang = trg_lang or os.path.splitext(split_compression(target_file)[0])[1][1:]
+    print(f"SRC language -> {src_lang}\nTRG language -> {trg_lang}\n")
+
+    if shards:
+        run_sharded(ShardStore(shards, shard_size), source_file, target_file, source_pavlov, target_pavlov, trg_lang, tagger, batch_size,
+                    read_ahead, binary, alignments, fa_iterations, command, align_per_shard, probability, augment_prob, seed, workers, chunk_size)
+        return
+
+    stages = []
+    pipeline_start = time.perf_counter()
+
+    # =================== TAGGING =================== #
+    print("... Tagging ...\n")
+    start_time = time.perf_counter()
+    ner_model = TAGGERS[tagger]()
+    pairs = threaded("read", read_text_pairs(source_file, target_file), queue_size, stages)
+    tagged = threaded("tag", tag_lines(ner_model, pairs, batch_size, read_ahead), queue_size, stages)
+    words = threaded("write", write_pavlov(tagged, source_pavlov, target_pavlov, binary), queue_size, stages)
+
+    # =================== ALIGNMENTS =================== #
+    if alignments:
+        for _ in words:
+            pass
+        print(f"... Tagged in {time.perf_counter() - start_time:.1f}s, alignments from {alignments} ...\n")
+        links = read_alignments(alignments)
+    else:
+        from ibm2_aligner import FastAlignModel, ParallelCorpus
+
+        corpus = ParallelCorpus(words)
+        print(f"... Tagged in {time.perf_counter() - start_time:.1f}s ...\n\n... Aligning {corpus.n_pairs:,} pairs ...\n")
+        start_time = time.perf_counter()
+        model = FastAlignModel(iterations = fa_iterations)
+        forward = model.align(corpus)
+        reverse = model.align(corpus, reverse = True)
+        del corpus
+        print(f"... Aligned in {time.perf_counter() - start_time:.1f}s ...\n")
+        links = symmetrize(forward, reverse, command)
+
+    # =================== DNTS =================== #
+    print("... Generating DNTs ...\n")
+    dnts.lng_trg = trg_lang
+    out_src = add_suffix(source_pavlov, ".dnts5")
+    out_trg = add_suffix(target_pavlov, ".dnts5")
+    dnt_counts = 0
+    cache_stats = Counter()
+
+    with open_text(source_file, "r") as orig_source, \
+         open_text(target_file, "r") as orig_target, \
+         open_text(out_src, "w") as source_out, \
+         open_text(out_trg, "w") as target_out:
+
+        streams = (load_pavlov(source_pavlov), orig_source, load_pavlov(target_pavlov), orig_target, links)
+        chunks = threaded("chunk", dnts.read_chunks(streams, chunk_size), max(1, queue_size // chunk_size), stages)
+        settings = (1 - probability if probability else .0, 1 - augment_prob if augment_prob else 0, seed, 0, dnts.Detokenizer(trg_lang))
+        chunk_results = dnts.collect_cache_stats(dnts.run_chunks(chunks, workers, settings), cache_stats, workers > 1)
+        results = threaded("dnts", chain.from_iterable(chunk_results), queue_size, stages)
+
+        for src_sentence, trg_sentence, _ in results:
+            source_out.write(src_sentence + "\n")
+            target_out.write(trg_sentence + "\n")
+            dnt_counts += src_sentence.count("{DNT0}") + trg_sentence.count("{DNT0}")
+
+
+    print("  ================================  ")
+    for stats in stages:
+        print(stats.report())
+    print(f"Total = {time.perf_counter() - pipeline_start:.1f}s")
+    print(f"DNTs in each corpora = {dnt_counts // 2:,}")
+    lookups = cache_stats["hits"] + cache_stats["misses"]
+    print(f"Decision cache = {cache_stats['hits']:,} hits, {cache_stats['misses']:,} misses "
+          f"({cache_stats['hits'] / lookups if lookups else 0:.1%} hit rate), {cache_stats['evictions']:,} evictions")
+    print(f"Outputs -> {out_src}, {out_trg}")
+    print("  ================================  ")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Tag, align and generate DNTs from raw parallel text in a single streaming run")
+    parser.add_argument("-s", "--source", help = "Path to raw source language file", required = True)
+    parser.add_argument("-t", "--target", help = "Path to raw target language file", required = True)
+    parser.add_argument("-o", "--output-dir", help = "Folder of the .pavlov and .dnts5 outputs, next to the source by default")
+    parser.add_argument("--src-lang", help = "Source language code, the source file extension by default")
+    parser.add_argument("--trg-lang", help = "Target language code, the target file extension by default")
+    parser.add_argument("--tagger", help = "NER model, 'standin' is a deterministic offline tagger", choices = list(TAGGERS), default = "deeppavlov")
+    parser.add_argument("-b", "--batch-size", help = "Sentences per model call", default = 32)
+    parser.add_argument("-k", "--read-ahead", help = "Lines read ahead and sorted by length before batching", default = 1024)
+    parser.add_argument("-f", "--format", help = "Format of the .pavlov files", choices = ["pickle", "binary"], default = "binary")
+    parser.add_argument("-a", "--alignments", help = "Precomputed symmetrized alignments, skips the aligner")
+    parser.add_argument("-i", "--iterations", help = "Aligner EM iterations", default = 5)
+    parser.add_argument("-c", "--command", help = "Symmetrization heuristic", choices = [c for c in COMMANDS if c != "fmeasure"], default = "union")
+    parser.add_argument("-p", "--probability", help = "In case a probability filter is wanted to be used", default = .0)
+    parser.add_argument("-g", "--augment", help = "probability to duplicate dnts", default = .0)
+    parser.add_argument("--seed", help = "Seed for the per-line random generators", default = 0)
+    parser.add_argument("-w", "--workers", help = "Number of worker processes for the DNT stage", default = 1)
+    parser.add_argument("--chunk-size", help = "Lines sent to a worker at once", default = 2_000)
+    parser.add_argument("-q", "--queue-size", help = "Items buffered between two stages", default = 1024)
+    parser.add_argument("--shards", help = "Shard store folder: incremental run, only the shards whose inputs or settings changed are computed again")
+    parser.add_argument("--shard-size", help = "Lines per shard of the incremental run", default = SHARD_SIZE)
+    parser.add_argument("--align-per-shard", help = "With --shards, align every shard on its own so unchanged shards keep their alignments (EM then sees one shard at a time)", action = "store_true")
+
+    args = parser.parse_args()
+    if args.align_per_shard and not args.shards:
+        parser.error("--align-per-shard needs --shards")
+    if args.align_per_shard and args.alignments:
+        parser.error("--align-per-shard and -a are exclusive, precomputed alignments are not aligned again")
+
+    main(args.source,
+         args.target,
+         args.output_dir,
+         args.src_lang,
+         args.trg_lang,
+         args.tagger,
+         int(args.batch_size),
+         int(args.read_ahead),
+         args.format == "binary",
+         args.alignments,
+         int(args.iterations),
+         args.command,
+         float(args.probability),
+         float(args.augment),
+         int(args.seed),
+         int(args.workers),
+         int(args.chunk_size),
+         int(args.queue_size),
+         args.shards,
+         int(args.shard_size),
+         args.align_per_shard)
@@ -1,19 +1,31 @@
+import os
 import re
-import random
+import sys
+import json
+import time
 import pickle
+import random
 import argparse
 import unicodedata
-from itertools import chain
+from array import array
+from bisect import bisect_right
+from collections import deque, Counter, OrderedDict
+from contextlib import closing, ExitStack
+from functools import lru_cache
+from itertools import chain, compress, repeat
 from unidecode import unidecode
 
-from nltk.corpus import stopwords
-italian_stopwords = stopwords.words("italian")
-english_stopwords = stopwords.words("english")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+from pavlov_binary import load_pavlov
+from corpus_io import open_text, add_suffix, strip_suffix
+from symmetrize import read_directions, symmetrize as symmetrize_lines
+from alignment_cache import open_alignment_cache
 
 admitted_tags = {"LOC", "PERSON", "GPE", "ORG", "FAC", "NORP"}
 not_admitted_languages = {"tir"}
-stops = set ( italian_stopwords + english_stopwords )
 lng_trg = ""
+NORMALIZE_CACHE_SIZE = 1 << 16
+DECISION_CACHE_SIZE = 1 << 18
 
 
 # ====== FILE PROCESSING FUNCTIONS ====== #
@@ -38,14 +50,131 @@ def make_tuple(indexes_row: list):
         res.append( ( int(el[:i]), int(el[i+1:]) ) )
     return res
 
+class AlignmentIndex:
+    """
+    Compact adjacency view of a parsed alignment line.
+    Links are stored once per direction as offsets plus a flat array (CSR layout),
+    keeping the original line order inside each token's bucket.
+    """
+    __slots__ = ("src_offsets", "src_links", "trg_offsets", "trg_links")
+
+    def __init__(self, alignments: list, src_len: int, trg_len: int):
+        self.src_offsets, self.src_links = build_adjacency(alignments, src_len, 0)
+        self.trg_offsets, self.trg_links = build_adjacency(alignments, trg_len, 1)
+
+    def forward(self, index: int):
+        # SRC token -> TRG tokens
+        return self.src_links[self.src_offsets[index]:self.src_offsets[index + 1]]
+
+    def reverse(self, index: int):
+        # TRG token -> SRC tokens
+        return self.trg_links[self.trg_offsets[index]:self.trg_offsets[index + 1]]
+
+def build_adjacency(alignments: list, size: int, side: int):
+    # counting sort on one side of the links, links pointing outside the sentence are dropped
+    other = 1 - side
+    counts = [0] * (size + 1)
+    for link in alignments:
+        if link[side] < size:
+            counts[link[side] + 1] += 1
+    for k in range(size):
+        counts[k + 1] += counts[k]
+
+    offsets = array("i", counts)
+    links = array("i", bytes(4 * counts[size]))
+    cursor = counts[:size]
+    for link in alignments:
+        k = link[side]
+        if k < size:
+            links[cursor[k]] = link[other]
+            cursor[k] += 1
+    return offsets, links
+
+# ====== SENTENCE MODEL ====== #
+class TagTable(dict):
+    """
+    Tag -> integer id, new tags get the next id on first lookup (also from C, through
+    __getitem__). Ids are only meaningful inside the process that assigned them.
+    """
+    def __init__(self):
+        super().__init__()
+        self.names = []
+        self.inside = bytearray()    # "I-" tags, continuing an entity
+        self._begins = (None, None)
+
+    def __missing__(self, tag):
+        self[tag] = tag_id = len(self.names)
+        self.names.append(tag)
+        self.inside.append(tag.startswith("I-"))
+        return tag_id
+
+    def begins(self, admitted):
+        # "B-" tags of an admitted entity type, recomputed when new tags or types show up
+        key = (len(self.names), frozenset(admitted))
+        if self._begins[0] != key:
+            self._begins = (key, bytearray(tag.startswith("B-") and tag[2:] in admitted for tag in self.names))
+        return self._begins[1]
+
+TAGS = TagTable()
+ENTITY = TAGS["ENTITY"]
+
+class Sentence:
+    """
+    Tokens of a sentence as parallel arrays: words, tag ids and a deletion mask, plus the
+    CSR alignment offsets/links of its side. Deleted tokens keep their index, as keys of
+    the former {index: {"word", "tag", "to"}} dicts did, and len() counts the live ones.
+    """
+    __slots__ = ("words", "tags", "alive", "size", "offsets", "links")
+
+    def __init__(self, tokens, offsets, links):
+        self.words = [word for word, _ in tokens]
+        self.tags = array("i", map(TAGS.__getitem__, [tag for _, tag in tokens]))
+        self.alive = bytearray(b"\x01") * len(self.words)
+        self.size = len(self.words)
+        self.offsets = offsets
+        self.links = links
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, index):
+        return index < len(self.alive) and self.alive[index]
+
+    def tag(self, index):
+        return TAGS.names[self.tags[index]]
+
+    def inside(self, index):
+        return TAGS.inside[self.tags[index]]
+
+    def linked(self, index):
+        return self.links[self.offsets[index]:self.offsets[index + 1]]
+
+    def replace(self, index, word, tag = None):
+        self.words[index] = word
+        if tag is not None:
+            self.tags[index] = tag
+
+    def delete(self, index):
+        self.alive[index] = 0
+        self.size -= 1
+
+    def live_words(self):
+        return list(compress(self.words, self.alive))
+
+    def copy(self):
+        # words, tags and mask are copied, the alignment arrays are shared
+        new = Sentence.__new__(Sentence)
+        new.words = self.words[:]
+        new.tags = array("i", self.tags)
+        new.alive = bytearray(self.alive)
+        new.size = self.size
+        new.offsets = self.offsets
+        new.links = self.links
+        return new
+
 def load_pickle(filename):
-    # create a pickle's iterator
-    with open(filename, "rb") as f:
-        while True:
-            try:
-                yield pickle.load(f)
-            except EOFError:
-                break
+    # pickled or binary .pavlov files
+    return load_pavlov(filename)
 
 def compare_lists_length(list1, list2):
     # Se una delle due stringhe è 3 volte la lunghezza dell'altra, la combinazione verrà scartata.
@@ -74,79 +203,347 @@ def get_string_type(string):
     # If none of the above conditions are met, it can be a combination of types
     return "Combination"
 
-def transform_string(input_string):
-
-    global lng_trg
-    # Move .,;!? and ) next to the previous word
-    transformed_string = re.sub(r'\s*([.,:%;!?\])])\s*', r'\1 ', input_string)
-    
+# ====== DETOKENIZER ====== #
+def contains(*needles):
+    # the rule can only change the text when one of the needles is in it
+    return re.compile("|".join(re.escape(needle) for needle in needles)).search
+
+def merge_symbols(match):
+    # merge consecutive symbols, only ascii runs lose their spaces
+    return match.group(0).replace(" ", "") if match.group(0).isascii() else match.group(0)
+
+# (guard, pattern, replacement), applied in order
+DETOKENIZER_RULES = [
+    # Move .,;!? and ) next to the previous word, in two passes:
+    # patterns starting with \s* are tried at every position and are much slower
+    (contains(*".,:%;!?])"), re.compile(r'\s+(?=[.,:%;!?\])])'), ''),
+    (contains(*".,:%;!?])"), re.compile(r'(?<=[.,:%;!?\])])\s*'), ' '),
     # Move - to create a unique word with the previous and next word
-    transformed_string = re.sub(r'\s*-\s*', '-', transformed_string)
-    
+    (contains("-"), re.compile(r'\s*-\s*'), '-'),
     # Move opening parenthesis to the next word
-    transformed_string = re.sub(r'\(\s*', '(', transformed_string)
-    transformed_string = re.sub(r'\[\s*', '[', transformed_string)
-    
+    (contains("("), re.compile(r'\(\s*'), '('),
+    (contains("["), re.compile(r'\[\s*'), '['),
     # Fix the format of splitted numbers
-    transformed_string = re.sub(r'(\d+([.,]\s*\d+)+)', lambda m: re.sub(r'\s*', '', m.group()), transformed_string)
-    
+    (re.compile(r'\d[.,]\s').search, re.compile(r'(?<=\d[.,])\s+(?=\d)'), ''),
     # Join the extracted matches with a space
-    transformed_string = re.sub(r'" ([^"]+) "', r'"\1"', transformed_string)
-
-    #merge consecutive symbols
-    transformed_string = re.sub(r'([^a-zA-Z\d])\s+\1(\s+\1)*', lambda m: m.group(0).replace(" ", "") if m.group(0).isascii()
-                                                                  else m.group(0).replace(" ", " ") , transformed_string)
-
-    #merge
-    transformed_string = re.sub(r'. ([,;:])', r'.\1', transformed_string)
+    (contains('" '), re.compile(r'" ([^"]+) "'), r'"\1"'),
+    # merge consecutive symbols
+    (None, re.compile(r'([^a-zA-Z\d])\s+\1(\s+\1)*'), merge_symbols),
+    # merge
+    (contains(" ,", " ;", " :"), re.compile(r'. ([,;:])'), r'.\1'),
+    # move situations like U. K. , S. A. togheter
+    (contains(". "), re.compile(r'([A-Z]\.) ([A-Z]\.)'), r'\1\2'),
+    # merge links (.com, .js etc)
+    (contains(". "), re.compile(r"\. (?=[A-z]{2,3})"), "."),
+]
+
+# extra rules applied after the common ones, by target language
+LANGUAGE_RULES = {
+    # merge urdu diacritics with the surrounding letters
+    "ur": [(contains(*"\u064b\u064c\u064d\u064e\u064f\u0650\u0652"), re.compile(r'(\w)\s+([ًٌٍَُِْ])\s+(\w)'), r'\1\2\3')],
+}
+
+def register_language_rule(language, pattern, replacement, guard = None):
+    LANGUAGE_RULES.setdefault(language, []).append((guard, re.compile(pattern), replacement))
+    # detokenizers copy the rules when built, the cached ones would miss the new rule
+    get_detokenizer.cache_clear()
+
+
+class Detokenizer:
+    """
+    Joins a token list back into a sentence, built once per language pair.
+    Each rule is skipped when its guard shows it can not match, and sentences made
+    of alphanumeric tokens only skip the common rules altogether.
+    """
+
+    def __init__(self, language = ""):
+        self.language = language
+        self.language_rules = LANGUAGE_RULES.get(language, [])
+        self.rules = DETOKENIZER_RULES + self.language_rules
+
+    def __call__(self, tokens) -> str:
+        text = " ".join(tokens)
+        if all(token.isalnum() for token in tokens):
+            return self.apply(text, self.language_rules)
+        return self.apply(text, self.rules)
+
+    def transform(self, text: str) -> str:
+        return self.apply(text, self.rules)
+
+    def __reduce__(self):
+        # workers rebuild it from the language instead of unpickling every pattern
+        return Detokenizer, (self.language,)
+
+    @staticmethod
+    def apply(text, rules):
+        for guard, pattern, replacement in rules:
+            if guard is None or guard(text):
+                text = pattern.sub(replacement, text)
+        return text
+
+@lru_cache(maxsize = None)
+def get_detokenizer(language):
+    return Detokenizer(language)
 
-    #move situations like U. K. , S. A. togheter
-    transformed_string = re.sub(r'([A-Z]\.) ([A-Z]\.)', r'\1\2', transformed_string)
-
-    #merge links (.com, .js etc)
-    transformed_string = re.sub(r"(\.) ([A-z]{2,3})", r"\1\2", transformed_string)
-
-    # # uppercase letter followed by a dot and space and a number
-    # modified_string = re.sub(r'([A-Z]*)\.\s+(\d+)', r'\1.\2', input_string)
-    
-    if lng_trg == "ur":
-        transformed_string = re.sub(r'(\w)\s+([ًٌٍَُِْ])\s+(\w)', r'\1\2\3', transformed_string)
-    
-    return transformed_string
+def transform_string(input_string):
+    return get_detokenizer(lng_trg).transform(input_string)
 
 
 
 # ====== DNTS PROCESSING FUNCS ====== #
-def levenshtein_distance(s1, s2):
+def levenshtein_distance(s1, s2, max_distance = None):
+    """
+    Edit distance between s1 and s2.
+    With max_distance the function returns max_distance + 1 as soon as the distance is known
+    to exceed it, so callers should only compare the result against their threshold. Only
+    the cells of the DP that can still lead to a distance within the cutoff are computed:
+    the band of diagonals allowed by the length difference, narrowed row by row to the cells
+    whose cost plus the edits left is within the cutoff.
+    Memory is two rows of the shorter string.
+    """
+    if s1 == s2:
+        return 0
+    # keep the shorter string on the columns
+    if len(s1) < len(s2):
+        s1, s2 = s2, s1
     m = len(s1)
     n = len(s2)
+    d = m - n
+
+    if max_distance is None:
+        max_distance = m
+    big = max_distance + 1
+    if d > max_distance:
+        return big
+    if n == 0:
+        return m
+
+    # reaching (i, j) and going on to (m, n) costs at least |i - j| + |d - (i - j)|
+    left = (max_distance + d) // 2
+    right = (max_distance - d) // 2
+
+    # the extra last slot stays big, it is also read as column -1
+    previous = [big] * (n + 2)
+    current = [big] * (n + 2)
+    lo, hi = 0, min(n, right)
+    previous[:hi + 1] = range(hi + 1)
 
-    # Create a matrix to store the dynamic programming values
-    dp = [[0] * (n + 1) for _ in range(m + 1)]
-
-    # Initialize the first row and column of the matrix
-    for i in range(m + 1):
-        dp[i][0] = i
-    for j in range(n + 1):
-        dp[0][j] = j
-
-    # Compute the minimum edit distance
     for i in range(1, m + 1):
-        for j in range(1, n + 1):
-            if s1[i - 1] == s2[j - 1]:
-                dp[i][j] = dp[i - 1][j - 1]
+        char1 = s1[i - 1]
+        first = max(lo, i - left)
+        end = min(i + right, n, hi + 1)
+        if first > end:
+            return big
+
+        current[first - 1] = big
+        j = first
+        if j == 0:
+            current[0] = previous[0] + 1
+            j = 1
+        for j in range(j, end + 1):
+            if char1 == s2[j - 1]:
+                current[j] = previous[j - 1]
             else:
-                dp[i][j] = min(dp[i - 1][j] + 1,  # Deletion
-                               dp[i][j - 1] + 1,  # Insertion
-                               dp[i - 1][j - 1] + 1)  # Substitution
-
-    # Return the minimum edit distance
-    return dp[m][n]
+                current[j] = min(previous[j - 1],   # Substitution
+                                 previous[j],       # Deletion
+                                 current[j - 1]) + 1  # Insertion
+        # right of the previous row's live cells only insertions are left
+        last = min(i + right, n)
+        while end < last and current[end] < max_distance:
+            end += 1
+            current[end] = current[end - 1] + 1
+
+        # drop the cells on both sides that can not end within the cutoff, stop once none is left
+        lo, hi = first, end
+        while lo <= hi and current[lo] + abs(d - i + lo) > max_distance:
+            lo += 1
+        if lo > hi:
+            return big
+        while current[hi] + abs(d - i + hi) > max_distance:
+            hi -= 1
+        current[hi + 1] = big
+        previous, current = current, previous
+
+    # the last row keeps its cells within the cutoff, (m, n) among them or none
+    return previous[n] if hi == n else big
+
+@lru_cache(maxsize = NORMALIZE_CACHE_SIZE)
+def normalize_word(word, transliterate = True):
+    # lowercased (and transliterated) forms, shared across sentences
+    word = word.lower()
+    return unidecode(word) if transliterate else word
+
+# ====== DECISION CACHE ====== #
+class DecisionCache:
+    """
+    Bounded LRU of what replace_entities recomputes for the same entity pairs all over
+    the corpus: edit distances between normalized words and accept/reject decisions of
+    multi-word spans. Entries only depend on the words, so they can be saved and reused
+    by runs with different -p/-g values.
+    """
+
+    VERSION = 2
+
+    def __init__(self, max_size = DECISION_CACHE_SIZE, track_new = False):
+        self.entries = OrderedDict()
+        self.max_size = max_size
+        self.hits = self.misses = self.evictions = 0
+        # workers keep what they add since the last drain, to send it back
+        self.track_new = track_new
+        self.new = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def put(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        if self.track_new:
+            self.new[key] = value
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last = False)
+            self.evictions += 1
+
+    def distance(self, s1, s2, limit = None):
+        # levenshtein_distance(s1, s2, limit), entries remember whether they are exact or a lower bound
+        key = (s1, s2) if s1 <= s2 else (s2, s1)
+        cached = self.entries.get(key)
+        if cached is not None:
+            value, exact = cached
+            if exact or (limit is not None and value > limit):
+                self.hits += 1
+                self.entries.move_to_end(key)
+                return value
+        self.misses += 1
+        value = levenshtein_distance(s1, s2, limit)
+        self.put(key, (value, limit is None or value <= limit))
+        return value
+
+    def span_rejected(self, src_entity_list, trg_entity_list):
+        # the rejection reason, "" when the span is accepted
+        key = ("span", tuple(src_entity_list), tuple(trg_entity_list))
+        reason = self.entries.get(key)
+        if reason is not None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return reason
+        self.misses += 1
+        reason = reject_span(src_entity_list, trg_entity_list)
+        self.put(key, reason)
+        return reason
+
+    def drain(self):
+        # counters and new entries since the last drain
+        delta = {"hits": self.hits, "misses": self.misses, "evictions": self.evictions, "entries": self.new}
+        self.hits = self.misses = self.evictions = 0
+        self.new = {}
+        return delta
+
+    def update(self, entries):
+        for key, value in entries.items():
+            self.put(key, value)
+
+    def load(self, filename):
+        with open(filename, "rb") as f:
+            data = pickle.load(f)
+        if data.get("version") == self.VERSION:
+            self.update(dict(data["entries"]))
+
+    def save(self, filename):
+        with open(filename + ".tmp", "wb") as f:
+            pickle.dump({"version": self.VERSION, "entries": list(self.entries.items())}, f, protocol = pickle.HIGHEST_PROTOCOL)
+        os.replace(filename + ".tmp", filename)
+
+decision_cache = DecisionCache()
+
+def reject_span(src_entity_list, trg_entity_list):
+    new_word_src = " ".join(el for el in src_entity_list)
+    new_word_trg = " ".join(el for el in trg_entity_list)
+    if len(new_word_trg) == 1 and not new_word_trg.isalnum():
+        return "non_alnum"
+    if compare_lists_length(src_entity_list, trg_entity_list):
+        return "length_ratio"
+    if get_string_type(new_word_src) != get_string_type(new_word_trg):
+        return "string_type"
+    return ""
+
+
+# ====== METRICS ====== #
+STAGES = ("parse_alignment", "build_sentences", "entity_matching", "detokenize", "augment", "write")
+# single word entities report the rejection of the link that went the furthest, in this order
+REJECTION_REASONS = ("no_link", "already_dnt", "non_alnum", "tag_mismatch", "length_ratio", "string_type", "single_char")
+
+class Metrics:
+    """
+    Seconds spent in each stage and entity counters (seen, skipped by -p, accepted and
+    rejected_<reason>). As with the decision cache, every process collects its own and
+    the main one sums what the workers drain.
+    """
+    def __init__(self):
+        self.timers = Counter()
+        self.entities = Counter()
+
+    def drain(self):
+        delta = {"timers": self.timers, "entities": self.entities}
+        self.timers, self.entities = Counter(), Counter()
+        return delta
+
+    def update(self, delta):
+        self.timers.update(delta["timers"])
+        self.entities.update(delta["entities"])
+
+    def snapshot(self, lines, dnts, elapsed, cache_stats):
+        return {"time": round(time.time(), 3),
+                "lines": lines,
+                "elapsed": round(elapsed, 3),
+                "lines_per_second": round(lines / elapsed, 1) if elapsed else None,
+                "dnts": dnts,
+                "stages": {stage: round(self.timers[stage], 4) for stage in STAGES},
+                "entities": {"seen": self.entities["seen"],
+                             "skipped": self.entities["skipped"],
+                             "accepted": self.entities["accepted"],
+                             "rejected": {reason: self.entities["rejected_" + reason] for reason in REJECTION_REASONS}},
+                "decision_cache": {key: cache_stats[key] for key in ("hits", "misses", "evictions")}}
+
+metrics = Metrics()
+
+def format_prometheus(snapshot):
+    res = []
+    def metric(name, kind, description, samples):
+        res.append(f"# HELP dnts_{name} {description}")
+        res.append(f"# TYPE dnts_{name} {kind}")
+        for labels, value in samples:
+            res.append(f"dnts_{name}{labels} {value}")
+
+    metric("lines_total", "counter", "Sentence pairs processed.", [("", snapshot["lines"])])
+    metric("dnts_total", "counter", "DNT tags written, in both corpora.", [("", snapshot["dnts"])])
+    metric("elapsed_seconds", "gauge", "Seconds since the start of the run.", [("", snapshot["elapsed"])])
+    metric("stage_seconds_total", "counter", "Seconds spent in each stage, summed over the workers.",
+           [(f'{{stage="{stage}"}}', seconds) for stage, seconds in snapshot["stages"].items()])
+    entities = snapshot["entities"]
+    metric("entities_total", "counter", "Source entities by outcome.",
+           [(f'{{outcome="{outcome}"}}', entities[outcome]) for outcome in ("seen", "skipped", "accepted")])
+    metric("entities_rejected_total", "counter", "Source entities rejected, by reason.",
+           [(f'{{reason="{reason}"}}', count) for reason, count in entities["rejected"].items()])
+    metric("decision_cache_total", "counter", "Decision cache lookups and evictions.",
+           [(f'{{result="{key}"}}', count) for key, count in snapshot["decision_cache"].items()])
+    return "\n".join(res) + "\n"
+
+def write_metrics(filename, fmt, snapshot):
+    # JSON lines are appended, the Prometheus textfile is replaced atomically
+    if fmt == "jsonl":
+        with open(filename, "a") as f:
+            f.write(json.dumps(snapshot) + "\n")
+    else:
+        with open(filename + ".tmp", "w") as f:
+            f.write(format_prometheus(snapshot))
+        os.replace(filename + ".tmp", filename)
 
 def dnt_augment(sentence1: str,
                 sentence2: str,
                 augment_percent: int,
-                to_sample: list) -> str:
+                to_sample: list,
+                rng = random) -> str:
     
     res1 = sentence1
     res2 = sentence2
@@ -154,41 +551,39 @@ def dnt_augment(sentence1: str,
     dnt_tags = re.findall(r"\$\{DNT0\}\d+", sentence1)
     # highest_dnt = max(int(el) for el in re.findall(r"\$\{DNT0\}(\d+)", sentence1))
     
-    to_sample = random.sample(range(50), k = 50)
+    to_sample = rng.sample(range(50), k = 50)
     replacements = { re.escape(el): el + " ${DNT0}" + str(to_sample.pop()) for el in dnt_tags }
     
     for old, new in replacements.items():
-        current_prob = random.random()
+        current_prob = rng.random()
         if augment_percent > 0 and current_prob > augment_percent:
             res1 = re.sub(old, new, res1)
             res2 = re.sub(old, new, res2)
     
     return res1, res2 
 
-def get_entities_align(src_sentence: tuple):
+def get_entities_align(src: Sentence):
     res = list()
     
-    idx = 0
-    while idx < len(src_sentence):
-        src_word, src_tag = src_sentence[idx]
+    begins = TAGS.begins(admitted_tags)
+    tags = src.tags
+    for idx, tag in enumerate(tags):
         
         #admitted_tags.add("PRODUCT")
-        if src_tag.startswith("B-") and src_tag[2:] in admitted_tags:
-            entity: list = [src_sentence[idx][0]]
-            entity_words_idx: list = [idx]
-            
+        if begins[tag]:
             # link the whole entity by B/I tags
             j = idx + 1
-            while j < len(src_sentence) and src_sentence[j][1].startswith("I-"):
-                entity.append(src_sentence[j][0])
-                entity_words_idx.append(j)
+            while j < len(tags) and TAGS.inside[tags[j]]:
                 j += 1
                 
-            res.append( (entity, src_tag, entity_words_idx) )
+            res.append( (src.words[idx:j], TAGS.names[tag], list(range(idx, j))) )
         # Se la parola non ha un tag utile, ci spostiamo alla successiva 
-        idx += 1
     return res
 
+def reject(reason):
+    metrics.entities["rejected_" + reason] += 1
+    return False
+
 def replace_entities(idx, src, trg, src_tag, src_entity_list, entity_words_idx, to_sample, found_als):
     global lng_trg
     global not_admitted_languages
@@ -203,60 +598,60 @@ def replace_entities(idx, src, trg, src_tag, src_entity_list, entity_words_idx,
         - Return the link and the .pop() element
         """
 
-        links = src[entity_words_idx[0]]["to"]
+        links = src.linked(entity_words_idx[0])
         
-        if links:
-            link = links[0]
-            if link in trg:
-                trg_word, trg_tag, _ = trg[link].values()
-                distance = levenshtein_distance(unidecode(src_entity_list[0]), unidecode(trg_word))
+        if not links or links[0] not in trg:
+            return reject("no_link")
+        link = links[0]
+        trg_tag = trg.tag(link)
                 
-                if (trg_tag == src_tag): # or distance < 5
+        if (trg_tag != src_tag): # or distance < 5
+            return reject("tag_mismatch")
                     
-                    # explicit SRC entity
-                    new_word_src = " ".join(el for el in src_entity_list)
-
-                    #explicit TRG entity
-                    trg_entity: str = trg[link]["word"]
-                    trg_entity_list: list[str] = [trg_entity]
-                    trg_entity_idx: list[int] = [link]
-
-                    i = link + 1
-                    cont = 0
-                    while i < len(trg) and cont < len(src_entity_list)-1 and i in trg.keys():
-                        middle_distance = levenshtein_distance(trg[i-1]["word"].lower(), src_entity_list[cont].lower())
-                        
-                        if trg[i]["tag"].startswith("I-") or middle_distance < 6:                    
-                            trg_entity = trg[i]["word"]
-                            trg_entity_list.append(trg_entity)
-                            trg_entity_idx.append(i)
-                            i += 1
-                            cont += 1
-                        else:
-                            break
-                    
-                    new_word_trg = " ".join(el for el in trg_entity_list)
-                    if len(new_word_trg) == 1 and not new_word_trg.isalnum() \
-                        or (compare_lists_length(src_entity_list, trg_entity_list)) \
-                        or (get_string_type(new_word_src) != (get_string_type(new_word_trg))):
-                        return False
-                    
-                    pop = to_sample.pop()
-                    if "DNT" not in new_word_trg:
-                        found_als.append(f"[{src_tag[2:]}][{new_word_src}] -> [{trg[link]['tag'][2:]}][{new_word_trg}]")
-
-                        # Replace SRC
-                        src[idx] = {"word": new_word_src}
-                        for i in entity_words_idx[1:]:
-                            del src[i]
-                        src[idx]['word'] = "${DNT0}" + str(pop)
-                        src[idx]['tag'] = "ENTITY"
-
-                        # Replace TRG
-                        for i in trg_entity_idx[1:]:
-                            del trg[i]
-                        trg[link]['word'] = "${DNT0}" + str(pop)
-                        trg[link]['tag'] = "ENTITY"
+        # explicit SRC entity
+        new_word_src = " ".join(el for el in src_entity_list)
+
+        #explicit TRG entity
+        trg_entity: str = trg.words[link]
+        trg_entity_list: list[str] = [trg_entity]
+        trg_entity_idx: list[int] = [link]
+
+        i = link + 1
+        cont = 0
+        while i < len(trg) and cont < len(src_entity_list)-1 and i in trg:
+            middle_distance = decision_cache.distance(normalize_word(trg.words[i-1], False),
+                                                      normalize_word(src_entity_list[cont], False), 5)
+            
+            if trg.inside(i) or middle_distance < 6:                    
+                trg_entity = trg.words[i]
+                trg_entity_list.append(trg_entity)
+                trg_entity_idx.append(i)
+                i += 1
+                cont += 1
+            else:
+                break
+        
+        new_word_trg = " ".join(el for el in trg_entity_list)
+        reason = decision_cache.span_rejected(src_entity_list, trg_entity_list)
+        if reason:
+            return reject(reason)
+        
+        pop = to_sample.pop()
+        if "DNT" in new_word_trg:
+            return reject("already_dnt")
+
+        metrics.entities["accepted"] += 1
+        found_als.append(f"[{src_tag[2:]}][{new_word_src}] -> [{trg_tag[2:]}][{new_word_trg}]")
+
+        # Replace SRC
+        for i in entity_words_idx[1:]:
+            src.delete(i)
+        src.replace(idx, "${DNT0}" + str(pop), ENTITY)
+
+        # Replace TRG
+        for i in trg_entity_idx[1:]:
+            trg.delete(i)
+        trg.replace(link, "${DNT0}" + str(pop), ENTITY)
 
     elif len(src_entity_list) == 1 and len(src_entity_list[0]) > 1:
         
@@ -267,90 +662,105 @@ def replace_entities(idx, src, trg, src_tag, src_entity_list, entity_words_idx,
         """
         src_word = src_entity_list[0]
         
-        entity_distances = list()
-        links = src[idx]["to"] #links [SRC ENTITY] -> [TRG ENTITIES]
+        closest = None # (distance, link, trg_word, trg_tag) of the closest eligible link
+        reason = "no_link" # otherwise, why the link that went the furthest was rejected
+        links = src.linked(idx) #links [SRC ENTITY] -> [TRG ENTITIES]
         if links:
             for link in links:
                 if link in trg:
-                    trg_word, trg_tag= trg[link]["word"], trg[link]["tag"]
+                    trg_word, trg_tag = trg.words[link], trg.tag(link)
                     
                     # if we process very low resource language, just get the first link
                     if lng_trg in not_admitted_languages:
                         if "{DNT0}" not in trg_word and trg_word.isalnum():
-                            entity_distances.append((0,
-                                                 link, 
-                                                 trg_word, 
-                                                 trg_tag))
+                            closest = (0, link, trg_word, trg_tag)
+                        else:
+                            reason = "already_dnt" if "{DNT0}" in trg_word else "non_alnum"
                         break
                     
                     # otherwise keep parsing them all
-                    distance = levenshtein_distance(unidecode(src_word.lower()), unidecode(trg_word.lower()))
-                    if (trg_tag == src_tag or distance < 3) and "{DNT0}" not in trg_word and trg_word.isalnum():
+                    if "{DNT0}" in trg_word or not trg_word.isalnum():
+                        reason = max(reason, "already_dnt" if "{DNT0}" in trg_word else "non_alnum", key = REJECTION_REASONS.index)
+                        continue
+
+                    # a link only wins if strictly closer than the current one (first one wins on ties),
+                    # links with a different tag must also be closer than 3
+                    limit = closest[0] - 1 if closest else None
+                    if trg_tag != src_tag:
+                        limit = 2 if limit is None else min(limit, 2)
+
+                    distance = decision_cache.distance(normalize_word(src_word), normalize_word(trg_word), limit)
+                    if limit is None or distance <= limit:
                         #print(f"{idx} = [{src_tag}]{src_word}:{unidecode(src_word)} -> {idx} = [{trg_tag}]{trg_word}:{unidecode(src_word)}")
-                        entity_distances.append((distance,
-                                                 link, 
-                                                 trg_word, 
-                                                 trg_tag))
+                        closest = (distance, link, trg_word, trg_tag)
+                        if distance == 0:
+                            break
+                    else:
+                        reason = "tag_mismatch"
                     
 
         #if there is any eligible entity, process the closest one             
-        if entity_distances:
-            entity_distances.sort(key=lambda x: x[0]) # sorting the list to get the closest word
-            _, link, trg_word, trg_tag  = entity_distances[0]
+        if not closest:
+            return reject(reason)
 
-            found_als.append(f"[{src_tag[2:]}][{src_word}] -> [{trg_tag[2:]}][{trg_word}]")
-            #print(f"{idx} = [{src_tag}][{src_word}] -> {link} = [{trg_tag}][{trg_word}]")
-                
-            # extract a random number and replace in dictionary
-            pop = "${DNT0}" + str(to_sample.pop())
-            src[idx]['word'] = pop
-            trg[link]['word'] = pop
+        _, link, trg_word, trg_tag  = closest
 
-def make_dnt_BIO(src_sentence, src_origin, trg_sentence, trg_origin, alignments, found_als, probability, augment_prob, verbosity = 0) -> tuple: 
+        metrics.entities["accepted"] += 1
+        found_als.append(f"[{src_tag[2:]}][{src_word}] -> [{trg_tag[2:]}][{trg_word}]")
+        #print(f"{idx} = [{src_tag}][{src_word}] -> {link} = [{trg_tag}][{trg_word}]")
+            
+        # extract a random number and replace in dictionary
+        pop = "${DNT0}" + str(to_sample.pop())
+        src.replace(idx, pop)
+        trg.replace(link, pop)
 
-    global stops
-    global admitted_tags
-    
-    to_sample = random.sample(population = range(25) if 25 > len(src_sentence) else range(len(src_sentence)), 
-                              k = len(src_sentence))
+    else:
+        return reject("single_char")
+
+def make_sentences(src_sentence, trg_sentence, alignments):
+    links = AlignmentIndex(alignments, len(src_sentence), len(trg_sentence))
+    return (Sentence(src_sentence, links.src_offsets, links.src_links),
+            Sentence(trg_sentence, links.trg_offsets, links.trg_links))
+
+def draw_replacements(src, src_entities, rng = random):
+    # random decisions of a sentence, drawn up front: the DNT numbers and one draw per entity, tried when >= probability
+    to_sample = rng.sample(population = range(25) if 25 > len(src.words) else range(len(src.words)), 
+                              k = len(src.words))
+    draws = [rng.random() for _ in src_entities]
+    return to_sample, draws
+
+def match_sentence(src, trg, src_entities, tried, to_sample, found_als, detokenizer = None) -> tuple:
     
-    src = {
-        index: {
-            "word": word,
-            "tag": tag,
-            "to": [tup[1] for tup in alignments if tup[0] == index]
-        }
-    for index, (word, tag) in enumerate(src_sentence)
-    }
-
-
-    trg = {
-        index: {
-            "word": word,
-            "tag": tag,
-            "to": [tup[1] for tup in alignments if tup[0] == index]
-        }
-        for index, (word, tag) in enumerate(trg_sentence)
-    }
+    start = time.perf_counter()
 
     # ====== PROCESSING WITH FAST ALIGN ====== #
-    src_entities = get_entities_align(src_sentence)
-    for entity, src_tag, entity_words_idx in src_entities:
+    metrics.entities["seen"] += len(src_entities)
+    for (entity, src_tag, entity_words_idx), attempt in zip(src_entities, tried):
         current_idx = entity_words_idx[0]
         
-        current_prob = random.random()
-        if current_prob >= probability: 
+        if attempt: 
             replace_entities(current_idx, src, trg, src_tag, entity, entity_words_idx, to_sample, found_als)
+        else:
+            metrics.entities["skipped"] += 1
 
 
-    src_res = transform_string(" ".join([res["word"] for _, res in src.items()])).rstrip()
-    trg_res = transform_string(" ".join([res["word"] for _, res in trg.items()])).rstrip()
-    
+    matched = time.perf_counter()
+    if detokenizer is None:
+        detokenizer = get_detokenizer(lng_trg)
+    src_res = detokenizer(src.live_words()).rstrip()
+    trg_res = detokenizer(trg.live_words()).rstrip()
+    metrics.timers["entity_matching"] += matched - start
+    metrics.timers["detokenize"] += time.perf_counter() - matched
+    return src_res, trg_res
+
+def augment_sentence(src_res, src_origin, trg_res, trg_origin, augment_prob, to_sample, rng = random) -> tuple:
     
     # ====== DNTS AUGMENTING ======= #
     if "{DNT0}" in src_res:
         if augment_prob > 0:
-            src_res, trg_res = dnt_augment(src_res, trg_res, augment_prob, to_sample)
+            start = time.perf_counter()
+            src_res, trg_res = dnt_augment(src_res, trg_res, augment_prob, to_sample, rng)
+            metrics.timers["augment"] += time.perf_counter() - start
         src_res = src_origin + src_res
         trg_res = trg_origin + trg_res
         
@@ -359,74 +769,368 @@ def make_dnt_BIO(src_sentence, src_origin, trg_sentence, trg_origin, alignments,
     
     return src_origin.strip(), trg_origin.strip()
 
+def replace_sentence(src, src_origin, trg, trg_origin, src_entities, found_als, probability, augment_prob, rng = random, detokenizer = None) -> tuple:
+    to_sample, draws = draw_replacements(src, src_entities, rng)
+    tried = tuple(draw >= probability for draw in draws)
+    src_res, trg_res = match_sentence(src, trg, src_entities, tried, to_sample, found_als, detokenizer)
+    return augment_sentence(src_res, src_origin, trg_res, trg_origin, augment_prob, to_sample, rng)
+
+def make_dnt_BIO(src_sentence, src_origin, trg_sentence, trg_origin, alignments, found_als, probability, augment_prob, verbosity = 0, rng = random, detokenizer = None) -> tuple: 
+    start = time.perf_counter()
+    src, trg = make_sentences(src_sentence, trg_sentence, alignments)
+    metrics.timers["build_sentences"] += time.perf_counter() - start
+    return replace_sentence(src, src_origin, trg, trg_origin, get_entities_align(src), found_als, probability, augment_prob, rng, detokenizer)
+
+def find_entity_spans(tag_ids, offsets):
+    """
+    Admitted entity spans of a batch of sentences in one vectorized pass, same spans as
+    get_entities_align sentence by sentence. `tag_ids` are the TAGS ids of the sentences
+    one after the other, sentence k covering tag_ids[offsets[k]:offsets[k + 1]].
+    Returns the flat start and (exclusive) end positions of the spans, in order.
+    """
+    import numpy as np
+
+    tag_ids = np.asarray(tag_ids, dtype = np.intp)
+    offsets = np.asarray(offsets, dtype = np.intp)
+    begins = np.frombuffer(bytes(TAGS.begins(admitted_tags)), dtype = np.bool_)
+    inside = np.frombuffer(bytes(TAGS.inside), dtype = np.bool_)
+
+    starts = np.flatnonzero(begins[tag_ids])
+    # a span stops on the first following token which is not "I-" or opens the next sentence
+    breaks = ~inside[tag_ids]
+    boundaries = offsets[1:-1]
+    breaks[boundaries[boundaries < len(tag_ids)]] = True
+    stops = np.append(np.flatnonzero(breaks), len(tag_ids))
+    ends = stops[np.searchsorted(stops, starts, side = "right")]
+    return starts, ends
+
+def build_batch(rows):
+    """
+    Sentences and source entities of a batch of (src_sentence, src_origin, trg_sentence,
+    trg_origin, alignments) rows, the entities of the whole batch found at once by
+    find_entity_spans. Returns [(src, trg), ...] and the entity list of each row.
+    """
+    batch_start = time.perf_counter()
+    sentences = [make_sentences(src_sentence, trg_sentence, alignments) for src_sentence, _, trg_sentence, _, alignments in rows]
+
+    tag_ids = array("i")
+    offsets = [0]
+    for src, _ in sentences:
+        tag_ids.extend(src.tags)
+        offsets.append(len(tag_ids))
+    built = time.perf_counter()
+    starts, ends = find_entity_spans(tag_ids, offsets)
+
+    entities = [[] for _ in rows]
+    for start, end in zip(starts.tolist(), ends.tolist()):
+        k = bisect_right(offsets, start) - 1
+        src, offset = sentences[k][0], offsets[k]
+        entities[k].append( (src.words[start - offset:end - offset], TAGS.names[tag_ids[start]], list(range(start - offset, end - offset))) )
+    metrics.timers["build_sentences"] += built - batch_start
+    metrics.timers["entity_matching"] += time.perf_counter() - built
+    return sentences, entities
+
+def make_dnt_BIO_batch(rows, probability, augment_prob, verbosity = 0, rngs = None, detokenizer = None) -> list:
+    """
+    make_dnt_BIO over a batch of rows (see build_batch). Each row draws from its own
+    generator in `rngs`. Returns (src, trg, found_als) per row.
+    """
+    sentences, entities = build_batch(rows)
+
+    results = []
+    for k, ((src, trg), (_, src_origin, _, trg_origin, _)) in enumerate(zip(sentences, rows)):
+        found_als = list()
+        src_res, trg_res = replace_sentence(src, src_origin, trg, trg_origin, entities[k], found_als, probability, augment_prob,
+                                            rngs[k] if rngs else random, detokenizer)
+        results.append((src_res, trg_res, found_als))
+    return results
+
+def make_dnt_BIO_variants(rows, variants, start = 0, verbosity = 0, detokenizer = None) -> list:
+    """
+    make_dnt_BIO_batch for several (probability, augment_prob, seed) variants at once, row
+    i of the corpus (start + k) drawing from line_rng(seed, i) as in a standalone run.
+    Sentences and entities are built once and the draws of a line once per seed; variants
+    with the same seed trying the same entities share its matching and detokenization,
+    and its augmentation when -g is the same too. Returns, per row, the (src, trg, found_als) of each variant.
+    """
+    sentences, entities = build_batch(rows)
+    seeds = list(dict.fromkeys(seed for _, _, seed in variants))
+
+    results = []
+    for k, ((src, trg), (_, src_origin, _, trg_origin, _)) in enumerate(zip(sentences, rows)):
+        # a variant picks up its seed's generator right after the shared draws
+        drawn = {}
+        for seed in seeds:
+            rng = line_rng(seed, start + k)
+            drawn[seed] = draw_replacements(src, entities[k], rng) + (rng.getstate(),)
+
+        matched = {}
+        augmented = {}
+        row_results = []
+        for probability, augment_prob, seed in variants:
+            to_sample, draws, state = drawn[seed]
+            tried = tuple(draw >= probability for draw in draws)
+
+            # nothing tried, the matching does not depend on the seed
+            key = (seed if any(tried) else None, tried)
+            if key not in matched:
+                found_als = list()
+                run_entities, metrics.entities = metrics.entities, Counter()
+                src_res, trg_res = match_sentence(src.copy(), trg.copy(), entities[k], tried, to_sample[:], found_als, detokenizer)
+                matched[key] = (src_res, trg_res, found_als, metrics.entities)
+                metrics.entities = run_entities
+            src_res, trg_res, found_als, entity_counts = matched[key]
+
+            # entity counters add up as if each variant ran on its own
+            metrics.entities.update(entity_counts)
+            if (seed, tried, augment_prob) not in augmented:
+                # the generator is only drawn from when DNTs get duplicated
+                if augment_prob > 0 and "{DNT0}" in src_res:
+                    rng.setstate(state)
+                augmented[seed, tried, augment_prob] = augment_sentence(src_res, src_origin, trg_res, trg_origin, augment_prob, to_sample, rng)
+            row_results.append(augmented[seed, tried, augment_prob] + (found_als,))
+        results.append(row_results)
+    return results
+
+
+
+# ====== SHARDING ====== #
+def line_rng(seed, line):
+    # one generator per line, so the output does not depend on how lines are split among workers
+    return random.Random(f"{seed}:{line}")
+
+def read_chunks(streams, chunk_size):
+    # group the aligned streams in chunks of consecutive lines, tagged with the first line number
+    chunk = []
+    start = 0
+    for row in zip(*streams):
+        chunk.append(row)
+        if len(chunk) == chunk_size:
+            yield start, chunk
+            start += len(chunk)
+            chunk = []
+    if chunk:
+        yield start, chunk
+
+def init_worker(target_language, cache_size = DECISION_CACHE_SIZE, cache_entries = None):
+    global lng_trg, decision_cache, metrics
+    lng_trg = target_language
+    metrics = Metrics()
+    # each worker starts from the parent's cache and reports back what it adds
+    decision_cache = DecisionCache(cache_size)
+    decision_cache.update(cache_entries or {})
+    decision_cache.track_new = True
+
+def process_chunk(start, chunk, probability, augment_prob, seed, verbosity, detokenizer = None, variants = None, alignment_cache = None,
+                  symmetrize = None):
+    parse_start = time.perf_counter()
+    if symmetrize:
+        # (forward, reverse) fast_align lines, symmetrized by the process that got the chunk
+        links = symmetrize_lines([row[4][0] for row in chunk], [row[4][1] for row in chunk], symmetrize)
+        chunk = [row[:4] + (alignment,) for row, alignment in zip(chunk, links)]
+    rows = []
+    for i, (src_sentence, src_origin, trg_sentence, trg_origin, alignment) in enumerate(chunk, start = start):
+
+        # make alignments readable from (str) to (int), symmetrized links are already parsed
+        # and cached ones are looked up by line number
+        if isinstance(alignment, str):
+            alignment = make_tuple(alignment.strip().split())
+        elif alignment is None:
+            alignment = alignment_cache.line(i)
+        rows.append((src_sentence, src_origin, trg_sentence, trg_origin, alignment))
+
+    metrics.timers["parse_alignment"] += time.perf_counter() - parse_start
+
+    if variants:
+        results = make_dnt_BIO_variants(rows, variants, start, verbosity, detokenizer)
+    else:
+        rngs = [line_rng(seed, i) for i in range(start, start + len(rows))]
+        results = make_dnt_BIO_batch(rows, probability, augment_prob, verbosity, rngs, detokenizer)
+    delta = decision_cache.drain()
+    delta["metrics"] = metrics.drain()
+    return results, delta
+
+def run_chunks(chunks, workers, settings):
+    # results come back chunk by chunk, in the original order
+    if workers <= 1:
+        for start, chunk in chunks:
+            yield process_chunk(start, chunk, *settings)
+        return
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    initargs = (lng_trg, decision_cache.max_size, dict(decision_cache.entries))
+    with ProcessPoolExecutor(max_workers = workers, initializer = init_worker, initargs = initargs) as pool:
+        pending = deque()
+        for start, chunk in chunks:
+            pending.append(pool.submit(process_chunk, start, chunk, *settings))
+            # bounded read-ahead, the streams are never fully loaded
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def collect_cache_stats(chunk_results, stats, merge_entries, run_metrics = None):
+    # sentence results chunk by chunk, summing the cache counters and metrics (and merging the workers' entries)
+    for results, delta in chunk_results:
+        entries = delta.pop("entries")
+        chunk_metrics = delta.pop("metrics")
+        if merge_entries:
+            decision_cache.update(entries)
+        if run_metrics is not None:
+            run_metrics.update(chunk_metrics)
+        stats.update(delta)
+        yield results
+
 
 
 # ====== MAIN ====== #
-def main(source_pavlov, target_pavlov, alignments, probability, augment_prob, verbosity):
+class VariantOutput:
+    """
+    Output corpora of one (probability, augment, seed) setting and its alignments log, the
+    found alignments of a --log-sample fraction of the lines streamed to it.
+    """
+    def __init__(self, source_out, target_out, log_path, log_sample, seed):
+        self.source_out = source_out
+        self.target_out = target_out
+        self.log_path = log_path
+        self.log_sample = log_sample
+        self.log_rng = random.Random(seed)
+        self.log_file = None
+        self.dnt_counts = 0
+        self.align_count = 0
+
+    def write(self, i, src_sentence, trg_sentence, found_als, verbosity):
+        self.source_out.write(src_sentence + "\n")
+        self.target_out.write(trg_sentence + "\n")
+        
+        self.dnt_counts += src_sentence.count("{DNT0}") + trg_sentence.count("{DNT0}")
+
+        found_to_append = str((i, found_als))
+        self.align_count += found_to_append.count("->")
+        if found_als and verbosity and (self.log_sample >= 1 or self.log_rng.random() < self.log_sample): 
+            if self.log_file is None:
+                self.log_file = open(self.log_path, "w")
+            self.log_file.write(found_to_append + "\n")
+
+    def close(self):
+        if self.log_file is not None:
+            self.log_file.close()
+
+def parse_variant(spec, default_seed = 0):
+    # "p:g[:seed]" -> (label, probability, augment_prob, seed), p and g read as -p and -g (an empty one is not given)
+    values = spec.split(":")
+    if len(values) not in (2, 3):
+        raise ValueError(f"Invalid variant {spec!r}, expected probability:augment[:seed]")
+    probability, augment = values[:2]
+    seed = int(values[2]) if len(values) == 3 and values[2] else default_seed
+    label = "-".join(f"{name}{float(value):g}" if value else f"{name}none" for name, value in (("p", probability), ("g", augment)))
+    return (f"{label}-s{seed}",
+            (1 - float(probability)) if probability else .0,
+            (1 - float(augment)) if augment else 0,
+            seed)
+
+
+def main(source_pavlov, target_pavlov, alignments, probability, augment_prob, verbosity, workers = 1, seed = 0, chunk_size = 2_000,
+         forward = None, reverse = None, symmetrize = "union", decision_cache_path = None, decision_cache_size = DECISION_CACHE_SIZE,
+         metrics_path = None, metrics_format = "jsonl", metrics_every = 100_000, log_sample = 1., variants = None,
+         alignment_cache = None):
+
+    global lng_trg, decision_cache
+    run_metrics = Metrics()
+    start_time = time.perf_counter()
+
+    decision_cache = DecisionCache(decision_cache_size)
+    if decision_cache_path and os.path.exists(decision_cache_path):
+        decision_cache.load(decision_cache_path)
+        print(f"Decision cache -> {len(decision_cache):,} entries loaded\n")
+    cache_stats = Counter()
+
+    if forward:
+        # symmetrized on the fly from the fast_align outputs, chunk by chunk in the workers, no intermediate file
+        als = read_directions(forward, reverse)
+        align_stream = als
+    elif alignment_cache is not None:
+        # parsed once into a memory-mapped cache, chunks only carry line numbers
+        als = open_alignment_cache(alignments, alignment_cache or None)
+        align_stream = repeat(None, len(als))
+    else:
+        als = open_text(alignments, "r")
+        align_stream = als
 
-    global lng_trg
-    dnt_counts = 0
+    # found alignments are streamed to the log, a --log-sample fraction of the lines when it's too big
+    out = find_equal_prefix(source_pavlov, target_pavlov)
+    log_dir = out if "/" in out else ""
     
-    with open(alignments, "r") as als, \
-         open(source_pavlov[:-7], "r") as orig_source, \
-         open(target_pavlov[:-7], "r") as orig_target, \
-         open(source_pavlov + f".dnts5", "w") as source_out, \
-         open(target_pavlov + f".dnts5", "w") as target_out:
+    with closing(als), ExitStack() as stack, \
+         open_text(strip_suffix(source_pavlov, ".pavlov"), "r") as orig_source, \
+         open_text(strip_suffix(target_pavlov, ".pavlov"), "r") as orig_target:
+
+        # one pair of outputs per variant, labelled when several settings share the pass
+        outputs = []
+        for label, _, _, variant_seed in variants or [("", probability, augment_prob, seed)]:
+            suffix = f".{label}" if label else ""
+            source_out = stack.enter_context(open_text(add_suffix(source_pavlov, suffix + ".dnts5"), "w"))
+            target_out = stack.enter_context(open_text(add_suffix(target_pavlov, suffix + ".dnts5"), "w"))
+            outputs.append(VariantOutput(source_out, target_out, f"{log_dir}alignments4{suffix}.log", log_sample, variant_seed))
+            stack.callback(outputs[-1].close)
         
         source = load_pickle(source_pavlov)
         target = load_pickle(target_pavlov)
-        alignments_found = []
-        align_count = 0
 
         #extract language
         lng_src, lng_trg = re.findall(r'\.\w{2,3}-\w{2,3}\.(\w{2,3})', source_pavlov + target_pavlov)
         print(f"SRC language -> {lng_src}\n")
         print(f"TRG language -> {lng_trg}\n")
         
-
-        for i, (src_sentence, src_origin, trg_sentence, trg_origin, alignment) in enumerate(zip( source, orig_source, target, orig_target, als ), start = 0):
-
-            # make alignments readable from (str) to (int)
-            alignment = make_tuple(alignment.strip().split())
-
-            found_als = list()
-            src_sentence, trg_sentence  = make_dnt_BIO( src_sentence, 
-                                                        src_origin,
-                                                        trg_sentence, 
-                                                        trg_origin,
-                                                        alignment, 
-                                                        found_als,
-                                                        probability,
-                                                        augment_prob,
-                                                        verbosity )
-            
-            source_out.write(src_sentence + "\n")
-            target_out.write(trg_sentence + "\n")
+        chunks = read_chunks((source, orig_source, target, orig_target, align_stream), chunk_size)
+        settings = (probability, augment_prob, seed, verbosity, Detokenizer(lng_trg),
+                    [variant[1:] for variant in variants] if variants else None,
+                    als if align_stream is not als else None,
+                    symmetrize if forward else None)
+        chunk_results = run_chunks(chunks, workers, settings)
+        results = chain.from_iterable(collect_cache_stats(chunk_results, cache_stats, workers > 1, run_metrics))
+
+        lines = 0
+        for i, row_results in enumerate(results, start = 0):
             
-            dnt_counts += src_sentence.count("{DNT0}") + trg_sentence.count("{DNT0}")
+            lines = i + 1
+            write_start = time.perf_counter()
+            for output, (src_sentence, trg_sentence, found_als) in zip(outputs, row_results if variants else [row_results]):
+                output.write(i, src_sentence, trg_sentence, found_als, verbosity)
 
             if i % 100_000 == 0:
                 print(f"Iteration -> {i:,}")
-            
-            found_to_append = str((i, found_als))
-            align_count += found_to_append.count("->")
-            if found_als and verbosity: 
-                alignments_found.append(str((i, found_als)))
-
+            run_metrics.timers["write"] += time.perf_counter() - write_start
 
-        if verbosity:  
-            out = find_equal_prefix(source_pavlov, target_pavlov)
-            if alignments_found:
+            if metrics_path and lines % metrics_every == 0:
+                write_metrics(metrics_path, metrics_format, run_metrics.snapshot(lines, sum(output.dnt_counts for output in outputs),
+                                                                                 time.perf_counter() - start_time, cache_stats))
 
-                with open( (out if "/" in out else "") + "alignments4.log" , "w") as f:
-                    f.writelines([el + "\n" for el in alignments_found])
+        if metrics_path:
+            write_metrics(metrics_path, metrics_format, run_metrics.snapshot(lines, sum(output.dnt_counts for output in outputs),
+                                                                             time.perf_counter() - start_time, cache_stats))
 
 
     print()
     print("  ================================  ")
-    print(f"DNTs in each corpora = {dnt_counts // 2:,}")
+    if variants:
+        for (label, *_), output in zip(variants, outputs):
+            print(f"DNTs in each corpora [{label}] = {output.dnt_counts // 2:,}")
+    else:
+        print(f"DNTs in each corpora = {outputs[0].dnt_counts // 2:,}")
+    lookups = cache_stats["hits"] + cache_stats["misses"]
+    print(f"Decision cache = {cache_stats['hits']:,} hits, {cache_stats['misses']:,} misses "
+          f"({cache_stats['hits'] / lookups if lookups else 0:.1%} hit rate), {cache_stats['evictions']:,} evictions")
+    entities = run_metrics.entities
+    rejected = ", ".join(f"{reason} {entities['rejected_' + reason]:,}" for reason in REJECTION_REASONS if entities["rejected_" + reason])
+    print(f"Entities = {entities['seen']:,} seen, {entities['accepted']:,} accepted, {entities['skipped']:,} skipped"
+          + (f", rejected: {rejected}" if rejected else ""))
     print("  ================================  ")
 
+    if decision_cache_path:
+        decision_cache.save(decision_cache_path)
+
 
 
 
@@ -438,13 +1142,60 @@ if __name__ == "__main__":
     parser.add_argument("-p", "--probability", help = "In case a probability filter is wanted to be used", default= .0)
     parser.add_argument("-g", "--augment", help = "probability to duplicate dnts", default= .0)
     parser.add_argument("-v", "--verbosity", help = "Verbosity", default= 0)
+    parser.add_argument("-w", "--workers", help = "Number of worker processes", default = 1)
+    parser.add_argument("--seed", help = "Seed for the per-line random generators", default = 0)
+    parser.add_argument("--chunk-size", help = "Lines sent to a worker at once", default = 2_000)
+    parser.add_argument("--decision-cache", help = "File keeping the entity pair decisions across runs", default = None)
+    parser.add_argument("--decision-cache-size", help = "Entries kept in the decision cache", default = DECISION_CACHE_SIZE)
+    parser.add_argument("--metrics", help = "File receiving stage timers and entity counters every --metrics-every lines", default = None)
+    parser.add_argument("--metrics-format", help = "Appended JSON lines or a Prometheus textfile (rewritten)", choices = ["jsonl", "prometheus"], default = "jsonl")
+    parser.add_argument("--metrics-every", help = "Lines between two metrics snapshots", default = 100_000)
+    parser.add_argument("--log-sample", help = "Fraction of the lines with found alignments written to alignments4.log (-v 1)", default = 1.)
+    parser.add_argument("--variants", help = "Settings produced in the same pass as probability:augment[:seed] (e.g. .2:.5 .5:.5:1), "
+                                             "each written to <pavlov>.p<p>-g<g>-s<seed>.dnts5 instead of -p/-g", nargs = "+", default = None)
+    parser.add_argument("--alignment-cache", help = "Read -a through its binary cache (at the given path, <alignments>.cache by default), "
+                                                    "built on first use and rebuilt when -a changes", nargs = "?", const = "", default = None)
+    parser.add_argument("--forward", help = "Forward alignments, symmetrized with --reverse instead of reading -a")
+    parser.add_argument("--reverse", help = "Reverse alignments")
+    parser.add_argument("--symmetrize", help = "Symmetrization heuristic for --forward/--reverse", choices = ["grow-diag",
+                                                                                                          "grow-diag-final",
+                                                                                                          "grow-diag-final-and",
+                                                                                                          "intersect",
+                                                                                                          "invert",
+                                                                                                          "union"], default = "union")
 
 
     args = parser.parse_args()
+    if args.forward and not args.reverse and args.symmetrize != "invert":
+        parser.error(f"--symmetrize {args.symmetrize} needs both --forward and --reverse")
+    if args.forward and args.alignment_cache is not None:
+        parser.error("--alignment-cache caches -a, it can not be used with --forward/--reverse")
+    variants = None
+    if args.variants:
+        try:
+            variants = [parse_variant(spec, int(args.seed)) for spec in args.variants]
+        except ValueError as error:
+            parser.error(str(error))
+        if len({label for label, *_ in variants}) < len(variants):
+            parser.error("--variants contains the same setting twice")
 
     main(args.source, 
          args.target, 
          args.alignents,
          (1 - float(args.probability)) if args.probability else .0, 
          (1 - float(args.augment)) if args.augment else 0, 
-         args.verbosity)
+         args.verbosity,
+         int(args.workers),
+         int(args.seed),
+         int(args.chunk_size),
+         args.forward,
+         args.reverse,
+         args.symmetrize,
+         args.decision_cache,
+         int(args.decision_cache_size),
+         args.metrics,
+         args.metrics_format,
+         int(args.metrics_every),
+         float(args.log_sample),
+         variants,
+         args.alignment_cache)
@@ -0,0 +1,228 @@
+"""
+Binary, memory-mappable cache of a text alignment file (`i-j` links, one line per
+sentence pair), so the links are parsed once instead of at every run.
+
+    header  | MAGIC, version, link width (2 or 4 bytes), size and mtime of the alignment file
+    links   | signed (src, trg) pairs, line after line
+    lines   | uint64 end (in links) of each line
+    footer  | section offsets and counts, MAGIC
+
+Integers are little endian and sections 8-byte aligned, as in the binary .pavlov files.
+The cache is stale, and rebuilt, as soon as the alignment file's size or mtime changes.
+"""
+
+import os
+import sys
+import mmap
+import struct
+import argparse
+import tempfile
+from array import array
+
+from corpus_io import open_text
+
+MAGIC = b"ALIGNC\0\0"
+VERSION = 1
+HEADER = struct.Struct("<8sIIQQ")
+FOOTER = struct.Struct("<4Q8s")
+LITTLE_ENDIAN = sys.byteorder == "little"
+FLUSH_EVERY = 1 << 20
+INT16_MAX = (1 << 15) - 1
+
+
+def default_cache_path(alignments):
+    return alignments + ".cache"
+
+def source_stamp(alignments):
+    stat = os.stat(alignments)
+    return stat.st_size, stat.st_mtime_ns
+
+def _to_le(values: array) -> bytes:
+    if not LITTLE_ENDIAN:
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+def _pad(f):
+    f.write(b"\0" * (-f.tell() % 8))
+
+
+# ====== BUILD ====== #
+def build_cache(alignments, cache_path = None):
+    """
+    Parses `alignments` once and writes its cache (atomically). Links are stored on two
+    bytes when every index fits, four otherwise. Returns the number of lines.
+    """
+    cache_path = cache_path or default_cache_path(alignments)
+    size, mtime = source_stamp(alignments)
+    cache_dir = os.path.dirname(os.path.abspath(cache_path))
+
+    # links are spilled as int32 while the widest index is not known yet
+    links = array("i")
+    line_ends = array("Q")
+    n_links = 0
+    largest = 0
+    with open_text(alignments, "r") as f, tempfile.TemporaryFile(dir = cache_dir) as spill:
+        for line in f:
+            # "i-j i-j" -> i j i j
+            links.extend(map(int, line.replace("-", " ").split()))
+            if len(links) >= FLUSH_EVERY:
+                largest = max(largest, max(links), -min(links))
+                n_links += len(links) // 2
+                spill.write(links.tobytes())
+                links = array("i")
+            line_ends.append(n_links + len(links) // 2)
+        if links:
+            largest = max(largest, max(links), -min(links))
+            n_links += len(links) // 2
+            spill.write(links.tobytes())
+
+        width = 2 if largest <= INT16_MAX else 4
+        fd, tmp_path = tempfile.mkstemp(dir = cache_dir, suffix = ".tmp")
+        try:
+            with os.fdopen(fd, "wb") as out:
+                out.write(HEADER.pack(MAGIC, VERSION, width, size, mtime))
+                _pad(out)
+                links_offset = out.tell()
+                spill.seek(0)
+                while True:
+                    block = spill.read(4 * FLUSH_EVERY)
+                    if not block:
+                        break
+                    values = array("i")
+                    values.frombytes(block)
+                    out.write(_to_le(array("h", values) if width == 2 else values))
+                _pad(out)
+                lines_offset = out.tell()
+                out.write(_to_le(line_ends))
+                out.write(FOOTER.pack(links_offset, n_links, lines_offset, len(line_ends), MAGIC))
+            os.replace(tmp_path, cache_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    return len(line_ends)
+
+def is_fresh(alignments, cache_path = None):
+    # the cache exists, is readable and was built from the current alignment file
+    cache_path = cache_path or default_cache_path(alignments)
+    try:
+        with open(cache_path, "rb") as f:
+            magic, version, _, size, mtime = HEADER.unpack(f.read(HEADER.size))
+    except (OSError, struct.error):
+        return False
+    return magic == MAGIC and version == VERSION and (size, mtime) == source_stamp(alignments)
+
+
+# ====== READER ====== #
+class AlignmentCache:
+    """
+    Random access view over an alignment cache: cache[n] and cache.line(n) are the links
+    of line n as [(i, j), ...], the same lists make_tuple returns; cache.lines(a, b)
+    iterates a range of lines.
+    """
+
+    def __init__(self, cache_path):
+        self.path = cache_path
+        self.f = open(cache_path, "rb")
+        self.mm = mmap.mmap(self.f.fileno(), 0, access = mmap.ACCESS_READ)
+
+        magic, version, width, self.source_size, self.source_mtime = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{cache_path} is not an alignment cache")
+        if version != VERSION:
+            raise ValueError(f"{cache_path}: unsupported alignment cache version {version}")
+        links_offset, n_links, lines_offset, self.n_lines, magic = FOOTER.unpack_from(self.mm, len(self.mm) - FOOTER.size)
+        if magic != MAGIC:
+            raise ValueError(f"{cache_path}: truncated alignment cache")
+
+        self.view = memoryview(self.mm)
+        self.links = self._column(links_offset, 2 * n_links, "h" if width == 2 else "i")
+        self.line_ends = self._column(lines_offset, self.n_lines, "Q")
+
+    def _column(self, offset, length, typecode):
+        size = array(typecode).itemsize
+        column = self.view[offset: offset + size * length]
+        if LITTLE_ENDIAN:
+            return column.cast(typecode)
+        values = array(typecode, column)
+        values.byteswap()
+        return values
+
+    def __len__(self):
+        return self.n_lines
+
+    def line(self, n):
+        start = self.line_ends[n - 1] if n else 0
+        pairs = self.links[2 * start: 2 * self.line_ends[n]].tolist()
+        return list(zip(pairs[::2], pairs[1::2]))
+
+    def lines(self, start = 0, stop = None):
+        stop = self.n_lines if stop is None else min(stop, self.n_lines)
+        for n in range(start, stop):
+            yield self.line(n)
+
+    def __getitem__(self, n):
+        if n < 0:
+            n += self.n_lines
+        if not 0 <= n < self.n_lines:
+            raise IndexError("alignment line out of range")
+        return self.line(n)
+
+    def __iter__(self):
+        return self.lines()
+
+    def __reduce__(self):
+        # sent to worker processes by path, each one maps the file once
+        return shared_cache, (self.path,)
+
+    def close(self):
+        if self.mm.closed:
+            return
+        for column in (self.links, self.line_ends):
+            if isinstance(column, memoryview):
+                column.release()
+        self.view.release()
+        self.mm.close()
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+_shared = {}
+
+def shared_cache(cache_path):
+    # one open reader per cache and process
+    if cache_path not in _shared:
+        _shared[cache_path] = AlignmentCache(cache_path)
+    return _shared[cache_path]
+
+def open_alignment_cache(alignments, cache_path = None):
+    # reader over the cache of `alignments`, (re)built first when missing or stale
+    cache_path = cache_path or default_cache_path(alignments)
+    if not is_fresh(alignments, cache_path):
+        _shared.pop(cache_path, None)
+        lines = build_cache(alignments, cache_path)
+        print(f"Alignment cache -> {cache_path} built ({lines:,} lines)\n")
+    return AlignmentCache(cache_path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Convert text alignment files to the binary alignment cache")
+    parser.add_argument("files", nargs = "+", help = "Alignment files (i-j links)")
+    parser.add_argument("-o", "--output", help = "Cache path (single input only), <file>.cache by default")
+    parser.add_argument("-f", "--force", help = "Rebuild even when the cache is up to date", action = "store_true")
+
+    args = parser.parse_args()
+    if args.output and len(args.files) > 1:
+        parser.error("-o can only be used with a single input file")
+
+    for filename in args.files:
+        cache_path = args.output or default_cache_path(filename)
+        if not args.force and is_fresh(filename, cache_path):
+            print(f"{cache_path} is up to date, skipping")
+            continue
+        lines = build_cache(filename, cache_path)
+        print(f"{filename} -> {cache_path} ({lines:,} lines, {os.path.getsize(cache_path):,} bytes)")
@@ -0,0 +1,212 @@
+"""
+Transparent compressed I/O for the corpora: files ending in .gz, .xz, .bz2 (and .zst when
+zstandard is installed) are decompressed or compressed on the fly, anything else is a
+plain file.
+
+Codec work runs on a background thread exchanging large blocks with the caller through
+a bounded queue: zlib, lzma, bz2 and zstd release the GIL, so the reading or writing
+loop keeps going while the next block is (de)compressed.
+"""
+
+import io
+import os
+import threading
+from queue import Queue, Full
+
+COMPRESSIONS = (".gz", ".xz", ".bz2", ".zst")
+BLOCK_SIZE = 1 << 22
+QUEUE_SIZE = 8
+# rough uncompressed/compressed ratios of text corpora, to size buffers from the file size
+COMPRESSION_RATIOS = {".gz": 4, ".xz": 6, ".bz2": 5, ".zst": 5}
+
+
+# ====== NAMES ====== #
+def split_compression(filename):
+    # "train.en.pavlov.xz" -> ("train.en.pavlov", ".xz"), plain files get ""
+    for ext in COMPRESSIONS:
+        if filename.endswith(ext):
+            return filename[:-len(ext)], ext
+    return filename, ""
+
+def is_compressed(filename):
+    return bool(split_compression(filename)[1])
+
+def add_suffix(filename, suffix):
+    # the suffix goes before the compression extension: train.en.xz -> train.en.pavlov.xz
+    base, ext = split_compression(filename)
+    return base + suffix + ext
+
+def strip_suffix(filename, suffix):
+    base, ext = split_compression(filename)
+    if not base.endswith(suffix):
+        raise ValueError(f"{filename} does not end with {suffix}")
+    return base[:-len(suffix)] + ext
+
+def estimated_size(filename):
+    # uncompressed size, estimated for compressed files
+    return os.path.getsize(filename) * COMPRESSION_RATIOS.get(split_compression(filename)[1], 1)
+
+
+# ====== CODECS ====== #
+def _zstd():
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError("zstandard is needed for .zst files: pip install zstandard") from None
+    return zstandard
+
+def open_codec(filename, mode):
+    # unthreaded binary stream of a compressed file, mode is "rb", "wb" or "ab"
+    ext = split_compression(filename)[1]
+    if ext == ".gz":
+        import gzip
+        return gzip.open(filename, mode, compresslevel = 6)
+    if ext == ".xz":
+        import lzma
+        return lzma.open(filename, mode)
+    if ext == ".bz2":
+        import bz2
+        return bz2.open(filename, mode)
+    if ext == ".zst":
+        zstandard = _zstd()
+        if mode == "rb":
+            return zstandard.ZstdDecompressor().stream_reader(open(filename, "rb"), read_across_frames = True, closefd = True)
+        return zstandard.ZstdCompressor().stream_writer(open(filename, mode), closefd = True)
+    raise ValueError(f"{filename} is not compressed")
+
+
+class ThreadedReader(io.RawIOBase):
+    # decompressed blocks are read ahead by a thread, up to `queue_size` of them
+
+    def __init__(self, stream, block_size = BLOCK_SIZE, queue_size = QUEUE_SIZE):
+        self.stream = stream
+        self.queue = Queue(queue_size)
+        self.pending = memoryview(b"")
+        self.eof = False
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target = self._read, args = (block_size,), daemon = True)
+        self.thread.start()
+
+    def _put(self, item):
+        while not self.stop.is_set():
+            try:
+                self.queue.put(item, timeout = .1)
+                return True
+            except Full:
+                pass
+        return False
+
+    def _read(self, block_size):
+        try:
+            while True:
+                block = self.stream.read(block_size)
+                if not self._put(block) or not block:
+                    return
+        except BaseException as error:
+            self._put(error)
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        if not self.pending:
+            if self.eof:
+                return 0
+            item = self.queue.get()
+            if isinstance(item, BaseException):
+                raise item
+            if not item:
+                self.eof = True
+                return 0
+            self.pending = memoryview(item)
+        n = min(len(b), len(self.pending))
+        b[:n] = self.pending[:n]
+        self.pending = self.pending[n:]
+        return n
+
+    def close(self):
+        if self.closed:
+            return
+        self.stop.set()
+        self.thread.join()
+        self.stream.close()
+        super().close()
+
+
+class ThreadedWriter(io.RawIOBase):
+    # blocks are handed to a thread which compresses and writes them
+
+    def __init__(self, stream, queue_size = QUEUE_SIZE):
+        self.stream = stream
+        self.queue = Queue(queue_size)
+        self.position = 0
+        self.error = None
+        self.thread = threading.Thread(target = self._write, daemon = True)
+        self.thread.start()
+
+    def _write(self):
+        while True:
+            block = self.queue.get()
+            if block is None:
+                return
+            if self.error is None:
+                try:
+                    self.stream.write(block)
+                except BaseException as error:
+                    self.error = error
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        if self.error is not None:
+            raise self.error
+        block = bytes(b)
+        self.queue.put(block)
+        self.position += len(block)
+        return len(block)
+
+    def tell(self):
+        # uncompressed position, what the writers of the .pavlov layout need
+        return self.position
+
+    def close(self):
+        if self.closed:
+            return
+        super().close()
+        self.queue.put(None)
+        self.thread.join()
+        self.stream.close()
+        if self.error is not None:
+            raise self.error
+
+
+# ====== OPEN ====== #
+def open_binary(filename, mode = "rb", block_size = BLOCK_SIZE, queue_size = QUEUE_SIZE):
+    if not is_compressed(filename):
+        return open(filename, mode)
+    mode = mode.replace("b", "") + "b"
+    if mode == "rb":
+        return io.BufferedReader(ThreadedReader(open_codec(filename, mode), block_size, queue_size), buffer_size = block_size)
+    if mode in ("wb", "ab"):
+        return io.BufferedWriter(ThreadedWriter(open_codec(filename, mode), queue_size), buffer_size = block_size)
+    raise ValueError(f"Unsupported mode {mode!r} for compressed files")
+
+def open_text(filename, mode = "r", encoding = None, errors = None, newline = None, **kwargs):
+    # same arguments as open(), compressed files are wrapped in a text layer
+    if not is_compressed(filename):
+        return open(filename, mode, encoding = encoding, errors = errors, newline = newline)
+    return io.TextIOWrapper(open_binary(filename, mode.replace("t", "") + "b", **kwargs),
+                            encoding = encoding, errors = errors, newline = newline)
+
+def seek_forward(f, offset):
+    # from the start of f: plain files seek, compressed streams are read and dropped up to offset
+    if f.seekable():
+        f.seek(offset)
+        return
+    left = offset
+    while left > 0:
+        data = f.read(min(left, BLOCK_SIZE))
+        if not data:
+            break
+        left -= len(data)
@@ -0,0 +1,305 @@
+"""
+In-process word aligner implementing fast_align's reparameterized IBM Model 2
+(Dyer et al., 2013): diagonal alignment prior with optimized tension (-d -o),
+variational Bayes lexical table (-v), fixed NULL probability.
+
+EM runs batched over flat sentence-pair arrays: every (target word, source position)
+cell of a batch is one element of a NumPy vector, and the lexical table is sparse,
+one value per co-occurring (source word, target word) pair.
+Output lines have the same "i-j" format fast_align writes.
+"""
+
+import sys
+import time
+import argparse
+import numpy as np
+
+from pavlov_binary import load_pavlov
+from corpus_io import open_text
+
+NULL = 0
+
+
+def digamma(x):
+    # same series expansion fast_align uses
+    x = np.array(x, dtype = np.float64)
+    result = np.zeros_like(x)
+    for _ in range(7):
+        small = x < 7
+        if not small.any():
+            break
+        result[small] -= 1 / x[small]
+        x[small] += 1
+    x = x - .5
+    xx = 1 / x
+    xx2 = xx * xx
+    xx4 = xx2 * xx2
+    return result + np.log(x) + (1. / 24.) * xx2 - (7. / 960.) * xx4 + (31. / 8064.) * xx4 * xx2 - (127. / 30720.) * xx4 * xx4
+
+
+def sorted_unique(values):
+    # np.unique, without the hash based path that is slow on large int64 arrays
+    values = np.sort(values)
+    return values[np.concatenate(([True], values[1:] != values[:-1]))] if len(values) else values
+
+def lookup(keys, needles):
+    # positions of needles inside the sorted keys, searching sorted needles is much faster
+    uniques, inverse = np.unique(needles, return_inverse = True)
+    return np.searchsorted(keys, uniques)[inverse]
+
+
+# ====== CORPUS ====== #
+class ParallelCorpus:
+    # words mapped to ids and flattened, source ids start at 1 (0 is NULL)
+
+    def __init__(self, pairs):
+        src_vocab, trg_vocab = {}, {}
+        src_ids, trg_ids = [], []
+        src_lens, trg_lens = [], []
+        for src_words, trg_words in pairs:
+            src_ids.extend(src_vocab.setdefault(word, len(src_vocab) + 1) for word in src_words)
+            trg_ids.extend(trg_vocab.setdefault(word, len(trg_vocab) + 1) for word in trg_words)
+            src_lens.append(len(src_words))
+            trg_lens.append(len(trg_words))
+
+        self.n_pairs = len(src_lens)
+        self.src = np.array(src_ids, dtype = np.int64)
+        self.trg = np.array(trg_ids, dtype = np.int64)
+        self.src_offsets = np.concatenate(([0], np.cumsum(src_lens, dtype = np.int64)))
+        self.trg_offsets = np.concatenate(([0], np.cumsum(trg_lens, dtype = np.int64)))
+        self.src_vocab_size = len(src_vocab) + 1
+        self.trg_vocab_size = len(trg_vocab) + 1
+
+    def reversed(self):
+        # the same corpus with the two sides swapped
+        other = object.__new__(ParallelCorpus)
+        other.n_pairs = self.n_pairs
+        other.src, other.trg = self.trg, self.src
+        other.src_offsets, other.trg_offsets = self.trg_offsets, self.src_offsets
+        other.src_vocab_size, other.trg_vocab_size = self.trg_vocab_size, self.src_vocab_size
+        return other
+
+
+# ====== MODEL ====== #
+class FastAlignModel:
+
+    def __init__(self,
+                 iterations = 5,
+                 favor_diagonal = True,
+                 optimize_tension = True,
+                 variational_bayes = True,
+                 alpha = .01,
+                 prob_align_null = .08,
+                 diagonal_tension = 4.,
+                 batch_cells = 1 << 22,
+                 cache_cells = 50_000_000):
+        self.iterations = iterations
+        self.favor_diagonal = favor_diagonal
+        self.optimize_tension = optimize_tension
+        self.variational_bayes = variational_bayes
+        self.alpha = alpha
+        self.prob_align_null = prob_align_null
+        self.diagonal_tension = diagonal_tension
+        self.batch_cells = batch_cells
+        self.cache_cells = cache_cells
+        self.final_tension = diagonal_tension
+
+    # ------ batches ------ #
+    def _split(self, corpus):
+        # consecutive sentence pairs, about batch_cells (target word, source position) cells each
+        src_lens = np.diff(corpus.src_offsets)
+        trg_lens = np.diff(corpus.trg_offsets)
+        cells = trg_lens * (src_lens + 1)
+        usable = np.flatnonzero((src_lens > 0) & (trg_lens > 0))
+
+        batches, start, total = [], 0, 0
+        for k, sent in enumerate(usable.tolist()):
+            total += int(cells[sent])
+            if total >= self.batch_cells:
+                batches.append(usable[start:k + 1])
+                start, total = k + 1, 0
+        if start < len(usable):
+            batches.append(usable[start:])
+        return batches
+
+    def _cells(self, corpus, sents):
+        n = corpus.src_offsets[sents + 1] - corpus.src_offsets[sents]
+        m = corpus.trg_offsets[sents + 1] - corpus.trg_offsets[sents]
+
+        # one row per target word
+        row_sent = np.repeat(np.arange(len(sents)), m)
+        row_j = np.arange(m.sum()) - np.repeat(np.cumsum(m) - m, m) + 1
+        row_m = m[row_sent]
+        row_n = n[row_sent]
+        row_word = corpus.trg[corpus.trg_offsets[sents][row_sent] + row_j - 1]
+
+        # one cell per (target word, source position), position 0 is NULL
+        width = row_n + 1
+        first = np.cumsum(width) - width
+        cell_row = np.repeat(np.arange(len(row_j)), width)
+        cell_i = np.arange(width.sum()) - first[cell_row]
+        null = cell_i == 0
+        src_pos = corpus.src_offsets[sents][row_sent][cell_row] + cell_i - 1
+        cell_word = np.where(null, NULL, corpus.src[np.where(null, 0, src_pos)])
+
+        i_over_n = cell_i / row_n[cell_row]
+        cell_m = row_m[cell_row]
+        cell_j = row_j[cell_row]
+        return {"sents": sents,
+                "row_j": row_j,
+                "row_sent": row_sent,
+                "first": first,
+                "width": width,
+                "cell_row": cell_row,
+                "null": null,
+                "keys": cell_word * corpus.trg_vocab_size + row_word[cell_row],
+                # alignment feature, fast_align uses the 0-based target position for the empirical one
+                "feature": np.where(null, 0., -np.abs(i_over_n - cell_j / cell_m)),
+                "emp_feature": np.where(null, 0., -np.abs(i_over_n - (cell_j - 1) / cell_m))}
+
+    # ------ diagonal prior ------ #
+    def _prior(self, batch, tension):
+        if not self.favor_diagonal:
+            return 1. / batch["width"][batch["cell_row"]]
+        unnormalized = np.where(batch["null"], 0., np.exp(tension * batch["feature"]))
+        z = np.add.reduceat(unnormalized, batch["first"])
+        return np.where(batch["null"],
+                        self.prob_align_null,
+                        unnormalized * (1 - self.prob_align_null) / z[batch["cell_row"]])
+
+    def _model_feature(self, size_counts, tension):
+        # expected alignment feature under the prior, summed over every target position
+        total = 0.
+        for (m, n), count in size_counts.items():
+            h = -np.abs(np.arange(1, n + 1)[None, :] / n - np.arange(1, m + 1)[:, None] / m)
+            w = np.exp(tension * h)
+            total += count * ((h * w).sum(axis = 1) / w.sum(axis = 1)).sum()
+        return total
+
+    # ------ EM ------ #
+    def align(self, corpus, reverse = False):
+        """
+        Returns one list of (source index, target index) links per sentence pair.
+        With reverse = True target words generate source words (fast_align -r),
+        links are still reported as (source, target).
+        """
+        if reverse:
+            corpus = corpus.reversed()
+
+        splits = self._split(corpus)
+        src_lens = np.diff(corpus.src_offsets)
+        trg_lens = np.diff(corpus.trg_offsets)
+
+        # batches are kept in memory when they fit, rebuilt at every iteration otherwise
+        cached = None
+        if int((trg_lens * (src_lens + 1)).sum()) <= self.cache_cells:
+            cached = [self._cells(corpus, sents) for sents in splits]
+        def batches():
+            return cached if cached is not None else (self._cells(corpus, sents) for sents in splits)
+
+        # sparse lexical table: one slot per co-occurring (source word, target word) pair
+        keys = sorted_unique(np.concatenate([sorted_unique(batch["keys"]) for batch in batches()] + [np.zeros(0, np.int64)]))
+        key_src = keys // corpus.trg_vocab_size
+        table = np.full(len(keys), 1e-9)
+        for batch in cached or []:
+            batch["slots"] = lookup(keys, batch["keys"])
+
+        toks = max(int(trg_lens.sum()), 1)
+        size_counts = {}
+        for m, n in zip(trg_lens.tolist(), src_lens.tolist()):
+            if m and n:
+                size_counts[(m, n)] = size_counts.get((m, n), 0) + 1
+
+        tension = self.diagonal_tension
+        res = [[] for _ in range(corpus.n_pairs)]
+        for iteration in range(self.iterations):
+            final = iteration == self.iterations - 1
+            counts = np.zeros(len(keys))
+            emp_feat = 0.
+
+            for batch in batches():
+                slots = batch["slots"] if "slots" in batch else lookup(keys, batch["keys"])
+                score = table[slots] * self._prior(batch, tension)
+
+                if final:
+                    self._viterbi(batch, score, reverse, res)
+                    continue
+
+                total = np.add.reduceat(score, batch["first"])
+                posterior = score / total[batch["cell_row"]]
+                counts += np.bincount(slots, weights = posterior, minlength = len(keys))
+                emp_feat += float((posterior * batch["emp_feature"]).sum())
+
+            if final:
+                break
+
+            emp_feat /= toks
+            if self.favor_diagonal and self.optimize_tension and iteration > 0:
+                for _ in range(8):
+                    mod_feat = self._model_feature(size_counts, tension) / toks
+                    tension += (emp_feat - mod_feat) * 20.
+                    tension = min(max(tension, .1), 14.)
+
+            table = self._normalize(counts, key_src, corpus.src_vocab_size)
+
+        self.final_tension = tension
+        return res
+
+    def _normalize(self, counts, key_src, src_vocab_size):
+        if self.variational_bayes:
+            counts = counts + self.alpha
+            total = np.bincount(key_src, weights = counts, minlength = src_vocab_size)
+            total[total == 0] = 1
+            return np.exp(digamma(counts) - digamma(total)[key_src])
+        total = np.bincount(key_src, weights = counts, minlength = src_vocab_size)
+        total[total == 0] = 1
+        return counts / total[key_src]
+
+    def _viterbi(self, batch, score, reverse, res):
+        # first best position of every row, NULL wins ties
+        best = np.maximum.reduceat(score, batch["first"])
+        position = np.arange(len(score)) - batch["first"][batch["cell_row"]]
+        candidate = np.where(score == best[batch["cell_row"]], position, np.iinfo(np.int64).max)
+        winner = np.minimum.reduceat(candidate, batch["first"])
+
+        sents = batch["sents"][batch["row_sent"]]
+        for sent, j, i in zip(sents.tolist(), (batch["row_j"] - 1).tolist(), winner.tolist()):
+            if i > 0:
+                res[sent].append((j, i - 1) if reverse else (i - 1, j))
+
+
+def format_alignment(links):
+    return " ".join(f"{i}-{j}" for i, j in links)
+
+def corpus_from_pavlov(source_file, target_file):
+    return ParallelCorpus(([word for word, _ in src], [word for word, _ in trg])
+                          for src, trg in zip(load_pavlov(source_file), load_pavlov(target_file)))
+
+
+def main(source_file, target_file, iterations, reverse, output_file):
+
+    start_time = time.time()
+    corpus = corpus_from_pavlov(source_file, target_file)
+    model = FastAlignModel(iterations = iterations)
+    alignments = model.align(corpus, reverse)
+
+    out = open_text(output_file, "w") if output_file else sys.stdout
+    for links in alignments:
+        out.write(format_alignment(links) + "\n")
+    if output_file:
+        out.close()
+
+    print(f"... {corpus.n_pairs:,} pairs aligned in {time.time() - start_time:.1f}s (final tension {model.final_tension:.3f}) ...", file = sys.stderr)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "fast_align compatible IBM Model 2 aligner over .pavlov corpora")
+    parser.add_argument("-s", help = "Path to input source pavlov file")
+    parser.add_argument("-t", help = "Path to input target pavlov file")
+    parser.add_argument("-I", "--iterations", help = "EM iterations", default = 5)
+    parser.add_argument("-r", "--reverse", help = "Reverse alignment direction", action = "store_true")
+    parser.add_argument("-o", "--output", help = "Output file, stdout by default")
+
+    args = parser.parse_args()
+
+    main(args.s, args.t, int(args.iterations), args.reverse, args.output)
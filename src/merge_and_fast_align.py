@@ -1,8 +1,10 @@
 import os
-import pickle
+import time
 import argparse
+import resource
 import subprocess
-from tqdm import tqdm
+from pavlov_binary import load_pavlov
+from corpus_io import open_text
 
 def find_equal_prefix(str1, str2):
     equal_prefix = ""
@@ -19,19 +21,60 @@ def find_equal_prefix(str1, str2):
     return equal_prefix
 
 def load_pickle(filename):
-    # create a pickle's iterator
-    with open(filename, "rb") as f:
-        while True:
+    # pickled or binary .pavlov files
+    return load_pavlov(filename)
+
+
+# ====== SUBPROCESSES ====== #
+def start_step(name, command, output_file, log_file):
+    # stdout goes straight to disk, nothing is buffered in python
+    with open(output_file, "w") as out, open(log_file, "w") as log:
+        process = subprocess.Popen(command, stdout = out, stderr = log)
+    return name, process, time.time()
+
+def finish_step(step, status, usage):
+    # os.wait4 gives the resources used by this very child, peak RSS included
+    name, process, start_time = step
+    process.returncode = os.waitstatus_to_exitcode(status)
+    elapsed = time.time() - start_time
+
+    print(f"... {name}: {elapsed:.1f}s, peak RSS {usage.ru_maxrss / 1024:.1f} MB, exit code {process.returncode} ...\n")
+    return process.returncode
+
+def report_step(name, start_time):
+    # in-process steps: peak RSS of this very process
+    elapsed = time.time() - start_time
+    print(f"... {name}: {elapsed:.1f}s, peak RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} MB ...\n")
+
+def run_steps(*steps):
+    # steps are reaped in the order they exit, the first failure stops the others and aborts the pipeline
+    pending = {step[1].pid: step for step in steps}
+    try:
+        while pending:
+            pid, status, usage = os.wait4(-1, 0)
+            if pid not in pending:
+                continue
+            step = pending.pop(pid)
+            if finish_step(step, status, usage) != 0:
+                raise subprocess.CalledProcessError(step[1].returncode, step[1].args)
+    finally:
+        for _, process, _ in pending.values():
+            process.terminate()
             try:
-                yield pickle.load(f)
-            except EOFError:
-                break
+                process.wait(5)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
 
 
 def main(input_source_file,
          input_target_file,
          fa_iterations,
-         command):
+         command,
+         fast_align = "./fast_align",
+         atools = "./atools",
+         aligner = "fast_align",
+         symmetrizer = "atools"):
     
     out = find_equal_prefix(input_source_file, input_target_file)
 
@@ -39,45 +82,86 @@ def main(input_source_file,
     target = load_pickle(input_target_file)
     output_file = out + "merged"
     alignments_folder = "./alignments"
+    forward_file = f"{alignments_folder}/forward.align"
+    reverse_file = f"{alignments_folder}/reverse.align"
+    union_file = f"{alignments_folder}/symm.union.align"
     
     if not os.path.exists(alignments_folder):
         os.makedirs(alignments_folder)
     
-    with open(output_file, "w") as output, \
-         open(f"{alignments_folder}/forward.align", 'w') as ff, \
-         open(f"{alignments_folder}/reverse.align", 'w')  as fr, \
-         open(f"{alignments_folder}/symm.union.align", "w") as un:
-        
+    # numpy alignments stay in memory for the native symmetrizer
+    directions = None
+
+    if aligner == "numpy":
+        # =================== IN-PROCESS ALIGNMENTS =================== #
+        # the tagged corpus is read directly, no merged file
 
+        from ibm2_aligner import FastAlignModel, corpus_from_pavlov, format_alignment
+
+        start_time = time.time()
+        corpus = corpus_from_pavlov(input_source_file, input_target_file)
+        model = FastAlignModel(iterations = fa_iterations)
+        report_step("Reading corpus", start_time)
+
+        directions = []
+        for name, alignment_file, reverse in (("FORWARD", forward_file, False), ("REVERSE", reverse_file, True)):
+            print(f"... Generating {name} Alignments ...\n")
+            start_time = time.time()
+            alignments = model.align(corpus, reverse)
+            with open(alignment_file, "w") as f:
+                for links in alignments:
+                    f.write(format_alignment(links) + "\n")
+            directions.append(alignments)
+            report_step(f"{name} alignments", start_time)
+
+    else:
         # =================== MERGING FILES =================== #
         # hello , this is an example ||| ciao , questo è un esempio
         
-        for src, trg in tqdm(zip(source, target), desc = "Merging corpora for alignments"):
+        from tqdm import tqdm
+
+        start_time = time.time()
+        with open(output_file, "w") as output:
+            for src, trg in tqdm(zip(source, target), desc = "Merging corpora for alignments"):
 
-            output.write(" ".join([word for word, _ in src]) + " ||| " +
-                         " ".join([word for word, _ in trg]) + "\n")
+                output.write(" ".join([word for word, _ in src]) + " ||| " +
+                             " ".join([word for word, _ in trg]) + "\n")
             
-        output.close()
-        print("... DONE Merging files ...\n\n... Creating Alignments ...\n")
+        print(f"... DONE Merging files ({time.time() - start_time:.1f}s) ...\n\n... Creating Alignments ...\n")
 
 
         # =================== GENERATING ALIGNMENTS =================== #
         
-        print("... Generating FORWARD Alignments ...\n")
-        alignments = subprocess.run(["./fast_align", "-i", f"{output_file}", "-d", "-o", "-v", "-I", f"{fa_iterations}"], capture_output=True, text=True)
-        ff.write(alignments.stdout)
-        #print(">>>", alignments.stdout)
-        ff.close()
-        
-        print("... Generating REVERSE Alignments ...\n")
-        alignments = subprocess.run(["./fast_align", "-i", f"{output_file}", "-d", "-o", "-v", "-r", "-I", f"{fa_iterations}"], capture_output=True, text=True)
-        fr.write(alignments.stdout)
-        fr.close()
-
-        print("... Generating UNION Alignments ...\n")
-        alignments = subprocess.run(["./atools", "-i", "fa_forward", "-j", "fa_reverse", "-c", f"{command}"], capture_output=True, text=True)
-        un.write(alignments.stdout)
-                    
+        print("... Generating FORWARD and REVERSE Alignments ...\n")
+        fa_command = [fast_align, "-i", f"{output_file}", "-d", "-o", "-v", "-I", f"{fa_iterations}"]
+        run_steps(start_step("FORWARD alignments", fa_command, forward_file, forward_file + ".log"),
+                  start_step("REVERSE alignments", fa_command + ["-r"], reverse_file, reverse_file + ".log"))
+
+    print(f"... Generating {command.upper()} Alignments ...\n")
+    if symmetrizer == "native":
+        from symmetrize import FMeasure, symmetrize, parse_links, format_links
+
+        start_time = time.time()
+        forward, reverse = directions if directions else (open_text(forward_file, "r"), open_text(reverse_file, "r"))
+        with open(union_file, "w") as f:
+            if command == "fmeasure":
+                score = FMeasure()
+                for a, b in zip(forward, reverse):
+                    score.update(parse_links(a) if isinstance(a, str) else a, parse_links(b) if isinstance(b, str) else b)
+                precision, recall, fmeasure = score.summary()
+                f.write(f"  P: {precision}\n  R: {recall}\n  F: {fmeasure}\n")
+            else:
+                for links in symmetrize(forward, reverse, command):
+                    f.write(format_links(links) + "\n")
+        if not directions:
+            forward.close()
+            reverse.close()
+        report_step(f"{command.upper()} alignments", start_time)
+    else:
+        run_steps(start_step(f"{command.upper()} alignments",
+                             [atools, "-i", forward_file, "-j", reverse_file, "-c", f"{command}"],
+                             union_file,
+                             union_file + ".log"))
     
     
     print(" DONE ")
@@ -88,14 +172,19 @@ if __name__ == "__main__":
     parser.add_argument("-s", help = "Path to input source language file")
     parser.add_argument("-t", help = "Path to input target language file")
     parser.add_argument("-i", help = "Fast Align Training Iteration", default=5)
-    parset.add_argument("-c", help = "Command", choices = ["fmeasure", 
+    parser.add_argument("-c", help = "Command", choices = ["fmeasure", 
                                                            "grow-diag", 
                                                            "grow-diag-final", 
                                                            "grow-diag-final-and", 
                                                            "intersect",
                                                            "invert",
                                                            "union"], default = "union")
+    parser.add_argument("--fast-align", help = "Path to the fast_align binary", default = "./fast_align")
+    parser.add_argument("--atools", help = "Path to the atools binary", default = "./atools")
+    parser.add_argument("-a", "--aligner", help = "fast_align binary or the in-process NumPy aligner", choices = ["fast_align", "numpy"], default = "fast_align")
+
+    parser.add_argument("--symmetrizer", help = "atools binary or the native Python symmetrization", choices = ["atools", "native"], default = "atools")
 
     args = parser.parse_args()
 
-    main(args.s, args.t, int(args.i), args.c)
+    main(args.s, args.t, int(args.i), args.c, args.fast_align, args.atools, args.aligner, args.symmetrizer)
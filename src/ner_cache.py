@@ -0,0 +1,121 @@
+"""
+Persistent NER results keyed by a hash of the model key and the sentence text, so
+duplicate sentences (frequent in crawled corpora) are tagged once, across runs too.
+
+The cache is a SQLite file in WAL mode: several tagger processes on the same host can
+read and write it at the same time, writers wait for each other (busy timeout).
+Entries are evicted least recently used first once there are more than `max_entries`.
+"""
+
+import json
+import time
+import sqlite3
+import hashlib
+from collections import Counter
+
+NER_CACHE_SIZE = 5_000_000
+# evictions free this fraction of the cache at once, not one entry per insert
+EVICT_SLACK = .05
+# bound on the parameters of one statement (older SQLite builds accept 999)
+MAX_VARIABLES = 500
+BUSY_TIMEOUT = 60
+
+
+class NERCache:
+
+    def __init__(self, path, model_key, max_entries = NER_CACHE_SIZE):
+        self.path = path
+        self.model_key = model_key
+        self.max_entries = max_entries
+        self.prefix = model_key.encode("utf-8") + b"\0"
+        self.stats = Counter()
+
+        self.db = sqlite3.connect(path, timeout = BUSY_TIMEOUT, isolation_level = None)
+        self.db.execute("PRAGMA journal_mode = WAL")
+        self.db.execute("PRAGMA synchronous = NORMAL")
+        with self.transaction():
+            self.db.execute("CREATE TABLE IF NOT EXISTS entries (key BLOB PRIMARY KEY, tagged TEXT NOT NULL, used INTEGER NOT NULL) WITHOUT ROWID")
+            self.db.execute("CREATE INDEX IF NOT EXISTS entries_used ON entries (used)")
+            self.db.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            self.db.execute("INSERT OR IGNORE INTO meta VALUES ('entries', (SELECT count(*) FROM entries))")
+
+    def transaction(self):
+        return Transaction(self.db)
+
+    def key(self, sentence):
+        return hashlib.blake2b(self.prefix + sentence.encode("utf-8"), digest_size = 16).digest()
+
+    def get_many(self, sentences):
+        # [(word, tag), ...] of each sentence, None when it is not cached
+        keys = [self.key(sentence) for sentence in sentences]
+        found = {}
+        for start in range(0, len(keys), MAX_VARIABLES):
+            batch = list(set(keys[start:start + MAX_VARIABLES]))
+            found.update(self.db.execute(f"SELECT key, tagged FROM entries WHERE key IN ({','.join('?' * len(batch))})", batch))
+
+        if found:
+            # hits move to the recent end
+            now = time.time_ns()
+            hits = list(found)
+            with self.transaction():
+                for start in range(0, len(hits), MAX_VARIABLES):
+                    batch = hits[start:start + MAX_VARIABLES]
+                    self.db.execute(f"UPDATE entries SET used = ? WHERE key IN ({','.join('?' * len(batch))})", [now] + batch)
+
+        res = [[tuple(token) for token in json.loads(found[key])] if key in found else None for key in keys]
+        hits = sum(tagged is not None for tagged in res)
+        self.stats["hits"] += hits
+        self.stats["misses"] += len(res) - hits
+        return res
+
+    def put_many(self, sentences, tagged):
+        now = time.time_ns()
+        rows = {self.key(sentence): json.dumps(tokens, ensure_ascii = False, separators = (",", ":"))
+                for sentence, tokens in zip(sentences, tagged)}
+        with self.transaction():
+            before = self.db.total_changes
+            self.db.executemany("INSERT OR IGNORE INTO entries VALUES (?, ?, ?)", [(key, value, now) for key, value in rows.items()])
+            added = self.db.total_changes - before
+            self.db.execute("UPDATE meta SET value = value + ? WHERE name = 'entries'", (added,))
+            self.stats["stored"] += added
+
+            entries, = self.db.execute("SELECT value FROM meta WHERE name = 'entries'").fetchone()
+            if entries > self.max_entries:
+                evict = entries - int(self.max_entries * (1 - EVICT_SLACK))
+                self.db.execute("DELETE FROM entries WHERE key IN (SELECT key FROM entries ORDER BY used LIMIT ?)", (evict,))
+                self.db.execute("UPDATE meta SET value = value - ? WHERE name = 'entries'", (evict,))
+                self.stats["evictions"] += evict
+
+    def __len__(self):
+        return self.db.execute("SELECT value FROM meta WHERE name = 'entries'").fetchone()[0]
+
+    def drain(self):
+        # counters since the last drain, summed by the parent when the cache lives in workers
+        stats, self.stats = self.stats, Counter()
+        return stats
+
+    def __reduce__(self):
+        # connections do not cross processes, each worker opens its own
+        return NERCache, (self.path, self.model_key, self.max_entries)
+
+    def close(self):
+        self.db.close()
+
+
+class Transaction:
+    # BEGIN IMMEDIATE takes the write lock up front, concurrent writers queue on the busy timeout
+
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        self.db.execute("BEGIN IMMEDIATE")
+
+    def __exit__(self, exc_type, *exc):
+        self.db.execute("COMMIT" if exc_type is None else "ROLLBACK")
+
+
+def format_stats(stats, entries = None):
+    lookups = stats["hits"] + stats["misses"]
+    return (f"NER cache = {stats['hits']:,} hits, {stats['misses']:,} misses ({stats['hits'] / lookups if lookups else 0:.1%} hit rate), "
+            f"{stats['stored']:,} stored, {stats['evictions']:,} evictions" + (f", {entries:,} entries" if entries is not None else ""))
@@ -0,0 +1,343 @@
+"""
+Columnar, memory-mappable alternative to the pickled .pavlov streams.
+
+    header  | MAGIC, version
+    pool    | utf-8 bytes of every token, back to back
+    ends    | uint64 end offset of each token inside the pool
+    tags    | uint8 tag id of each token
+    lines   | uint64 end (in tokens) of each sentence
+    table   | tag names, "\n" separated, the position is the id
+    footer  | section offsets and counts, MAGIC
+
+Integers are little endian, numeric sections are 8-byte aligned so they can be cast
+straight out of the mmap without copying.
+"""
+
+import os
+import sys
+import mmap
+import pickle
+import shutil
+import struct
+import argparse
+import tempfile
+from array import array
+
+from corpus_io import open_binary, is_compressed, add_suffix
+
+MAGIC = b"PAVLOVB\0"
+VERSION = 1
+HEADER = struct.Struct("<8sII")
+FOOTER = struct.Struct("<8Q8s")
+LITTLE_ENDIAN = sys.byteorder == "little"
+FLUSH_EVERY = 1 << 16
+
+
+def is_pavlov_binary(filename):
+    with open_binary(filename, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+def _to_le(values: array) -> bytes:
+    if not LITTLE_ENDIAN:
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+def _pad(f):
+    # align the next section to 8 bytes
+    f.write(b"\0" * (-f.tell() % 8))
+
+
+# ====== WRITER ====== #
+class PavlovBinaryWriter:
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.f = open_binary(filename, "wb")
+        self.f.write(HEADER.pack(MAGIC, VERSION, 0))
+
+        # numeric columns are spilled to temporary files and appended on close
+        self.spill_dir = os.path.dirname(os.path.abspath(filename))
+        self.token_ends_spill = tempfile.TemporaryFile(dir = self.spill_dir)
+        self.tag_ids_spill = tempfile.TemporaryFile(dir = self.spill_dir)
+        self.sentence_ends_spill = tempfile.TemporaryFile(dir = self.spill_dir)
+
+        self.token_ends = array("Q")
+        self.tag_ids = bytearray()
+        self.sentence_ends = array("Q")
+
+        self.tags = {}
+        self.pool_length = 0
+        self.n_tokens = 0
+        self.n_sentences = 0
+
+    def tag_id(self, tag):
+        tag_id = self.tags.get(tag)
+        if tag_id is None:
+            if len(self.tags) > 255:
+                raise ValueError("More than 256 distinct tags, they do not fit in one byte")
+            if "\n" in tag:
+                raise ValueError(f"Invalid tag {tag!r}")
+            tag_id = self.tags[tag] = len(self.tags)
+        return tag_id
+
+    def write(self, sentence):
+        # sentence -> [(word, tag), ..., (word, tag)]
+        for word, tag in sentence:
+            data = word.encode("utf-8")
+            self.f.write(data)
+            self.pool_length += len(data)
+            self.token_ends.append(self.pool_length)
+            self.tag_ids.append(self.tag_id(tag))
+
+        self.n_tokens += len(sentence)
+        self.n_sentences += 1
+        self.sentence_ends.append(self.n_tokens)
+
+        if len(self.token_ends) >= FLUSH_EVERY:
+            self.flush_columns()
+
+    def flush_columns(self):
+        self.token_ends_spill.write(_to_le(self.token_ends))
+        self.tag_ids_spill.write(self.tag_ids)
+        self.sentence_ends_spill.write(_to_le(self.sentence_ends))
+        self.token_ends = array("Q")
+        self.tag_ids = bytearray()
+        self.sentence_ends = array("Q")
+
+    def close(self):
+        if self.f.closed:
+            return
+        self.flush_columns()
+
+        offsets = []
+        for spill in (self.token_ends_spill, self.tag_ids_spill, self.sentence_ends_spill):
+            _pad(self.f)
+            offsets.append(self.f.tell())
+            spill.seek(0)
+            shutil.copyfileobj(spill, self.f)
+            spill.close()
+
+        table = "\n".join(sorted(self.tags, key = self.tags.get)).encode("utf-8")
+        tags_offset = self.f.tell()
+        self.f.write(table)
+        _pad(self.f)
+
+        self.f.write(FOOTER.pack(self.pool_length, *offsets, tags_offset, len(table),
+                                 self.n_tokens, self.n_sentences, MAGIC))
+        self.f.close()
+
+    def abort(self):
+        # no footer is written, the partial file is removed so it can never be read as a complete one
+        if self.f.closed:
+            return
+        for spill in (self.token_ends_spill, self.tag_ids_spill, self.sentence_ends_spill):
+            spill.close()
+        self.f.close()
+        os.remove(self.filename)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+# ====== READER ====== #
+class PavlovBinaryReader:
+    """
+    Random access view over a binary .pavlov file.
+    reader[n] -> [(word, tag), ...], reader[a:b] and reader.lines(a, b) for line ranges.
+    """
+
+    def __init__(self, filename):
+        if is_compressed(filename):
+            # the layout needs random access: decompressed once to an anonymous temporary file
+            self.f = tempfile.TemporaryFile(dir = os.path.dirname(os.path.abspath(filename)))
+            with open_binary(filename, "rb") as compressed:
+                shutil.copyfileobj(compressed, self.f, 1 << 22)
+            self.f.flush()
+        else:
+            self.f = open(filename, "rb")
+        self.mm = mmap.mmap(self.f.fileno(), 0, access = mmap.ACCESS_READ)
+
+        magic, version, _ = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{filename} is not a binary pavlov file")
+        if version != VERSION:
+            raise ValueError(f"{filename}: unsupported binary pavlov version {version}")
+
+        (pool_length, token_ends_offset, tag_ids_offset, sentence_ends_offset,
+         tags_offset, tags_length, self.n_tokens, self.n_sentences, magic) = FOOTER.unpack_from(self.mm, len(self.mm) - FOOTER.size)
+        if magic != MAGIC:
+            raise ValueError(f"{filename}: truncated binary pavlov file")
+
+        self.view = memoryview(self.mm)
+        self.pool = self.view[HEADER.size: HEADER.size + pool_length]
+        self.tag_ids = self.view[tag_ids_offset: tag_ids_offset + self.n_tokens]
+        self.token_ends = self._column(token_ends_offset, self.n_tokens)
+        self.sentence_ends = self._column(sentence_ends_offset, self.n_sentences)
+
+        table = str(self.view[tags_offset: tags_offset + tags_length], "utf-8")
+        self.tags = table.split("\n") if table else []
+
+    def _column(self, offset, length):
+        column = self.view[offset: offset + 8 * length]
+        if LITTLE_ENDIAN:
+            return column.cast("Q")
+        # big endian hosts pay for one copy
+        values = array("Q", column)
+        values.byteswap()
+        return values
+
+    def __len__(self):
+        return self.n_sentences
+
+    def sentence(self, n):
+        first = self.sentence_ends[n - 1] if n else 0
+        last = self.sentence_ends[n]
+
+        pool, tags, token_ends = self.pool, self.tags, self.token_ends
+        start = token_ends[first - 1] if first else 0
+        res = []
+        for k in range(first, last):
+            end = token_ends[k]
+            res.append((str(pool[start:end], "utf-8"), tags[self.tag_ids[k]]))
+            start = end
+        return res
+
+    def lines(self, start = 0, stop = None):
+        stop = self.n_sentences if stop is None else min(stop, self.n_sentences)
+        for n in range(start, stop):
+            yield self.sentence(n)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return [self.sentence(n) for n in range(*key.indices(self.n_sentences))]
+        if key < 0:
+            key += self.n_sentences
+        if not 0 <= key < self.n_sentences:
+            raise IndexError("sentence index out of range")
+        return self.sentence(key)
+
+    def __iter__(self):
+        return self.lines()
+
+    def close(self):
+        if self.mm.closed:
+            return
+        # views on the mmap have to be released before closing it
+        for column in (self.token_ends, self.sentence_ends):
+            if isinstance(column, memoryview):
+                column.release()
+        self.pool.release()
+        self.tag_ids.release()
+        self.view.release()
+        self.mm.close()
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# ====== EITHER FORMAT ====== #
+class PavlovPickleWriter:
+    # one pickle.dump per sentence, the original .pavlov format
+
+    def __init__(self, filename, resume_at = None):
+        if resume_at is None:
+            self.f = open_binary(filename, "wb")
+        elif is_compressed(filename):
+            raise ValueError("Compressed .pavlov files can not be resumed")
+        else:
+            # drop whatever was written after the last consistent point
+            self.f = open(filename, "r+b")
+            size = os.fstat(self.f.fileno()).st_size
+            if resume_at > size:
+                self.f.close()
+                raise ValueError(f"{filename} has {size:,} bytes, fewer than the {resume_at:,} of the checkpoint")
+            self.f.truncate(resume_at)
+            self.f.seek(resume_at)
+
+    def write(self, sentence):
+        pickle.dump(sentence, self.f)
+
+    def sync(self):
+        # make everything written so far durable, returns the committed size
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        return self.f.tell()
+
+    def close(self):
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def open_pavlov_writer(filename, binary = False, resume_at = None):
+    if binary:
+        if resume_at is not None:
+            raise ValueError("Binary .pavlov files can not be resumed, use the pickle format")
+        return PavlovBinaryWriter(filename)
+    return PavlovPickleWriter(filename, resume_at)
+
+def load_pickle(filename):
+    # create a pickle's iterator
+    with open_binary(filename, "rb") as f:
+        while True:
+            try:
+                yield pickle.load(f)
+            except EOFError:
+                break
+
+def load_pavlov(filename, start = 0, stop = None):
+    # sentences of a .pavlov file in either format, binary files seek straight to `start`
+    if is_pavlov_binary(filename):
+        with PavlovBinaryReader(filename) as reader:
+            yield from reader.lines(start, stop)
+        return
+    for n, sentence in enumerate(load_pickle(filename)):
+        if stop is not None and n >= stop:
+            break
+        if n >= start:
+            yield sentence
+
+
+# ====== CONVERSION ====== #
+def convert(input_file, output_file = None):
+    # without an output file the .pavlov is converted in place, keeping its name
+    target = output_file or add_suffix(input_file, ".tmp")
+    sentences = 0
+    with PavlovBinaryWriter(target) as writer:
+        for sentence in load_pickle(input_file):
+            writer.write(sentence)
+            sentences += 1
+    if output_file is None:
+        os.replace(target, input_file)
+    return sentences
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Convert pickled .pavlov files to the binary columnar format")
+    parser.add_argument("files", nargs = "+", help = "Pickled .pavlov files")
+    parser.add_argument("-o", "--output", help = "Output path (single input only), by default files are converted in place")
+
+    args = parser.parse_args()
+    if args.output and len(args.files) > 1:
+        parser.error("-o can only be used with a single input file")
+
+    for filename in args.files:
+        if is_pavlov_binary(filename):
+            print(f"{filename} is already binary, skipping")
+            continue
+        sentences = convert(filename, args.output)
+        print(f"{filename} -> {args.output or filename} ({sentences:,} sentences)")
@@ -1,14 +1,13 @@
-import argparse
+import os
 import re
+import json
 import time
-from tqdm import tqdm
+import argparse
+from collections import deque
 import random
-import pickle
-from deeppavlov import configs, build_model
-
-import deeppavlov
-import transformers
-from torchcrf import CRF
+from pavlov_binary import open_pavlov_writer
+from corpus_io import open_binary, is_compressed, add_suffix, seek_forward
+from ner_cache import NERCache, NER_CACHE_SIZE, format_stats
 
 
 # !pip install deeppavlov
@@ -16,47 +15,261 @@ from torchcrf import CRF
 # !pip install pytorch-crf
 
 
-def tag_sentences(ner_output: list) -> tuple:
+# ====== TAGGERS ====== #
+# A tagger maps a list of sentences to a list of [(word, tag), ..., (word, tag)], one per sentence.
+
+class DeepPavlovTagger:
+
+    def __init__(self, config = None):
+        # heavy imports, only paid when the model is actually built
+        from deeppavlov import configs, build_model
+
+        self.cache_key = self.model_key(config)
+        self.model = build_model(config or configs.ner.ner_ontonotes_bert_mult, download=True)
+
+    @staticmethod
+    def model_key(config = None):
+        # identifies the model in the NER cache: deeppavlov version and the config (path, or dict) it is built from
+        import deeppavlov
+        from deeppavlov import configs
+
+        config = config or configs.ner.ner_ontonotes_bert_mult
+        config = json.dumps(config, sort_keys = True) if isinstance(config, dict) else os.path.abspath(os.fspath(config))
+        return f"deeppavlov-{deeppavlov.__version__}:{config}"
+
+    def __call__(self, sentences: list) -> list:
+        # the model returns [tokens of each sentence], [tags of each sentence]
+        tokens, tags = self.model(sentences)
+        return [list(zip(words, labels)) for words, labels in zip(tokens, tags)]
+
+
+class StandInTagger:
+    """
+    Deterministic, model-free tagger used to test the pipeline offline.
+    Words and punctuation are split apart, runs of capitalized words become PERSON entities
+    (ORG when fully uppercase) and numbers CARDINAL.
+    """
+
+    token_re = re.compile(r"\w+|[^\w\s]")
+    cache_key = "standin:1"
+
+    @classmethod
+    def model_key(cls, config = None):
+        return cls.cache_key
+
+    def __call__(self, sentences: list) -> list:
+        return [self.tag(sentence) for sentence in sentences]
+
+    def tag(self, sentence: str) -> list:
+        res = []
+        previous = "O"
+        for word in self.token_re.findall(sentence):
+            if word.isdigit():
+                label = "CARDINAL"
+            elif word[0].isupper():
+                label = "ORG" if word.isupper() and len(word) > 1 else "PERSON"
+            else:
+                label = "O"
+
+            if label == "O":
+                tag = "O"
+            elif previous[2:] == label:
+                tag = "I-" + label
+            else:
+                tag = "B-" + label
+            res.append((word, tag))
+            previous = tag
+        return res
+
+
+TAGGERS = {"deeppavlov": DeepPavlovTagger,
+           "standin": StandInTagger}
+
+
 
-    # estraggo lista di tuple (word_tag) per frasi src e trg
-    src_sentence = list(zip( ner_output[0][0], ner_output[1][0] ))
-    trg_sentence = list(zip( ner_output[0][1], ner_output[1][1] ))
-    return src_sentence, trg_sentence
+# ====== BATCHING ====== #
+def tag_window(tagger, window: list, batch_size: int, cache = None):
+    sentences = [sentence for pair in window for sentence in pair]
+    if cache is None:
+        tagged = [None] * len(sentences)
+        todo = range(len(sentences))
+    else:
+        # cached sentences are served as they are, the others go to the model once each
+        tagged = cache.get_many(sentences)
+        todo = list({sentences[k]: k for k in range(len(sentences)) if tagged[k] is None}.values())
+
+    # sort the window by length so every batch holds sentences of similar size (less padding)
+    order = sorted(todo, key = lambda k: len(sentences[k].split()))
+    for start in range(0, len(order), batch_size):
+        batch = order[start:start + batch_size]
+        for k, sentence in zip(batch, tagger([sentences[k] for k in batch])):
+            tagged[k] = sentence
+
+    if cache is not None and order:
+        cache.put_many([sentences[k] for k in order], [tagged[k] for k in order])
+        first = {sentences[k]: tagged[k] for k in order}
+        tagged = [first[sentence] if res is None else res for sentence, res in zip(sentences, tagged)]
+
+    # back to the original order
+    for k in range(0, len(tagged), 2):
+        yield tagged[k], tagged[k + 1]
+
+def tag_lines(tagger, pairs, batch_size: int, read_ahead: int, cache = None):
+    # pairs -> (src, trg) lines, yields (src_tagged, trg_tagged) in input order
+    window = []
+    for pair in pairs:
+        window.append(pair)
+        if len(window) == read_ahead:
+            yield from tag_window(tagger, window, batch_size, cache)
+            window = []
+    if window:
+        yield from tag_window(tagger, window, batch_size, cache)
+
+
+
+
+# ====== CHECKPOINTS ====== #
+def read_pairs(source, target, source_offset = 0, target_offset = 0):
+    # inputs are read as bytes to know where each line ends, yields (src, trg, src_end, trg_end)
+    seek_forward(source, source_offset)
+    seek_forward(target, target_offset)
+    for src_line, trg_line in zip(source, target):
+        source_offset += len(src_line)
+        target_offset += len(trg_line)
+        yield (src_line.decode("utf-8").rstrip("\r\n"),
+               trg_line.decode("utf-8").rstrip("\r\n"),
+               source_offset,
+               target_offset)
+
+def load_checkpoint(filename, inputs):
+    # a checkpoint only applies to the inputs it was taken on
+    with open(filename, "r") as f:
+        state = json.load(f)
+    if state.get("inputs") != inputs:
+        raise ValueError(f"{filename} was taken on other inputs ({state.get('inputs')}), run again without --resume")
+    return state
+
+def input_stamp(*filenames):
+    return [{"path": os.path.abspath(filename), "size": os.path.getsize(filename)} for filename in filenames]
+
+def save_checkpoint(filename, state):
+    # write-then-rename, a crash never leaves a half written checkpoint
+    with open(filename + ".tmp", "w") as f:
+        json.dump(state, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(filename + ".tmp", filename)
+
+def count_lines(filename):
+    with open_binary(filename, "rb") as f:
+        return sum(chunk.count(b"\n") for chunk in iter(lambda: f.read(1 << 20), b""))
+
+def format_eta(seconds):
+    seconds = int(seconds)
+    return f"{seconds // 3600}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
 
 
 
 
 def main(input_source_file,
          input_target_file,
-         DISPLAY_ITERATION):
+         DISPLAY_ITERATION,
+         binary = False,
+         tagger = "deeppavlov",
+         batch_size = 32,
+         read_ahead = 1024,
+         checkpoint_every = 10_000,
+         resume = False,
+         workers = 1,
+         ner_cache = None,
+         ner_cache_size = NER_CACHE_SIZE):
+
+    checkpoint_file = input_source_file + ".pavlov.ckpt"
+    inputs = input_stamp(input_source_file, input_target_file)
+    state = {"lines": 0,
+             "source_bytes": 0,
+             "target_bytes": 0,
+             "source_out_bytes": None,
+             "target_out_bytes": None}
+
+    if resume:
+        if not os.path.exists(checkpoint_file):
+            raise FileNotFoundError(f"No checkpoint to resume from ({checkpoint_file})")
+        state = load_checkpoint(checkpoint_file, inputs)
+        print(f"... Resuming from line {state['lines']:,} ...")
+    elif os.path.exists(checkpoint_file):
+        # left by an earlier run, it does not describe the outputs this run writes
+        os.remove(checkpoint_file)
 
-    ner_model = build_model(configs.ner.ner_ontonotes_bert_mult, download=True)
+    total = count_lines(input_source_file)
+    cache = NERCache(ner_cache, TAGGERS[tagger].model_key(), ner_cache_size) if ner_cache else None
+    if workers > 1:
+        # one model per worker process, the parent only reads, reorders and writes
+        from tagger_farm import TaggerFarm
+        farm = TaggerFarm(TAGGERS[tagger], workers, batch_size, read_ahead, cache = cache)
+    else:
+        ner_model = TAGGERS[tagger]()
 
-    with open(input_source_file, 'r') as source, \
-         open(input_target_file, 'r') as target, \
-         open(input_source_file + ".pavlov", 'wb') as os, \
-         open(input_target_file + ".pavlov", 'wb') as ot:
+    # outputs keep the compression of their input: train.en.xz -> train.en.pavlov.xz
+    source_pavlov = add_suffix(input_source_file, ".pavlov")
+    target_pavlov = add_suffix(input_target_file, ".pavlov")
+    # compressed outputs can not be truncated back to a checkpoint
+    checkpoints = not binary and not is_compressed(source_pavlov) and not is_compressed(target_pavlov)
 
-        parsed = 0
+    with open_binary(input_source_file, 'rb') as source, \
+         open_binary(input_target_file, 'rb') as target, \
+         open_pavlov_writer(source_pavlov, binary, state["source_out_bytes"]) as out_src, \
+         open_pavlov_writer(target_pavlov, binary, state["target_out_bytes"]) as out_trg:
+
+        parsed = resumed_from = state["lines"]
+        source_end, target_end = state["source_bytes"], state["target_bytes"]
         start_time = time.time()
-        for src_sentence, trg_sentence in zip(source, target):
 
-            output = ner_model([src_sentence.rstrip("\n"), trg_sentence.rstrip("\n")])
+        # input offsets of the lines being tagged, consumed in the same order outputs come back
+        offsets = deque()
+        def pairs(source_offset, target_offset):
+            for src_sentence, trg_sentence, *ends in read_pairs(source, target, source_offset, target_offset):
+                offsets.append(ends)
+                yield src_sentence, trg_sentence
+
+        if workers > 1:
+            tagged = farm.tag(pairs(source_end, target_end))
+        else:
+            tagged = tag_lines(ner_model, pairs(source_end, target_end), batch_size, read_ahead, cache)
 
-            # taggo frase source (it) per cercare le target tags
-            src_sentence, trg_sentence = tag_sentences(output)
+        for src_sentence, trg_sentence in tagged:
 
-            pickle.dump(src_sentence, os)
-            pickle.dump(trg_sentence, ot)
+            out_src.write(src_sentence)
+            out_trg.write(trg_sentence)
 
             parsed += 1
+            source_end, target_end = offsets.popleft()
+
+            # checkpoints are only taken between sentences, after both outputs are on disk
+            if checkpoints and parsed % checkpoint_every == 0:
+                save_checkpoint(checkpoint_file, {"inputs": inputs,
+                                                  "lines": parsed,
+                                                  "source_bytes": source_end,
+                                                  "target_bytes": target_end,
+                                                  "source_out_bytes": out_src.sync(),
+                                                  "target_out_bytes": out_trg.sync()})
 
             if parsed % DISPLAY_ITERATION == 0:
-                print(f"- {parsed = } -")
-                end_time = time.time()
-                elapsed_minutes = (end_time - start_time) / 60   # Convert seconds to minutes
-                print(f"Time elapsed: {elapsed_minutes:.2f} minutes")
+                rate = (parsed - resumed_from) / max(time.time() - start_time, 1e-9)
+                eta = format_eta((total - parsed) / rate) if total > parsed else "-"
+                print(f"- {parsed = :,} - {rate:,.1f} lines/sec - ETA {eta}")
+
+        # the run is complete once both outputs are on disk, nothing is left to resume
+        if checkpoints and os.path.exists(checkpoint_file):
+            out_src.sync()
+            out_trg.sync()
+            os.remove(checkpoint_file)
 
+        if workers > 1:
+            farm.report()
+        if cache is not None:
+            print(format_stats(farm.cache_stats if workers > 1 else cache.drain(), len(cache)))
+            cache.close()
         print(f" - DONE - ")
 
 
@@ -66,8 +279,35 @@ if __name__ == "__main__":
     parser.add_argument("-t", help="Path to input target language file")
     parser.add_argument("-i", "--iterations", help="Display counter at each i'th iteration",
                         default=200)
+    parser.add_argument("-b", "--batch-size", help="Sentences per model call", default=32)
+    parser.add_argument("-k", "--read-ahead", help="Lines read ahead and sorted by length before batching",
+                        default=1024)
+    parser.add_argument("--tagger", help="NER model, 'standin' is a deterministic offline tagger", choices=list(TAGGERS),
+                        default="deeppavlov")
+    parser.add_argument("-c", "--checkpoint-every", help="Lines between two checkpoints", default=10_000)
+    parser.add_argument("--resume", help="Continue from the last checkpoint of a previous run", action="store_true")
+    parser.add_argument("-w", "--workers", help="Tagging processes, each with its own model instance (CPU nodes)", default=1)
+    parser.add_argument("--ner-cache", help="SQLite file caching the tags of every sentence, duplicates skip the model", default=None)
+    parser.add_argument("--ner-cache-size", help="Sentences kept in the NER cache, least recently used are evicted", default=NER_CACHE_SIZE)
+    parser.add_argument("-f", "--format", help="Output format of the .pavlov files", choices=["pickle", "binary"],
+                        default="pickle")
 
 
     args = parser.parse_args()
+    if args.resume and args.format == "binary":
+        parser.error("--resume is only supported with the pickle format")
+    if args.resume and (is_compressed(args.s) or is_compressed(args.t)):
+        parser.error("--resume is not supported with compressed corpora, their outputs are compressed too")
 
-    main(args.s, args.t, int(args.iterations))
+    main(args.s,
+         args.t,
+         int(args.iterations),
+         args.format == "binary",
+         args.tagger,
+         int(args.batch_size),
+         int(args.read_ahead),
+         int(args.checkpoint_every),
+         args.resume,
+         int(args.workers),
+         args.ner_cache,
+         int(args.ner_cache_size))
@@ -0,0 +1,136 @@
+"""
+Shard store of the incremental pipeline: the corpora are cut in fixed-size shards and
+every stage's output of a shard is saved under a key hashing what it was computed from
+(content hashes of its inputs and the stage's settings). A shard whose key is already in
+the store is not computed again, the final files are stitched from the stored outputs.
+
+    <store>/manifest.json      | shard size, then per stage and shard: key, inputs, settings, lines, outputs
+    <store>/<stage>/<key>.<x>  | outputs of one shard (or of the whole corpus) for one stage
+
+Outputs are written to a temporary file and renamed once complete, so whatever is in the
+store can be used as is, also after a crashed run. The manifest is rewritten at the end of
+every run and the outputs it no longer references are deleted: only files named like the
+store's own outputs, in its stage directories, anything else under <store> is left alone.
+"""
+
+import os
+import re
+import json
+import time
+import hashlib
+from collections import Counter
+from contextlib import contextmanager
+
+MANIFEST_VERSION = 1
+SHARD_SIZE = 100_000
+STAGES = ("tag", "align", "dnts")
+# <key>.src.pavlov, <key>.trg.pavlov, <key>.<shard>.align, <key>.src, <key>.trg, or one of them being written
+OUTPUT_NAME = re.compile(r"[0-9a-f]{32}\.(?:src\.pavlov|trg\.pavlov|\d+\.align|src|trg)(\.tmp)?")
+
+
+def digest(*parts) -> str:
+    # strings and bytes are hashed as they are, anything else as sorted JSON
+    h = hashlib.blake2b(digest_size = 16)
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode("utf-8")
+        elif not isinstance(part, bytes):
+            part = json.dumps(part, sort_keys = True).encode("utf-8")
+        h.update(len(part).to_bytes(8, "little"))
+        h.update(part)
+    return h.hexdigest()
+
+
+class ShardStore:
+
+    def __init__(self, directory, shard_size = SHARD_SIZE):
+        self.directory = directory
+        self.shard_size = shard_size
+        self.manifest_path = os.path.join(directory, "manifest.json")
+        self.stages = {}
+        self.counts = Counter()
+        self.started = time.time()
+        os.makedirs(directory, exist_ok = True)
+
+        self.previous = {}
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, "r") as f:
+                previous = json.load(f)
+            if previous["version"] != MANIFEST_VERSION:
+                print(f"... Shard store version changed ({previous['version']} -> {MANIFEST_VERSION}), recomputing every shard ...\n")
+            elif previous["shard_size"] != shard_size:
+                # other shard boundaries, no stored output can match a new key
+                print(f"... Shard size changed ({previous['shard_size']:,} -> {shard_size:,}), recomputing every shard ...\n")
+            else:
+                self.previous = previous["stages"]
+
+    def path(self, stage, key, suffix):
+        os.makedirs(os.path.join(self.directory, stage), exist_ok = True)
+        return os.path.join(self.directory, stage, key + suffix)
+
+    def has(self, paths):
+        return all(os.path.exists(path) for path in paths)
+
+    @contextmanager
+    def write(self, paths):
+        # yields temporary paths, renamed to `paths` when the block completes
+        tmp = [path + ".tmp" for path in paths]
+        try:
+            yield tmp
+        except BaseException:
+            for path in tmp:
+                if os.path.exists(path):
+                    os.remove(path)
+            raise
+        for path, final in zip(tmp, paths):
+            os.replace(path, final)
+
+    def record(self, stage, shard, key, inputs, settings, lines, outputs, reused):
+        self.stages.setdefault(stage, []).append({"shard": shard,
+                                                  "key": key,
+                                                  "inputs": inputs,
+                                                  "settings": settings,
+                                                  "lines": lines,
+                                                  "outputs": [os.path.relpath(path, self.directory) for path in outputs]})
+        self.counts[stage, "reused" if reused else "computed"] += 1
+
+    def changed(self, stage, shard):
+        # what differs from the previous run for this shard: "new", "inputs", "settings" or None
+        previous = self.previous.get(stage, [])
+        current = self.stages[stage][-1]
+        if shard >= len(previous):
+            return "new"
+        if previous[shard]["inputs"] != current["inputs"]:
+            return "inputs"
+        if previous[shard]["settings"] != current["settings"]:
+            return "settings"
+        return None
+
+    def save(self):
+        # write-then-rename, then drop the outputs nothing refers to anymore
+        with self.write([self.manifest_path]) as (tmp,):
+            with open(tmp, "w") as f:
+                json.dump({"version": MANIFEST_VERSION, "shard_size": self.shard_size, "stages": self.stages}, f, indent = 1)
+
+        referenced = {os.path.join(self.directory, output) for entries in self.stages.values() for entry in entries for output in entry["outputs"]}
+        removed = 0
+        for stage in sorted(set(STAGES) | set(self.stages)):
+            stage_dir = os.path.join(self.directory, stage)
+            if not os.path.isdir(stage_dir):
+                continue
+            for name in os.listdir(stage_dir):
+                path = os.path.join(stage_dir, name)
+                match = OUTPUT_NAME.fullmatch(name)
+                if path in referenced or not match or os.path.islink(path) or not os.path.isfile(path):
+                    continue
+                # a temporary file touched since this run started is being written by another one
+                if match.group(1) and os.path.getmtime(path) >= self.started:
+                    continue
+                os.remove(path)
+                removed += 1
+        return removed
+
+    def report(self, stage):
+        if stage not in self.stages:
+            return f"{stage:>8}: {'not stored':>27}"
+        return f"{stage:>8}: {self.counts[stage, 'reused']:>6,} shards reused {self.counts[stage, 'computed']:>6,} computed"
@@ -0,0 +1,181 @@
+"""
+Native symmetrization of forward/reverse word alignments, same heuristics and output
+order as fast_align's atools (-c): fmeasure, grow-diag, grow-diag-final,
+grow-diag-final-and, intersect, invert, union.
+
+Alignments are streamed line by line, so the result can feed make_dnt_BIO directly
+without writing an intermediate file.
+"""
+
+import sys
+import heapq
+import argparse
+
+from corpus_io import open_text
+
+COMMANDS = ["fmeasure",
+            "grow-diag",
+            "grow-diag-final",
+            "grow-diag-final-and",
+            "intersect",
+            "invert",
+            "union"]
+
+NEIGHBORS = [(-1, 0), (0, -1), (1, 0), (0, 1)]
+DIAG_NEIGHBORS = NEIGHBORS + [(-1, -1), (-1, 1), (1, -1), (1, 1)]
+
+
+def parse_links(line: str) -> list:
+    res = []
+    for el in line.split():
+        k = el.index("-")
+        res.append((int(el[:k]), int(el[k+1:])))
+    return res
+
+def format_links(links) -> str:
+    return " ".join(f"{i}-{j}" for i, j in links)
+
+
+# ====== HEURISTICS ====== #
+# every heuristic returns the links sorted by (i, j), the order atools prints them
+
+def intersect(a, b):
+    return sorted(set(a) & set(b))
+
+def union(a, b):
+    return sorted(set(a) | set(b))
+
+def invert(a, b = None):
+    return sorted((j, i) for i, j in set(a))
+
+def grow_diag(a, b, final = False, final_and = False):
+    a, b = set(a), set(b)
+
+    # start from the intersection, the other union points are the candidates
+    res = a & b
+    candidates = a ^ b
+    i_aligned = {i for i, _ in res}
+    j_aligned = {j for _, j in res}
+
+    # grow-diag: atools sweeps the grid in (i, j) order until nothing changes, adding the candidate
+    # neighbours of every aligned point that touch an unaligned word. A point only adds neighbours
+    # the first time the sweep meets it, so only new points are queued: those after the current
+    # one are grown in this sweep, the others in the next one
+    pending = sorted(res) if candidates else []
+    while pending:
+        later = []
+        while pending:
+            point = i, j = heapq.heappop(pending)
+            for di, dj in DIAG_NEIGHBORS:
+                neighbor = i2, j2 = i + di, j + dj
+                if neighbor in candidates and (i2 not in i_aligned or j2 not in j_aligned):
+                    candidates.discard(neighbor)
+                    res.add(neighbor)
+                    i_aligned.add(i2)
+                    j_aligned.add(j2)
+                    if neighbor > point:
+                        heapq.heappush(pending, neighbor)
+                    else:
+                        later.append(neighbor)
+        pending = later
+        heapq.heapify(pending)
+
+    # final(-and): add remaining points of each direction whose words are (both) unaligned
+    if final:
+        for direction in (a, b):
+            for i, j in sorted(direction - res):
+                if (i not in i_aligned and j not in j_aligned) if final_and else (i not in i_aligned or j not in j_aligned):
+                    res.add((i, j))
+                    i_aligned.add(i)
+                    j_aligned.add(j)
+
+    return sorted(res)
+
+def grow_diag_final(a, b):
+    return grow_diag(a, b, final = True)
+
+def grow_diag_final_and(a, b):
+    return grow_diag(a, b, final = True, final_and = True)
+
+HEURISTICS = {"grow-diag": grow_diag,
+              "grow-diag-final": grow_diag_final,
+              "grow-diag-final-and": grow_diag_final_and,
+              "intersect": intersect,
+              "invert": invert,
+              "union": union}
+
+
+class FMeasure:
+    # corpus level precision/recall of the first alignment against the second one (reference)
+
+    def __init__(self):
+        self.matched = self.predicted = self.reference = 0
+
+    def update(self, a, b):
+        a, b = set(a), set(b)
+        self.matched += len(a & b)
+        self.predicted += len(a)
+        self.reference += len(b)
+
+    def summary(self):
+        precision = self.matched / self.predicted if self.predicted else 0.
+        recall = self.matched / self.reference if self.reference else 0.
+        f = 2 * precision * recall / (precision + recall) if precision + recall else 0.
+        return precision, recall, f
+
+
+# ====== STREAMING ====== #
+def symmetrize(forward_lines, reverse_lines, command = "union"):
+    # forward/reverse "i-j" lines (or already parsed links) -> symmetrized links, one list per line
+    if command not in HEURISTICS:
+        raise ValueError(f"'{command}' does not produce alignments, use one of {list(HEURISTICS)}")
+    heuristic = HEURISTICS[command]
+
+    if command == "invert":
+        for forward in forward_lines:
+            yield heuristic(parse_links(forward) if isinstance(forward, str) else forward)
+        return
+
+    for forward, reverse in zip(forward_lines, reverse_lines):
+        yield heuristic(parse_links(forward) if isinstance(forward, str) else forward,
+                        parse_links(reverse) if isinstance(reverse, str) else reverse)
+
+def read_directions(forward_file, reverse_file):
+    # (forward, reverse) line pairs as they are, to be symmetrized elsewhere (e.g. by worker processes)
+    with open_text(forward_file, "r") as forward, \
+         open_text(reverse_file if reverse_file else forward_file, "r") as reverse:
+        yield from zip(forward, reverse)
+
+def symmetrize_files(forward_file, reverse_file, command = "union"):
+    with open_text(forward_file, "r") as forward, \
+         open_text(reverse_file if reverse_file else forward_file, "r") as reverse:
+        yield from symmetrize(forward, reverse, command)
+
+
+def main(forward_file, reverse_file, command):
+
+    if command == "fmeasure":
+        score = FMeasure()
+        with open_text(forward_file, "r") as forward, open_text(reverse_file, "r") as reverse:
+            for a, b in zip(forward, reverse):
+                score.update(parse_links(a), parse_links(b))
+        precision, recall, f = score.summary()
+        print(f"  P: {precision}\n  R: {recall}\n  F: {f}")
+        return
+
+    write = sys.stdout.write
+    for links in symmetrize_files(forward_file, reverse_file, command):
+        write(format_links(links) + "\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Symmetrize forward/reverse alignments (atools compatible)")
+    parser.add_argument("-i", help = "Forward alignments (for fmeasure, the predicted alignments scored against -j)", required = True)
+    parser.add_argument("-j", help = "Reverse alignments (for fmeasure, the reference alignments)")
+    parser.add_argument("-c", help = "Command", choices = COMMANDS, default = "union")
+
+    args = parser.parse_args()
+    if args.c != "invert" and not args.j:
+        parser.error(f"-c {args.c} needs two alignment files (-i and -j)")
+
+    main(args.i, args.j, args.c)
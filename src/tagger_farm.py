@@ -0,0 +1,215 @@
+"""
+Tagging farm for CPU nodes: N worker processes, each loading its own model instance,
+tag line-numbered windows of sentence pairs handed out by the parent, which puts the
+results back in input order. A worker that dies (segfault, OOM kill, ...) is replaced
+and its window handed out again.
+
+Every worker talks to the parent through its own pipe and gets one window at a time,
+so a killed worker can not leave a shared queue locked or half written.
+"""
+
+import time
+import traceback
+import multiprocessing
+from collections import deque, Counter
+from multiprocessing.connection import wait
+
+from pavlov_tagger_pickle import tag_window
+
+
+# ====== WORKER ====== #
+def work(conn, loader, batch_size, cache = None):
+    # child process: load the model, then tag windows until told to stop
+    start = time.perf_counter()
+    try:
+        tagger = loader()
+    except Exception:
+        conn.send(("error", None, traceback.format_exc()))
+        return
+    conn.send(("ready", None, time.perf_counter() - start))
+
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            # the parent is gone
+            return
+        if task is None:
+            return
+        first_line, window = task
+        start = time.perf_counter()
+        try:
+            tagged = list(tag_window(tagger, window, batch_size, cache))
+        except Exception:
+            conn.send(("error", first_line, traceback.format_exc()))
+            return
+        conn.send(("done", first_line, (tagged, time.perf_counter() - start, cache.drain() if cache else Counter())))
+
+
+class WorkerStats:
+
+    def __init__(self):
+        self.lines = 0
+        self.windows = 0
+        self.busy = 0.
+        self.load = 0.
+        self.restarts = 0
+
+    def report(self, slot):
+        rate = self.lines / self.busy if self.busy else 0
+        return (f"worker {slot}: {self.lines:,} lines in {self.windows:,} windows, {self.busy:,.1f} s busy, "
+                f"{rate:,.1f} lines/sec, model loaded in {self.load:,.1f} s, {self.restarts} restarts")
+
+
+class Worker:
+    # one slot of the farm, the process in it is replaced when it dies
+
+    def __init__(self, ctx, loader, batch_size, cache = None):
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target = work, args = (child_conn, loader, batch_size, cache), daemon = True)
+        self.process.start()
+        child_conn.close()
+        self.ready = False
+        self.task = None
+
+    def stop(self):
+        if self.process.is_alive():
+            try:
+                self.conn.send(None)
+            except OSError:
+                pass
+            self.process.join(5)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+        self.conn.close()
+
+
+# ====== FARM ====== #
+class TaggerFarm:
+    """
+    farm.tag(pairs) is a drop-in for tag_lines: (src, trg) lines in, (src_tagged,
+    trg_tagged) out in input order. `loader` builds the tagger inside each worker, it has
+    to be picklable (a class or a module level function, TAGGERS[name] for instance).
+
+    Windows of `read_ahead` pairs are tagged as tag_lines does, at most `max_pending`
+    windows per worker are held (read, tagging or waiting to be yielded in order). A
+    window that kills `max_retries` workers in a row is an error. With a NER `cache`,
+    every worker opens its own connection to it and their counters add up in cache_stats.
+    """
+
+    def __init__(self, loader, workers, batch_size = 32, read_ahead = 1024, max_pending = 4, max_retries = 3, start_method = "spawn", cache = None):
+        self.loader = loader
+        self.workers = workers
+        self.batch_size = batch_size
+        self.read_ahead = read_ahead
+        self.max_pending = max_pending
+        self.max_retries = max_retries
+        # spawned workers do not inherit the parent's threads, CUDA or torch state
+        self.ctx = multiprocessing.get_context(start_method)
+        self.cache = cache
+        self.stats = [WorkerStats() for _ in range(workers)]
+        self.cache_stats = Counter()
+
+    def windows(self, pairs):
+        # (first line number, [(src, trg), ...])
+        window = []
+        line = 0
+        for pair in pairs:
+            window.append(pair)
+            if len(window) == self.read_ahead:
+                yield line, window
+                line += len(window)
+                window = []
+        if window:
+            yield line, window
+
+    def tag(self, pairs):
+        windows = self.windows(pairs)
+        slots = [Worker(self.ctx, self.loader, self.batch_size, self.cache) for _ in range(self.workers)]
+        todo = deque()          # windows waiting for a worker, retried ones first
+        done = {}               # first line -> tagged pairs, waiting for their turn
+        attempts = {}
+        next_line = 0
+        held = 0                # windows read and not yielded yet
+        exhausted = False
+
+        try:
+            while True:
+                # read ahead, bounded
+                while not exhausted and held < self.max_pending * self.workers:
+                    window = next(windows, None)
+                    if window is None:
+                        exhausted = True
+                    else:
+                        todo.append(window)
+                        held += 1
+
+                for worker in slots:
+                    if worker.ready and worker.task is None and todo:
+                        worker.task = todo.popleft()
+                        try:
+                            worker.conn.send(worker.task)
+                        except OSError:
+                            # died in the meantime, its sentinel hands the window out again
+                            pass
+
+                while next_line in done:
+                    tagged = done.pop(next_line)
+                    held -= 1
+                    next_line += len(tagged)
+                    yield from tagged
+
+                if exhausted and not held:
+                    break
+
+                ready = wait([worker.conn for worker in slots] + [worker.process.sentinel for worker in slots])
+                for slot, worker in enumerate(slots):
+                    if worker.conn in ready:
+                        try:
+                            kind, first_line, payload = worker.conn.recv()
+                        except EOFError:
+                            kind = "dead"
+                        if kind == "ready":
+                            worker.ready = True
+                            self.stats[slot].load += payload
+                            continue
+                        if kind == "done":
+                            tagged, seconds, cache_stats = payload
+                            self.cache_stats.update(cache_stats)
+                            done[first_line] = tagged
+                            attempts.pop(first_line, None)
+                            worker.task = None
+                            self.stats[slot].lines += len(tagged)
+                            self.stats[slot].windows += 1
+                            self.stats[slot].busy += seconds
+                            continue
+                        if kind == "error":
+                            where = "loading the model" if first_line is None else f"tagging the window at line {first_line:,}"
+                            raise RuntimeError(f"Worker {slot} failed {where}:\n{payload}")
+                    elif worker.process.sentinel not in ready:
+                        continue
+
+                    # the process died: its window goes back to the front of the queue and the slot gets a new worker
+                    worker.process.join()
+                    if worker.task is not None:
+                        first_line = worker.task[0]
+                        attempts[first_line] = attempts.get(first_line, 0) + 1
+                        if attempts[first_line] >= self.max_retries:
+                            raise RuntimeError(f"The window at line {first_line:,} killed {attempts[first_line]} workers, giving up")
+                        todo.appendleft(worker.task)
+                    print(f"Worker {slot} died (exit code {worker.process.exitcode}), restarting it")
+                    worker.task = None
+                    worker.stop()
+                    slots[slot] = Worker(self.ctx, self.loader, self.batch_size, self.cache)
+                    self.stats[slot].restarts += 1
+        finally:
+            for worker in slots:
+                worker.stop()
+
+    def report(self):
+        for slot, stats in enumerate(self.stats):
+            print(stats.report(slot))
+        lines = sum(stats.lines for stats in self.stats)
+        busy = sum(stats.busy for stats in self.stats)
+        print(f"total: {lines:,} lines, {busy:,.1f} worker seconds, {sum(stats.restarts for stats in self.stats)} restarts")
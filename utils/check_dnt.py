@@ -1,63 +1,261 @@
 #!/usr/bin/env python
 # coding: utf-8
 
-import argparse
+import os
 import re
-from collections import Counter
+import sys
+import json
+import heapq
+import bisect
+import hashlib
+import argparse
+from collections import Counter, deque
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from corpus_io import open_binary
+
+# the index of every DNT: "${dnt0} 3" is "${DNT0}3" once normalized
+DNT_PATTERN = re.compile('\\${DNT0}\\s*(\\d+)', flags=re.I)
+# same matches on ascii lines: str \s also covers \x1c-\x1f, bytes \d is already [0-9]
+DNT_PATTERN_BYTES = re.compile(rb'\$\{DNT0\}[ \t\n\r\f\v\x1c-\x1f]*(\d+)', flags=re.I)
+MISMATCH_TYPES = ("missing", "extra", "substituted")
+
 
 def list_intersection(b, a):
+    if a == b:
+        return list(a)
+    if not a or not b:
+        return []
     return list((Counter(a) & Counter(b)).elements())
 
+def find_dnts(line):
+    # sorted, normalized DNTs of a line: "${DNT0} 3" -> "${DNT0}3"
+    if b"{" not in line:
+        return []
+    if line.isascii():
+        dnts = ["${DNT0}" + index.decode() for index in DNT_PATTERN_BYTES.findall(line)]
+    else:
+        dnts = ["${DNT0}" + index for index in DNT_PATTERN.findall(line.decode('utf-8'))]
+    dnts.sort()
+    return dnts
+
+def dnt_index(dnt):
+    return dnt[len("${DNT0}"):]
+
+
+# ====== READING ====== #
+def read_lines(filename, block_size=1 << 22):
+    # lists of byte lines, split like text mode's universal newlines (\n, \r\n and \r)
+    with open_binary(filename, 'rb') as f:
+        rest = b""
+        while True:
+            block = f.read(block_size)
+            if block:
+                block = rest + block
+                cut = block.rfind(b"\n") + 1
+                if not cut:
+                    rest = block
+                    continue
+                block, rest = block[:cut], block[cut:]
+            elif rest:
+                block, rest = rest, b""
+            else:
+                break
+
+            if b"\r" in block:
+                block = block.replace(b"\r\n", b"\n").replace(b"\r", b"\n")
+            lines = block.split(b"\n")
+            if not lines[-1]:
+                lines.pop()
+            yield lines
+
+def read_chunks(files, chunk_size, paired=2):
+    # chunks of paired lines (one list per file), stops at the shortest of the first `paired` files like zip,
+    # the other files (--src) are padded with None when shorter
+    streams = [read_lines(filename) for filename in files]
+    buffers = [deque() for _ in files]
+    start = 0
+    while True:
+        for stream, buffer in zip(streams, buffers):
+            while len(buffer) < chunk_size:
+                lines = next(stream, None)
+                if lines is None:
+                    break
+                buffer.extend(lines)
+        size = min(chunk_size, *(len(buffer) for buffer in buffers[:paired]))
+        if not size:
+            break
+        yield start, [[buffer.popleft() if buffer else None for _ in range(size)] for buffer in buffers]
+        start += size
+
+
+# ====== EVALUATION ====== #
+def new_stats():
+    return {"lines": 0,
+            "missing_src": 0,
+            "rcount": 0,
+            "hcount": 0,
+            "mcount": 0,
+            "mismatched_lines": 0,
+            "mismatch_types": Counter(),
+            "missing_dnts": 0,
+            "extra_dnts": 0,
+            "per_index": {"ref": Counter(), "hyp": Counter(), "matching": Counter()},
+            "examples": []}
+
+def process_chunk(start, chunk, max_examples, seed):
+    stats = new_stats()
+    rlines, hlines = chunk[0], chunk[1]
+    slines = chunk[2] if len(chunk) > 2 else None
+
+    # DNTs of the whole chunk, counted once at the end
+    all_rdnt, all_hdnt, all_matching = [], [], []
+    for i, (rl, hl) in enumerate(zip(rlines, hlines), start=start):
+        rdnt = find_dnts(rl)
+        hdnt = find_dnts(hl)
+        if not rdnt and not hdnt:
+            continue
+        matching = list_intersection(rdnt, hdnt)
+        all_rdnt += rdnt
+        all_hdnt += hdnt
+        all_matching += matching
+
+        if not(rdnt == hdnt):
+            missing = len(rdnt) - len(matching)
+            extra = len(hdnt) - len(matching)
+            stats["mismatched_lines"] += 1
+            stats["missing_dnts"] += missing
+            stats["extra_dnts"] += extra
+            stats["mismatch_types"]["substituted" if missing and extra else "missing" if missing else "extra"] += 1
+
+            # bottom-k sample: the same lines are kept whatever the chunking
+            priority = hashlib.blake2b(f"{seed}:{i}".encode(), digest_size=8).digest()
+            examples = stats["examples"]
+            if len(examples) >= max_examples and (not examples or priority >= examples[-1][0]):
+                continue
+            example = {"line": i,
+                       "ref_dnts": rdnt,
+                       "hyp_dnts": hdnt,
+                       "ref": rl.decode('utf-8').strip(),
+                       "hyp": hl.decode('utf-8').strip()}
+            if slines is not None and slines[i - start] is not None:
+                example["src"] = slines[i - start].decode('utf-8').strip()
+            bisect.insort(examples, (priority, i, example))
+            del examples[max_examples:]
+
+    stats["lines"] = min(len(rlines), len(hlines))
+    stats["rcount"], stats["hcount"], stats["mcount"] = len(all_rdnt), len(all_hdnt), len(all_matching)
+    for key, dnts in (("ref", all_rdnt), ("hyp", all_hdnt), ("matching", all_matching)):
+        stats["per_index"][key].update(map(dnt_index, dnts))
+    stats["missing_src"] = slines.count(None) if slines is not None else 0
+    return stats
+
+def merge_stats(total, stats, max_examples):
+    for key in ("lines", "missing_src", "rcount", "hcount", "mcount", "mismatched_lines", "missing_dnts", "extra_dnts"):
+        total[key] += stats[key]
+    total["mismatch_types"].update(stats["mismatch_types"])
+    for key, counts in stats["per_index"].items():
+        total["per_index"][key].update(counts)
+    total["examples"] = heapq.nsmallest(max_examples, total["examples"] + stats["examples"])
+
+def run_chunks(chunks, workers, settings):
+    if workers <= 1:
+        for start, chunk in chunks:
+            yield process_chunk(start, chunk, *settings)
+        return
+
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for start, chunk in chunks:
+            pending.append(pool.submit(process_chunk, start, chunk, *settings))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+# ====== REPORT ====== #
+def ratio(a, b):
+    return round(a/b, 3) if b else None
+
+def make_report(stats):
+    per_index = stats["per_index"]
+    indexes = sorted(set(per_index["ref"]) | set(per_index["hyp"]), key=lambda k: (len(k), k))
+    return {"lines": stats["lines"],
+            "dnt_in_ref": stats["rcount"],
+            "dnt_in_hyp": stats["hcount"],
+            "matching_dnts": stats["mcount"],
+            "precision": ratio(stats["mcount"], stats["hcount"]),
+            "recall": ratio(stats["mcount"], stats["rcount"]),
+            "mismatched_lines": stats["mismatched_lines"],
+            "mismatch_types": {key: stats["mismatch_types"][key] for key in MISMATCH_TYPES},
+            "missing_dnts": stats["missing_dnts"],
+            "extra_dnts": stats["extra_dnts"],
+            "per_index": {index: {"ref": per_index["ref"][index],
+                                  "hyp": per_index["hyp"][index],
+                                  "matching": per_index["matching"][index],
+                                  "precision": ratio(per_index["matching"][index], per_index["hyp"][index]),
+                                  "recall": ratio(per_index["matching"][index], per_index["ref"][index])}
+                          for index in indexes},
+            "examples": [example for _, _, example in sorted(stats["examples"], key=lambda el: el[1])]}
+
+def print_example(example):
+    print()
+    print("[Error] DNTs do not match at line", example["line"])
+    print("--> Ref DNTs:", example["ref_dnts"])
+    print("--> Hyp DNTs:", example["hyp_dnts"])
+    if "src" in example:
+        print("Src:", example["src"])
+    print("Ref:", example["ref"])
+    print("Hyp:", example["hyp"])
+    print("\n ========= \n")
+
+
 def main():
 
     parser = argparse.ArgumentParser(description='Check DNT matching between reference and hypothesis. Works line by line.')
     parser.add_argument('--ref', help='reference file', required=True)
     parser.add_argument('--hyp', help='hypothesis file', required=True)
     parser.add_argument('--src', help='optional, source language file', default=argparse.SUPPRESS)
+    parser.add_argument('--report', help='optional, write the metrics as JSON to this file', default=None)
+    parser.add_argument('--max-examples', help='mismatching lines sampled and printed', type=int, default=20)
+    parser.add_argument('--seed', help='seed of the examples sample', type=int, default=0)
+    parser.add_argument('-w', '--workers', help='worker processes', type=int, default=1)
+    parser.add_argument('--chunk-size', help='lines sent to a worker at once', type=int, default=50_000)
     args = parser.parse_args()
 
-    with open(args.ref, encoding='utf-8') as r:
-        rlines = [line.strip() for line in r]
-    with open(args.hyp, encoding='utf-8') as h:
-        hlines = [line.strip() for line in h]
-    if "src" in args:
-        with open(args.src, encoding='utf-8') as s:
-            slines = [line.strip() for line in s]
-
-    rcount = 0
-    hcount = 0
-    mcount = 0
-    for i, (rl, hl) in enumerate(zip(rlines, hlines)):
-        rdnt = re.findall('\${DNT0}\s*\d+', rl, flags=re.I)
-        hdnt = re.findall('\${DNT0}\s*\d+', hl, flags=re.I)
-        rdnt = ["".join(elem.upper().split()) for elem in rdnt]
-        hdnt = ["".join(elem.upper().split()) for elem in hdnt]
-        rdnt.sort()
-        hdnt.sort()
-        rcount = rcount + len(rdnt)
-        hcount = hcount + len(hdnt)
-        mcount = mcount + len(list_intersection(rdnt, hdnt))
-        if not(rdnt == hdnt):
-            print()
-            print("[Error] DNTs do not match at line", i)
-            print("--> Ref DNTs:", rdnt)
-            print("--> Hyp DNTs:", hdnt)
-            if "src" in args:
-                print("Src:", slines[i])
-            print("Ref:", rl)
-            print("Hyp:", hl)
-            print("\n ========= \n")
-    
-    print("-- Summary --")
-    print("DNT in ref:", rcount)
-    print("DNT in hyp:", hcount)
-    print("Matching DNTs:", mcount)
-    print("Precision:", round(mcount/hcount, 3))
-    print("Recall:", round(mcount/rcount, 3))
+    files = [args.ref, args.hyp] + ([args.src] if "src" in args else [])
+    chunks = read_chunks(files, args.chunk_size)
 
-if __name__ == "__main__":
-    main()
+    stats = new_stats()
+    for chunk_stats in run_chunks(chunks, args.workers, (args.max_examples, args.seed)):
+        merge_stats(stats, chunk_stats, args.max_examples)
+    report = make_report(stats)
 
+    for example in report["examples"]:
+        print_example(example)
+    if report["mismatched_lines"] > len(report["examples"]):
+        print(f"... {len(report['examples'])} of {report['mismatched_lines']:,} mismatching lines shown\n")
 
+    if stats["missing_src"]:
+        print(f"[Warning] --src is {stats['missing_src']:,} lines shorter than --ref/--hyp, the metrics cover all {report['lines']:,} lines\n")
 
+    print("-- Mismatches --")
+    for key in MISMATCH_TYPES:
+        print(f"{key.capitalize()}:", report["mismatch_types"][key])
+    print()
 
+    print("-- Summary --")
+    print("DNT in ref:", report["dnt_in_ref"])
+    print("DNT in hyp:", report["dnt_in_hyp"])
+    print("Matching DNTs:", report["matching_dnts"])
+    print("Precision:", report["precision"])
+    print("Recall:", report["recall"])
+
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,11 @@
+import os
 import re
 import sys
 from collections import Counter
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from corpus_io import open_text
+
 file1 = sys.argv[1]
 file2 = sys.argv[2]
 to_int = isinstance(sys.argv[-1],int) if len(sys.argv) > 2 else 0
@@ -13,8 +17,8 @@ print(f" ... Parsing [{lng_src}] and [{lng_trg}] ... \n")
 dnt_count_f1 = 0
 dnt_count_f2 = 0
 
-with open(file1, "r") as f1, \
-     open(file2, "r") as f2:
+with open_text(file1, "r") as f1, \
+     open_text(file2, "r") as f2:
          
     counter_s = Counter()
     counter_t = Counter()
@@ -1,34 +1,170 @@
+import os
+import sys
+import math
 import random
+import struct
 import argparse
+import tempfile
+from itertools import zip_longest, islice
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from corpus_io import open_binary, estimated_size, add_suffix
 
-def main(source, target):
+RECORD = struct.Struct("<II")
 
-    with (open(source, "r") as s,
-          open(target, "r") as t,
-          open("res_src", "w") as o_s,
-          open("res_trg", "w") as o_t):
-        
-        src = s.readlines()
-        trg = t.readlines()
 
-        res = list(zip(src, trg))
-        random.shuffle(res)
+def read_pairs(source, target):
+    # (source line, target line) as bytes, raises if the corpora do not have the same length
+    with open_binary(source, "rb") as s, open_binary(target, "rb") as t:
+        for i, (src_line, trg_line) in enumerate(zip_longest(s, t)):
+            if src_line is None or trg_line is None:
+                shorter = source if src_line is None else target
+                raise ValueError(f"{shorter} ends at line {i:,}, the corpora must have the same number of lines")
+            # the last line may miss its newline, it won't stay the last one
+            yield (src_line if src_line.endswith(b"\n") else src_line + b"\n",
+                   trg_line if trg_line.endswith(b"\n") else trg_line + b"\n")
 
-        for i, (src_sentence, trg_sentence) in enumerate(res):
-            o_s.write(src_sentence)
-            o_t.write(trg_sentence)
 
-            if i % 500_000 == 0:
-                print(f"Iteration: {i:,}")
+# ====== BUCKETS ====== #
+def memory_factor(source, target, sample = 10_000):
+    """
+    Bytes a pair takes once loaded, per byte on disk, measured on the first `sample` pairs:
+    two bytes objects in a tuple referenced by a list. Short lines cost several times their length.
+    """
+    loaded = size = 0
+    for src_line, trg_line in islice(read_pairs(source, target), sample):
+        pair = (src_line, trg_line)
+        loaded += sys.getsizeof(src_line) + sys.getsizeof(trg_line) + sys.getsizeof(pair) + 8
+        size += len(src_line) + len(trg_line)
+    return loaded / size if size else 1
+
+def write_buckets(pairs, n_buckets, directory, rng):
+    # every pair goes to a random bucket, source and target in the same record; the buckets are closed once written
+    names, buckets = [], []
+    try:
+        for _ in range(n_buckets):
+            fd, name = tempfile.mkstemp(dir = directory)
+            names.append(name)
+            buckets.append(os.fdopen(fd, "wb"))
+        for src_line, trg_line in pairs:
+            bucket = buckets[rng.randrange(n_buckets)]
+            bucket.write(RECORD.pack(len(src_line), len(trg_line)))
+            bucket.write(src_line)
+            bucket.write(trg_line)
+    finally:
+        for bucket in buckets:
+            bucket.close()
+    return names
+
+def read_bucket(name):
+    # whole bucket in memory
+    with open(name, "rb") as f:
+        data = f.read()
+    os.remove(name)
+
+    res, k = [], 0
+    while k < len(data):
+        src_length, trg_length = RECORD.unpack_from(data, k)
+        k += RECORD.size
+        res.append((data[k: k + src_length], data[k + src_length: k + src_length + trg_length]))
+        k += src_length + trg_length
+    return res
+
+def stream_bucket(name):
+    # record by record, for buckets that are split again
+    with open(name, "rb") as f:
+        while header := f.read(RECORD.size):
+            src_length, trg_length = RECORD.unpack(header)
+            yield f.read(src_length), f.read(trg_length)
+    os.remove(name)
+
+def shuffle_buckets(pairs, n_buckets, max_open, directory, rng):
+    # at most `max_open` buckets per pass, the ones still too big for memory are split again
+    fan_out = min(n_buckets, max_open)
+    for name in write_buckets(pairs, fan_out, directory, rng):
+        if fan_out == n_buckets:
+            res = read_bucket(name)
+            rng.shuffle(res)
+            yield from res
+        else:
+            yield from shuffle_buckets(stream_bucket(name), math.ceil(n_buckets / fan_out), max_open, directory, rng)
+
+def shuffled_pairs(source, target, memory, tmp_dir, rng, max_open = 256):
+    """
+    External shuffle: pairs are spread over random buckets small enough to be shuffled in
+    memory, then the buckets are shuffled and emitted one after the other. With more buckets
+    than `max_open` the split takes several passes, so open files stay bounded.
+    """
+    size = estimated_size(source) + estimated_size(target)
+    factor = memory_factor(source, target)
+
+    if size * factor <= memory:
+        res = list(read_pairs(source, target))
+        rng.shuffle(res)
+        yield from res
+        return
+
+    # a bucket is read whole before its pairs are made, both are in memory at once
+    n_buckets = math.ceil(size * (factor + 1) / memory)
+    with tempfile.TemporaryDirectory(dir = tmp_dir) as directory:
+        yield from shuffle_buckets(read_pairs(source, target), n_buckets, max(2, max_open), directory, rng)
+
+
+def main(source, target, out_src = "res_src", out_trg = "res_trg", seed = None, dev_size = 0, test_size = 0, memory = 512 << 20, tmp_dir = None, max_open = 256):
+
+    rng = random.Random(seed)
+
+    # the first shuffled lines make the dev and test sets, the rest is the train set
+    splits = [(dev_size, add_suffix(out_src, ".dev"), add_suffix(out_trg, ".dev")),
+              (test_size, add_suffix(out_src, ".test"), add_suffix(out_trg, ".test")),
+              (math.inf, out_src, out_trg)]
+
+    pairs = shuffled_pairs(source, target, memory, tmp_dir, rng, max_open)
+    i = 0
+    for size, split_src, split_trg in splits:
+        if not size:
+            continue
+
+        with open_binary(split_src, "wb") as o_s, open_binary(split_trg, "wb") as o_t:
+            written = 0
+            for src_sentence, trg_sentence in pairs:
+                o_s.write(src_sentence)
+                o_t.write(trg_sentence)
+
+                if i % 500_000 == 0:
+                    print(f"Iteration: {i:,}")
+                i += 1
+
+                written += 1
+                if written == size:
+                    break
+
+        print(f"{split_src}, {split_trg} -> {written:,} lines")
 
 
 if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description="Make pavlov corpora suitable for Fast Align")
+    parser = argparse.ArgumentParser(description="Shuffle parallel corpora keeping source and target lines paired")
     parser.add_argument("-s", help = "Path to source DNTs file")
     parser.add_argument("-t", help = "Path to target DNTs file")
+    parser.add_argument("--out-src", help = "Shuffled source output", default = "res_src")
+    parser.add_argument("--out-trg", help = "Shuffled target output", default = "res_trg")
+    parser.add_argument("--seed", help = "Random seed, for reproducible shuffles", default = None)
+    parser.add_argument("--dev-size", help = "Lines written to <out>.dev", default = 0)
+    parser.add_argument("--test-size", help = "Lines written to <out>.test", default = 0)
+    parser.add_argument("-m", "--memory", help = "Memory budget in MB, bigger corpora are shuffled through temporary buckets", default = 512)
+    parser.add_argument("--tmp-dir", help = "Folder for the temporary buckets", default = None)
+    parser.add_argument("--max-open-files", help = "Buckets written at once, more buckets are split in several passes", default = 256)
 
 
     args = parser.parse_args()
 
-    main(args.s, args.t)
\ No newline at end of file
+    main(args.s,
+         args.t,
+         args.out_src,
+         args.out_trg,
+         int(args.seed) if args.seed is not None else None,
+         int(args.dev_size),
+         int(args.test_size),
+         int(args.memory) << 20,
+         args.tmp_dir,
+         int(args.max_open_files))